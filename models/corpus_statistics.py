@@ -0,0 +1,272 @@
+"""Columnar statistics of the MaintIE corpora
+
+
+Notes
+-----
+- A single pass over the records collects entity mentions, relation triples, record sizes and token n-grams into
+  Arrow tables, which are written as Parquet files and can be queried interactively, e.g.
+
+```python
+from corpus_statistics import CorpusStatistics
+
+stats = CorpusStatistics.load("./data/s-statistics")
+stats.type_counts(level=1, split="train")
+stats.top_ngrams(n=2, k=10)
+```
+
+- Mentions carry the type of every level of the entity hierarchy, so per-level counts need no further pass.
+- Requires `pyarrow` (part of the REBEL requirements).
+"""
+
+import argparse
+import json
+import os
+from collections import Counter
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from create_datasets import ONTOLOGY_PATH, OntologyTable
+
+TABLES = ("records", "mentions", "relations", "ngrams")
+
+
+def _split_filter(table: pa.Table, split: str = None) -> pa.Table:
+    return table if split is None else table.filter(pc.equal(table["split"], split))
+
+
+def _count_by(table: pa.Table, columns: list, unique_columns: list = None) -> pa.Table:
+    """Counts the rows per value of `columns` (distinct values of `unique_columns` if given), most frequent first"""
+    if unique_columns:
+        table = table.group_by(columns + unique_columns).aggregate([])
+    counts = table.group_by(columns).aggregate([([], "count_all")])
+    counts = counts.select(columns + ["count_all"]).rename_columns(columns + ["count"])
+    return counts.sort_by([("count", "descending")] + [(c, "ascending") for c in columns])
+
+
+class CorpusStatistics:
+    """
+    Arrow tables of a (split) MaintIE corpus.
+
+    Tables:
+    - records: split, record, token_count, entity_count, relation_count, count (collapsed duplicates).
+    - mentions: split, record, start, end, size, text, type, type_level_1, type_level_2, type_level_3.
+    - relations: split, record, relation, head_text, head_type, tail_text, tail_type.
+    - ngrams: split, n, ngram, frequency (of the lowercased tokens).
+    """
+
+    def __init__(self, tables: dict):
+        self.tables = tables
+
+    @classmethod
+    def from_splits(
+        cls, splits: dict, ontology_table: OntologyTable, max_ngram: int = 3
+    ) -> "CorpusStatistics":
+        """
+        Builds the tables in a single pass over the records.
+
+        Parameters:
+        - splits (dict): Records (with full entity type names) per split name, e.g. {"train": [...], ...}.
+        - ontology_table (OntologyTable): The entity type hierarchy, used to add the type of every level.
+        - max_ngram (int): The maximum length of the counted token n-grams.
+
+        Returns:
+        - CorpusStatistics: The statistics of all splits.
+        """
+
+        records = {
+            k: []
+            for k in (
+                "split",
+                "record",
+                "token_count",
+                "entity_count",
+                "relation_count",
+                "count",
+            )
+        }
+        mentions = {
+            k: []
+            for k in ("split", "record", "start", "end", "size", "text", "type")
+            + tuple(f"type_level_{level}" for level in OntologyTable.LEVELS)
+        }
+        relations = {
+            k: []
+            for k in (
+                "split",
+                "record",
+                "relation",
+                "head_text",
+                "head_type",
+                "tail_text",
+                "tail_type",
+            )
+        }
+        ngrams = Counter()
+
+        for split, data in splits.items():
+            for record, item in enumerate(data):
+                tokens = item["tokens"]
+                entities = item["entities"]
+                type_ids = ontology_table.type_ids(entities)
+
+                records["split"].append(split)
+                records["record"].append(record)
+                records["token_count"].append(len(tokens))
+                records["entity_count"].append(len(entities))
+                records["relation_count"].append(len(item["relations"]))
+                records["count"].append(item.get("count", 1))
+
+                # entity end index is not inclusive (the statistics of create_datasets before this module
+                # sliced up to end + 1, i.e. one token too many, which inflated the unique mention counts)
+                texts = [" ".join(tokens[e["start"] : e["end"]]) for e in entities]
+
+                for e, text, type_id in zip(entities, texts, type_ids):
+                    mentions["split"].append(split)
+                    mentions["record"].append(record)
+                    mentions["start"].append(e["start"])
+                    mentions["end"].append(e["end"])
+                    mentions["size"].append(e["end"] - e["start"])
+                    mentions["text"].append(text)
+                    mentions["type"].append(e["type"])
+                    for level in OntologyTable.LEVELS:
+                        mentions[f"type_level_{level}"].append(
+                            ontology_table.level_fullnames[level][type_id]
+                        )
+
+                for r in item["relations"]:
+                    relations["split"].append(split)
+                    relations["record"].append(record)
+                    relations["relation"].append(r["type"])
+                    relations["head_text"].append(texts[r["head"]])
+                    relations["head_type"].append(entities[r["head"]]["type"])
+                    relations["tail_text"].append(texts[r["tail"]])
+                    relations["tail_type"].append(entities[r["tail"]]["type"])
+
+                lowered = [t.lower() for t in tokens]
+                for n in range(1, max_ngram + 1):
+                    ngrams.update(
+                        (split, n, " ".join(lowered[i : i + n]))
+                        for i in range(len(lowered) - n + 1)
+                    )
+
+        ngram_columns = list(zip(*ngrams.keys())) if ngrams else [[], [], []]
+        tables = {
+            "records": pa.table(records),
+            "mentions": pa.table(mentions),
+            "relations": pa.table(relations),
+            "ngrams": pa.table(
+                {
+                    "split": pa.array(ngram_columns[0], pa.string()),
+                    "n": pa.array(ngram_columns[1], pa.int32()),
+                    "ngram": pa.array(ngram_columns[2], pa.string()),
+                    "frequency": pa.array(list(ngrams.values()), pa.int64()),
+                }
+            ),
+        }
+        return cls(tables)
+
+    def save(self, path: str) -> None:
+        """Writes every table as `<path>/<table>.parquet`"""
+        os.makedirs(path, exist_ok=True)
+        for name, table in self.tables.items():
+            pq.write_table(table, os.path.join(path, f"{name}.parquet"))
+
+    @classmethod
+    def load(cls, path: str) -> "CorpusStatistics":
+        return cls({name: pq.read_table(os.path.join(path, f"{name}.parquet")) for name in TABLES})
+
+    def split_sizes(self) -> pa.Table:
+        """Number of records (and of records including collapsed duplicates) per split"""
+        return (
+            self.tables["records"]
+            .group_by(["split"])
+            .aggregate([([], "count_all"), ("count", "sum")])
+            .select(["split", "count_all", "count_sum"])
+            .rename_columns(["split", "records", "records_with_duplicates"])
+        )
+
+    def type_counts(self, level: int = None, split: str = None, unique: bool = False) -> pa.Table:
+        """
+        Entity mentions per type.
+
+        Parameters:
+        - level (int, optional): The level of the entity hierarchy (1-3), full types if not given.
+        - split (str, optional): Only count the mentions of this split.
+        - unique (bool): Count distinct mention texts instead of mentions.
+
+        Returns:
+        - pa.Table: The columns "type" and "count", most frequent type first.
+        """
+        column = "type" if level is None else f"type_level_{level}"
+        counts = _count_by(
+            _split_filter(self.tables["mentions"], split),
+            [column],
+            ["text"] if unique else None,
+        )
+        return counts.rename_columns(["type", "count"])
+
+    def relation_counts(self, split: str = None, unique: bool = False) -> pa.Table:
+        """Relation triples per relation type (distinct (head, relation, tail) texts if `unique`)"""
+        return _count_by(
+            _split_filter(self.tables["relations"], split),
+            ["relation"],
+            ["head_text", "tail_text"] if unique else None,
+        )
+
+    def top_ngrams(self, n: int = 1, k: int = 20, split: str = None) -> pa.Table:
+        """The `k` most frequent token n-grams (over all splits if `split` is not given)"""
+        table = _split_filter(self.tables["ngrams"], split)
+        table = table.filter(pc.equal(table["n"], n))
+        counts = table.group_by(["ngram"]).aggregate([("frequency", "sum")])
+        counts = counts.select(["ngram", "frequency_sum"]).rename_columns(["ngram", "frequency"])
+        return counts.sort_by([("frequency", "descending"), ("ngram", "ascending")]).slice(0, k)
+
+    def mentions_of(self, type_name: str, level: int = None, split: str = None) -> pa.Table:
+        """The mentions of an entity type (of the given level of the entity hierarchy)"""
+        column = "type" if level is None else f"type_level_{level}"
+        table = _split_filter(self.tables["mentions"], split)
+        return table.filter(pc.equal(table[column], type_name))
+
+    def summary(self) -> str:
+        """Split sizes and total/unique mention counts per top level type and relation counts per split"""
+        lines = [str(self.split_sizes().to_pylist())]
+        for split in self.tables["records"]["split"].unique().to_pylist():
+            lines.append(f"\n{split.upper()}")
+            for label, counts in (
+                ("Total", self.type_counts(level=1, split=split)),
+                ("Unique", self.type_counts(level=1, split=split, unique=True)),
+                ("Relations total", self.relation_counts(split=split)),
+                ("Relations unique", self.relation_counts(split=split, unique=True)),
+            ):
+                lines.append(f"{label}: {dict(zip(*counts.to_pydict().values()))}")
+        return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument(
+        "corpus",
+        type=str,
+        nargs="+",
+        help="Corpus or split files (e.g. ../data/silver_release.json or ./data/g-3/maintie_*.json)",
+    )
+    arg_parser.add_argument("--output", type=str, help="Directory of the Parquet tables")
+    arg_parser.add_argument("--max_ngram", type=int, default=3, help="Maximum token n-gram length")
+    args = arg_parser.parse_args()
+
+    with open(ONTOLOGY_PATH, "r") as f:
+        ontology_table = OntologyTable(json.load(f)["entity"])
+
+    splits = {}
+    for path in args.corpus:
+        with open(path, "r") as f:
+            splits[os.path.splitext(os.path.basename(path))[0]] = json.load(f)
+
+    statistics = CorpusStatistics.from_splits(splits, ontology_table, max_ngram=args.max_ngram)
+    print(statistics.summary())
+
+    if args.output:
+        statistics.save(args.output)
+        print(f"Saved tables in {args.output}")
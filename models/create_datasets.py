@@ -19,8 +19,9 @@ Example
 ```
 """
 
-import copy
+import argparse
 from collections import Counter
+import hashlib
 import json
 import random
 import os
@@ -43,17 +44,17 @@ def flatten_nested(data):
     - data (list): A list of dictionaries, where each dictionary can have a key 'children' with a nested list.
 
     Returns:
-    - list: A flattened list of dictionaries without the nested 'children' structures.
+    - list: A flattened list of dictionaries without the nested 'children' structures (the input is not modified).
     """
 
     flattened = []
 
     for item in data:
         # Extract item's children if present, or set to an empty list
-        children = item.pop("children", [])
+        children = item.get("children", [])
 
-        # Add the current item to the flattened list
-        flattened.append(item)
+        # Add (a copy of) the current item without its children to the flattened list
+        flattened.append({k: v for k, v in item.items() if k != "children"})
 
         # If the item had children, flatten them recursively
         if children:
@@ -117,11 +118,225 @@ def get_substring_by_level(s, level):
     return "/".join(parts[:level])
 
 
-def main(silver_corpus: bool = False):
+class OntologyTable:
+    """
+    Integer indexed entity type hierarchy of the ontology, built once and shared by all entity levels.
+
+    Attributes:
+    - fullnames (list): The full name of every type id, e.g. "PhysicalObject/SensingObject".
+    - names (list): The short name of every type id, e.g. "SensingObject".
+    - ids (dict): The type id of every full name.
+    - ancestors (dict): For every level, the type id of the ancestor at that level of every type id (the type
+      itself if it is not deeper than the level, see `get_substring_by_level`).
+    - level_fullnames (dict): For every level, the full name of the ancestor at that level of every type id.
+    """
+
+    LEVELS = (1, 2, 3)
+
+    def __init__(self, entity_ontology: list):
+        flattened = flatten_nested(entity_ontology)
+
+        self.fullnames = [e["fullname"] for e in flattened]
+        self.names = [e["name"] for e in flattened]
+        self.ids = {fullname: i for i, fullname in enumerate(self.fullnames)}
+
+        self.ancestors = {
+            level: [
+                self.ids[get_substring_by_level(fullname, level=level)]
+                for fullname in self.fullnames
+            ]
+            for level in self.LEVELS
+        }
+        self.level_fullnames = {
+            level: [self.fullnames[i] for i in ancestors]
+            for level, ancestors in self.ancestors.items()
+        }
+
+    def type_ids(self, entities: list) -> list:
+        """Returns the type ids of the given entities (with full type names)"""
+        try:
+            return [self.ids[e["type"]] for e in entities]
+        except KeyError as e:
+            raise ValueError(f"Entity type {e} is not part of the ontology ({ONTOLOGY_PATH})")
+
+    def level_type_ids(self, level: int) -> list:
+        """Returns the ids of the types of the given level (in ontology order)"""
+        return sorted(set(self.ancestors[level]))
+
+
+def collapse_exact_duplicates(data):
+    """
+    Collapses records with identical tokens into a single record with a "count" of the occurrences.
+
+    Parameters:
+    - data (list): Records with "tokens", "entities" and "relations".
+
+    Returns:
+    - list: One record per distinct token sequence (in order of first occurrence). If duplicates are annotated
+      differently, the most frequent annotation is kept.
+    """
+
+    groups = {}
+    for item in data:
+        groups.setdefault(tuple(item["tokens"]), []).append(item)
+
+    collapsed = []
+    for items in groups.values():
+        annotations = Counter(
+            json.dumps([item["entities"], item["relations"]], sort_keys=True)
+            for item in items
+        )
+        entities, relations = json.loads(annotations.most_common(1)[0][0])
+        collapsed.append(
+            {
+                "tokens": items[0]["tokens"],
+                "entities": entities,
+                "relations": relations,
+                "count": len(items),
+            }
+        )
+
+    return collapsed
+
+
+def get_shingles(tokens: list) -> set:
+    """Returns the (lowercased) token unigrams and bigrams of a record"""
+    tokens = [t.lower() for t in tokens]
+    return set(tokens) | {" ".join(tokens[i : i + 2]) for i in range(len(tokens) - 1)}
+
+
+def minhash_signature(shingles: set, permutations: list) -> tuple:
+    """Returns the MinHash signature of a set of shingles, one minimum per (a, b) hash permutation"""
+    prime = (1 << 61) - 1
+    hashes = [
+        int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=8).digest(), "big")
+        for shingle in shingles
+    ] or [0]
+    return tuple(min((a * h + b) % prime for h in hashes) for a, b in permutations)
+
+
+def find_near_duplicate_groups(
+    data, threshold: float = 0.8, num_perm: int = 64, bands: int = 16
+):
+    """
+    Groups near-duplicate records, i.e. records whose token shingles have a Jaccard similarity of at least
+    `threshold`. Candidates are found with MinHash locality sensitive hashing (`bands` bands of
+    `num_perm / bands` rows) and verified with the exact similarity.
+
+    Parameters:
+    - data (list): Records with "tokens".
+    - threshold (float): Minimum Jaccard similarity of near-duplicates.
+    - num_perm (int): Number of MinHash permutations.
+    - bands (int): Number of LSH bands.
+
+    Returns:
+    - list: The group index of every record (records without near-duplicates have their own group).
+    """
+
+    rng = random.Random(SEED)
+    prime = (1 << 61) - 1
+    permutations = [(rng.randrange(1, prime), rng.randrange(0, prime)) for _ in range(num_perm)]
+    rows = num_perm // bands
+
+    shingles = [get_shingles(item["tokens"]) for item in data]
+    signatures = [minhash_signature(s, permutations) for s in shingles]
+
+    # union-find over verified candidate pairs
+    parents = list(range(len(data)))
+
+    def find(i):
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    for band in range(bands):
+        buckets = {}
+        for i, signature in enumerate(signatures):
+            buckets.setdefault(signature[band * rows : (band + 1) * rows], []).append(i)
+
+        for candidates in buckets.values():
+            for j in candidates[1:]:
+                i = candidates[0]
+                root_i, root_j = find(i), find(j)
+                if root_i == root_j:
+                    continue
+                similarity = len(shingles[i] & shingles[j]) / len(shingles[i] | shingles[j])
+                if similarity >= threshold:
+                    parents[root_j] = root_i
+
+    roots = {}
+    return [roots.setdefault(find(i), len(roots)) for i in range(len(data))]
+
+
+def deduplicate(data, near_duplicate_threshold: float = 0.8):
+    """
+    Collapses exact duplicates into one record with a "count" (used as sample weight by SpERT and REBEL) and
+    assigns near-duplicates a shared "group", so that splitting keeps them in the same split.
+
+    Parameters:
+    - data (list): Records with "tokens", "entities" and "relations".
+    - near_duplicate_threshold (float): Minimum Jaccard similarity of near-duplicates.
+
+    Returns:
+    - list: The deduplicated records.
+    """
+
+    collapsed = collapse_exact_duplicates(data)
+    groups = find_near_duplicate_groups(collapsed, threshold=near_duplicate_threshold)
+
+    for item, group in zip(collapsed, groups):
+        item["group"] = group
+
+    print(
+        f"DEDUPLICATION: {len(data)} records, {len(collapsed)} distinct "
+        f"({1 - len(collapsed) / len(data):.1%} removed), {len(set(groups))} near-duplicate groups"
+    )
+
+    return collapsed
+
+
+def split_by_groups(data, train_ratio: float = 0.8, dev_ratio: float = 0.1):
+    """
+    Splits records into train, dev and test data without separating records of the same "group".
+
+    Parameters:
+    - data (list): Records with a "group".
+    - train_ratio (float): Proportion of train records.
+    - dev_ratio (float): Proportion of dev records.
+
+    Returns:
+    - tuple: The train, dev and test records.
+    """
+
+    groups = {}
+    for item in data:
+        groups.setdefault(item["group"], []).append(item)
+
+    # same order for every call (and therefore every entity level)
+    group_order = list(groups)
+    random.Random(SEED).shuffle(group_order)
+
+    splits = ([], [], [])
+    train_size, dev_size = train_ratio * len(data), (train_ratio + dev_ratio) * len(data)
+    size = 0
+    for group in group_order:
+        split = 0 if size < train_size else 1 if size < dev_size else 2
+        splits[split].extend(groups[group])
+        size += len(groups[group])
+
+    return splits
+
+
+def main(
+    silver_corpus: bool = False,
+    deduplicate_corpus: bool = False,
+    near_duplicate_threshold: float = 0.8,
+):
     print("CREATING DATASETS WITH NORMALISED INPUTS")
     print(f'USING {"SILVER" if silver_corpus else "GOLD"} CORPUS')
 
-    folder_prefix = ""  # "c2t-"
+    folder_prefix = "dedup-" if deduplicate_corpus else ""  # "c2t-"
     dataset_type = "s" if silver_corpus else "g"  # g - gold, s - silver
 
     with open(SILVER_CORPUS_PATH if silver_corpus else GOLD_CORPUS_PATH, "r") as f:
@@ -155,10 +370,25 @@ def main(silver_corpus: bool = False):
     # Shuffle and save the data
     random.shuffle(data)
 
-    # Create untyped dataset (*2t-^-0)
+    if deduplicate_corpus:
+        output_data = deduplicate(
+            output_data, near_duplicate_threshold=near_duplicate_threshold
+        )
+
+    # Load the ontology once
+    with open(ONTOLOGY_PATH, "r") as f:
+        ontology = json.load(f)
+
+    ontology_table = OntologyTable(ontology["entity"])
+    relation_types = flatten_nested(ontology["relation"])
+
+    # Create untyped (*2t-^-0) and multi-level datasets (*2t-^-1/2/3) in one pass
     # For SpERT, a single sentinel token is used in place of all entities, "Entity"
     untyped_dataset = []
+    multi_level_datasets = {_level: [] for _level in OntologyTable.LEVELS}
     for item in output_data:
+        type_ids = ontology_table.type_ids(item["entities"])
+
         # Convert entity classes into single type
         untyped_dataset.append(
             {
@@ -173,38 +403,35 @@ def main(silver_corpus: bool = False):
             }
         )
 
-    # Create multi-level datasets (*2t-^-1/2/3)
-    multi_level_datasets = {}
-    for _level in [1, 2, 3]:
-        multi_level_datasets[_level] = []
-        for item in output_data:
-            # Truncate entity classes based on level...
-            multi_level_datasets[_level].append(
+        # Truncate entity classes based on level (table lookup)
+        for _level, _dataset in multi_level_datasets.items():
+            level_fullnames = ontology_table.level_fullnames[_level]
+            _dataset.append(
                 {
                     **item,
                     "entities": [
                         {
                             **e,
-                            "type": get_substring_by_level(e["type"], level=_level),
+                            "type": level_fullnames[type_id],
                         }
-                        for e in item["entities"]
+                        for e, type_id in zip(item["entities"], type_ids)
                     ],
                 }
             )
 
-    # Create "_types.json"
-    with open(ONTOLOGY_PATH, "r") as f:
-        ontology = json.load(f)
-
     def split_and_save_datasets(data, folder_name: str):
-        # Determine the split indices
-        train_split_idx = int(0.8 * len(data))
-        dev_split_idx = int(0.9 * len(data))
-
-        # Split the data into 80%, 10%, and 10% portions
-        train_data = data[:train_split_idx]
-        dev_data = data[train_split_idx:dev_split_idx]
-        test_data = data[dev_split_idx:]
+        if deduplicate_corpus:
+            # Split the data into 80%, 10%, and 10% portions, keeping near-duplicates together
+            train_data, dev_data, test_data = split_by_groups(data)
+        else:
+            # Determine the split indices
+            train_split_idx = int(0.8 * len(data))
+            dev_split_idx = int(0.9 * len(data))
+
+            # Split the data into 80%, 10%, and 10% portions
+            train_data = data[:train_split_idx]
+            dev_data = data[train_split_idx:dev_split_idx]
+            test_data = data[dev_split_idx:]
 
         datasets = {"train": train_data, "dev": dev_data, "test": test_data}
 
@@ -224,24 +451,15 @@ def main(silver_corpus: bool = False):
     def create_and_save_entity_type_data(
         folder_name: str, level: int = None, untyped: bool = False
     ):
-        _entity_ontology = copy.deepcopy(ontology["entity"])
-        _relation_ontology = copy.deepcopy(ontology["relation"])
-
-        entitie_types = {e["fullname"]: e for e in flatten_nested(_entity_ontology)}
-
         if level:
-            unique_entitie_types = {
-                get_substring_by_level(e_fullname, level=_level)
-                for e_fullname in entitie_types.keys()
-            }
             entities = {
-                entitie_types[e_fullame]["fullname"]: {
-                    "short": entitie_types[e_fullame]["name"],
-                    "verbose": entitie_types[e_fullame]["fullname"],
+                ontology_table.fullnames[type_id]: {
+                    "short": ontology_table.names[type_id],
+                    "verbose": ontology_table.fullnames[type_id],
                 }
-                for e_fullame in unique_entitie_types
+                for type_id in ontology_table.level_type_ids(level)
             }
-            print("unique_entitie_types", len(unique_entitie_types))
+            print("unique_entitie_types", len(entities))
 
         if untyped:
             entities = {
@@ -259,7 +477,7 @@ def main(silver_corpus: bool = False):
                     "verbose": r["fullname"],
                     "symmetric": False,
                 }
-                for r in flatten_nested(_relation_ontology)
+                for r in relation_types
             },
         }
 
@@ -289,80 +507,6 @@ def main(silver_corpus: bool = False):
                 indent=2,
             )
 
-    def aggregate_annotations(data):
-        """Aggregates entities and relations"""
-        all_entities = []  # (ngram, type)
-        all_relations = []  # (head, relation, tail)
-
-        for di in data:
-            tokens = di["tokens"]
-            entities = di["entities"]
-
-            formatted_entities = [
-                (" ".join(tokens[e["start"] : e["end"] + 1]), e["type"])
-                for e in entities
-            ]
-            relations = di.get("relations")
-            formatted_relations = []
-            if relations:
-                formatted_relations = [
-                    (
-                        (
-                            " ".join(
-                                tokens[
-                                    entities[r["head"]]["start"] : entities[r["head"]][
-                                        "end"
-                                    ]
-                                    + 1
-                                ]
-                            )
-                        ),
-                        r["type"],
-                        (
-                            " ".join(
-                                tokens[
-                                    entities[r["tail"]]["start"] : entities[r["tail"]][
-                                        "end"
-                                    ]
-                                    + 1
-                                ]
-                            )
-                        ),
-                    )
-                    for r in relations
-                ]
-
-            all_entities.extend(formatted_entities)
-            all_relations.extend(formatted_relations)
-
-        return all_entities, all_relations
-
-    def get_split_annotation_distributions(data):
-        """Returns the distribution of splits"""
-
-        for split, _data in data.items():
-            print(split, len(_data))
-            # print(_data[0])
-
-            _entities, _relations = aggregate_annotations(_data)
-
-            _entity_counts = Counter(_entities)
-            # print(_entity_counts)
-            _top_level_entities = [(i[0], i[1].split("/")[0]) for i in _entities]
-            # print(_top_level_entities)
-            _unique_counts = Counter(
-                [j[1] for j in set(i for i in _top_level_entities)]
-            )
-            _total_counts = Counter([i[1] for i in _top_level_entities])
-
-            print(f"Total: {_total_counts}\nUnique: {_unique_counts}")
-
-            total_counts = Counter([i[1] for i in _relations])
-            unique_counts = Counter([i[1] for i in set(_relations)])
-            print(f"\nRELATIONS\nTotal: {total_counts}\nUniuqe: {unique_counts}")
-
-            # return counts, unique_counts, total_counts
-
     # Create untyped dataset
     split_and_save_datasets(
         data=untyped_dataset,
@@ -373,7 +517,7 @@ def main(silver_corpus: bool = False):
     )
 
     # Create multi-level datasets
-    for _level in [1, 2, 3]:
+    for _level in OntologyTable.LEVELS:
         # print(f"Processing dataset level: {_level}")
 
         _dataset = multi_level_datasets[_level]
@@ -387,13 +531,42 @@ def main(silver_corpus: bool = False):
             level=_level,
         )
 
-        # Output metrics on splits
-        get_split_annotation_distributions(data=_split_datasets)
+    # Output metrics on splits (single pass, mentions carry the types of all levels)
+    try:
+        from corpus_statistics import CorpusStatistics
+    except ImportError:
+        print("Split statistics require pyarrow, see corpus_statistics.py")
+    else:
+        statistics = CorpusStatistics.from_splits(_split_datasets, ontology_table)
+        print(statistics.summary())
+        statistics.save(f"./{DATA_DIR}/{folder_prefix}{dataset_type}-statistics")
 
 
 if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument(
+        "--deduplicate",
+        action="store_true",
+        help="Collapse duplicate records (with a count used as sample weight) and keep near-duplicates in the "
+        "same split. Datasets are written to 'dedup-' prefixed folders",
+    )
+    arg_parser.add_argument(
+        "--near_duplicate_threshold",
+        type=float,
+        default=0.8,
+        help="Minimum Jaccard similarity of the token uni- and bigrams of near-duplicate records",
+    )
+    args = arg_parser.parse_args()
+
     # USE TO CREATE C2T DATASETS
-    main()
+    main(
+        deduplicate_corpus=args.deduplicate,
+        near_duplicate_threshold=args.near_duplicate_threshold,
+    )
 
     # Create silver C2T training dataset
-    main(silver_corpus=True)
+    main(
+        silver_corpus=True,
+        deduplicate_corpus=args.deduplicate,
+        near_duplicate_threshold=args.near_duplicate_threshold,
+    )
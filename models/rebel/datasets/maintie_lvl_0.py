@@ -76,6 +76,7 @@ class MAINTIE(datasets.GeneratorBasedBuilder):
                     "title": datasets.Value("string"),
                     "context": datasets.Value("string"),
                     "triplets": datasets.Value("string"),
+                    "weight": datasets.Value("float32"),
                 }
             ),
             # No default supervised_keys (as we have to pass both question
@@ -195,4 +196,6 @@ class MAINTIE(datasets.GeneratorBasedBuilder):
                     "context": text,
                     "id": str(id_),
                     "triplets": triplets,
+                    # number of collapsed duplicates (deduplicated datasets)
+                    "weight": float(row.get("count", 1)),
                 }
@@ -0,0 +1,234 @@
+import argparse
+import importlib.util
+import json
+import time
+
+import torch
+from transformers import AutoTokenizer, LogitsProcessorList
+from transformers.models.bart.configuration_bart import BartConfig
+
+from constrained_decoding import MaintieTripletGrammar, TrieGuidedDecoder
+from modeling_bart import BartForConditionalGeneration
+
+
+def add_common_args(arg_parser: argparse.ArgumentParser) -> None:
+    arg_parser.add_argument("--samples", type=int, default=64, help="Number of (synthetic or dataset) source sequences")
+    arg_parser.add_argument("--batch_size", type=int, default=8, help="Batch size")
+    arg_parser.add_argument("--max_source_length", type=int, default=64, help="Source sequence length")
+    arg_parser.add_argument("--val_max_target_length", type=int, default=64, help="Maximum generated length")
+    arg_parser.add_argument("--eval_beams", type=int, default=3, help="Number of beams")
+    arg_parser.add_argument("--d_model", type=int, default=256, help="Hidden size of the (random) model")
+    arg_parser.add_argument("--layers", type=int, default=3, help="Encoder and decoder layers of the (random) model")
+    arg_parser.add_argument("--vocab_size", type=int, default=50272, help="Vocabulary size")
+    arg_parser.add_argument("--repeat", type=int, default=3, help="Timed passes over the data")
+    arg_parser.add_argument("--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu")
+    arg_parser.add_argument("--seed", type=int, default=42, help="Seed")
+
+
+def add_checkpoint_args(arg_parser: argparse.ArgumentParser) -> None:
+    arg_parser.add_argument(
+        "--model_path", type=str, default=None, help="Trained model and tokenizer (see model_saving.py)"
+    )
+    arg_parser.add_argument(
+        "--dataset_path", type=str, default=None, help="Split of the dataset, e.g. maintie_dev.json"
+    )
+    arg_parser.add_argument(
+        "--dataset_name", type=str, default=None, help="Dataset script of the level, e.g. datasets/maintie_lvl_3.py"
+    )
+
+
+def create_model(args: argparse.Namespace) -> BartForConditionalGeneration:
+    """Randomly initialized (small) BART model, no download required"""
+    config = BartConfig(
+        vocab_size=args.vocab_size,
+        d_model=args.d_model,
+        encoder_layers=args.layers,
+        decoder_layers=args.layers,
+        encoder_attention_heads=max(args.d_model // 64, 1),
+        decoder_attention_heads=max(args.d_model // 64, 1),
+        encoder_ffn_dim=args.d_model * 4,
+        decoder_ffn_dim=args.d_model * 4,
+        max_position_embeddings=max(args.max_source_length, args.val_max_target_length),
+        decoder_start_token_id=0,
+        forced_bos_token_id=None,
+        forced_eos_token_id=None,
+    )
+    return BartForConditionalGeneration(config).to(args.device).eval()
+
+
+def run_generation(model: BartForConditionalGeneration, batches: list, args: argparse.Namespace, **kwargs):
+    generated = []
+
+    with torch.no_grad():
+        for input_ids in batches:
+            generated.append(
+                model.generate(
+                    input_ids,
+                    attention_mask=torch.ones_like(input_ids),
+                    max_length=args.val_max_target_length,
+                    # decode the full length so both settings generate the same number of tokens
+                    min_length=args.val_max_target_length,
+                    early_stopping=False,
+                    length_penalty=0,
+                    no_repeat_ngram_size=0,
+                    num_beams=args.eval_beams,
+                    **kwargs,
+                )
+            )
+
+    return generated
+
+
+def kv_cache(args: argparse.Namespace) -> None:
+    torch.manual_seed(args.seed)
+    model = create_model(args)
+
+    batches = [
+        torch.randint(4, args.vocab_size, (args.batch_size, args.max_source_length), device=args.device)
+        for _ in range(0, args.samples, args.batch_size)
+    ]
+
+    settings = [
+        ("concatenated cache", {}),
+        ("static cache", {"static_cache_length": args.val_max_target_length}),
+    ]
+    results = {}
+
+    for label, kwargs in settings:
+        # warm up
+        outputs = run_generation(model, batches[:1], args, **kwargs)
+
+        if args.device.startswith("cuda"):
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+
+        for _ in range(args.repeat):
+            outputs = run_generation(model, batches, args, **kwargs)
+
+        if args.device.startswith("cuda"):
+            torch.cuda.synchronize()
+        elapsed = time.perf_counter() - start
+
+        # tokens generated per sequence, excluding the decoder start token
+        token_count = args.repeat * sum(o.shape[0] * (o.shape[1] - 1) for o in outputs)
+        results[label] = (outputs, token_count / elapsed)
+
+    identical = all(
+        torch.equal(a, b) for a, b in zip(results["concatenated cache"][0], results["static cache"][0])
+    )
+
+    print(
+        f"Beam search generation ({args.device}, {args.samples} samples, batch size {args.batch_size}, "
+        f"eval_beams={args.eval_beams}, val_max_target_length={args.val_max_target_length})"
+    )
+    print("%24s %16s" % ("setting", "tokens/s"))
+    for label, (_, tokens_per_second) in results.items():
+        print("%24s %16.1f" % (label, tokens_per_second))
+    print(
+        "speed up: %.2fx, identical outputs: %s"
+        % (results["static cache"][1] / results["concatenated cache"][1], identical)
+    )
+
+
+def _type_tokens(dataset_name: str) -> list:
+    """Entity type tokens of the linearization of a MaintIE dataset script (none for the untyped level 0)"""
+    spec = importlib.util.spec_from_file_location("maintie_dataset", dataset_name)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return list(getattr(module, "mapping_types", {}).values())
+
+
+def _well_formed(grammar: MaintieTripletGrammar, tokens: list, source_ids: list, pad_token_id: int) -> bool:
+    """True if every generated token (after the decoder start token) is allowed by the grammar"""
+    parsed = grammar.step(grammar.initial_state(), tokens[0])
+    for i, token_id in enumerate(tokens[1:], start=1):
+        if token_id not in grammar.allowed_token_ids_after(parsed, source_ids):
+            return False
+        if token_id == grammar.eos_token_id:
+            return all(t == pad_token_id for t in tokens[i + 1 :])
+        parsed = grammar.step(parsed, token_id)
+    return True
+
+
+def _strip(tokens: list, pad_token_id: int) -> list:
+    while tokens and tokens[-1] == pad_token_id:
+        tokens = tokens[:-1]
+    return tokens
+
+
+def constrained_decoding(args: argparse.Namespace) -> None:
+    """
+    Regression check of the triplet grammar against a trained checkpoint: for the sources whose unconstrained
+    output is well-formed, grammar constrained beam search must generate the same tokens as beam search, and trie
+    guided decoding the same tokens as greedy search.
+    """
+    tokenizer = AutoTokenizer.from_pretrained(args.model_path)
+    model = BartForConditionalGeneration.from_pretrained(args.model_path).to(args.device).eval()
+    grammar = MaintieTripletGrammar(tokenizer, type_tokens=_type_tokens(args.dataset_name))
+    pad_token_id = model.config.pad_token_id
+
+    with open(args.dataset_path) as dataset_file:
+        sources = [" ".join(row["tokens"]) for row in json.load(dataset_file)][: args.samples]
+
+    counts = {"beam search": [0, 0], "greedy": [0, 0]}
+    with torch.no_grad():
+        for start in range(0, len(sources), args.batch_size):
+            inputs = tokenizer(
+                sources[start : start + args.batch_size],
+                max_length=args.max_source_length,
+                padding=True,
+                truncation=True,
+                return_tensors="pt",
+            ).to(args.device)
+            gen_kwargs = {
+                "max_length": args.val_max_target_length,
+                "early_stopping": False,
+                "length_penalty": 0,
+                "no_repeat_ngram_size": 0,
+            }
+
+            outputs = {
+                "beam search": model.generate(**inputs, num_beams=args.eval_beams, **gen_kwargs),
+                "constrained": model.generate(
+                    **inputs,
+                    num_beams=args.eval_beams,
+                    logits_processor=LogitsProcessorList(
+                        [grammar.logits_processor(inputs["input_ids"], args.eval_beams)]
+                    ),
+                    **gen_kwargs,
+                ),
+                "greedy": model.generate(**inputs, num_beams=1, **gen_kwargs),
+                "trie": TrieGuidedDecoder(grammar).generate(
+                    model, inputs["input_ids"], inputs["attention_mask"], args.val_max_target_length
+                ),
+            }
+            outputs = {label: o.tolist() for label, o in outputs.items()}
+
+            for i, source in enumerate(inputs["input_ids"].tolist()):
+                source_ids = grammar.source_token_ids(source)
+                for reference, guided in [("beam search", "constrained"), ("greedy", "trie")]:
+                    expected = _strip(outputs[reference][i], pad_token_id)
+                    if _well_formed(grammar, expected, source_ids, pad_token_id):
+                        counts[reference][0] += 1
+                        counts[reference][1] += expected == _strip(outputs[guided][i], pad_token_id)
+
+    print(f"Grammar guided decoding ({args.model_path}, {len(sources)} sources, eval_beams={args.eval_beams})")
+    print("%24s %16s %16s" % ("setting", "well-formed", "identical"))
+    for (reference, (well_formed, identical)), guided in zip(counts.items(), ["constrained", "trie"]):
+        print("%24s %16s %16s" % (f"{guided} vs {reference}", well_formed, identical))
+
+
+BENCHMARKS = {
+    "kv_cache": kv_cache,
+    "constrained_decoding": constrained_decoding,
+}
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("benchmark", type=str, choices=list(BENCHMARKS))
+    add_common_args(arg_parser)
+    add_checkpoint_args(arg_parser)
+    args = arg_parser.parse_args()
+
+    BENCHMARKS[args.benchmark](args)
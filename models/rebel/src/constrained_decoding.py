@@ -0,0 +1,366 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import torch
+from transformers import LogitsProcessor, PreTrainedTokenizer
+
+# Relation phrases of the linearized MaintIE triplets (see `mapping` in `datasets/maintie_lvl_*.py`)
+MAINTIE_RELATIONS = [
+    "is a",
+    "contains",
+    "has part",
+    "has participant",
+    "has patient",
+    "has agent",
+    "has property",
+]
+
+# Decoding states of the linearization
+# `<triplet> HEAD <head type> TAIL <tail type> RELATION (<head type> TAIL <tail type> RELATION)*`
+START, HEAD, TAIL, RELATION = range(4)
+
+# Trie key marking the end of a complete relation phrase
+TERMINAL = -1
+
+
+class MaintieTripletGrammar:
+    """
+    Token level grammar of the linearized MaintIE triplets.
+
+    Parameters:
+    - tokenizer (PreTrainedTokenizer): The (byte-level BPE) tokenizer of the model, including the added marker tokens.
+    - type_tokens (List[str], optional): The entity type tokens of the active level, e.g. "<physical object>".
+      If not given, the untyped (level 0) linearization with "<subj>" and "<obj>" markers is used.
+    - relations (List[str]): The relation phrases that may follow a tail type.
+
+    Notes
+    -----
+    - Head and tail spans may only copy subwords of the source, see `source_token_ids`.
+    - "</s>" is allowed in every state so that `max_length` forcing of `generate` keeps working. Incomplete
+      triplets at the end of a sequence are dropped by `extract_maintie_triplets_typed` / `extract_triplets`.
+    - Prefixes start with the decoder start token. As the targets are tokenized with a leading "<s>", the first
+      generated token may also be "<s>" (besides "<triplet>" and "</s>").
+    """
+
+    def __init__(
+        self,
+        tokenizer: PreTrainedTokenizer,
+        type_tokens: Optional[List[str]] = None,
+        relations: List[str] = MAINTIE_RELATIONS,
+    ):
+        self.tokenizer = tokenizer
+        self.triplet_token_id = tokenizer.convert_tokens_to_ids("<triplet>")
+        self.bos_token_id = tokenizer.bos_token_id
+        self.eos_token_id = tokenizer.eos_token_id
+
+        if type_tokens:
+            self.head_type_ids = set(tokenizer.convert_tokens_to_ids(type_tokens))
+            self.tail_type_ids = self.head_type_ids
+        else:
+            self.head_type_ids = {tokenizer.convert_tokens_to_ids("<subj>")}
+            self.tail_type_ids = {tokenizer.convert_tokens_to_ids("<obj>")}
+
+        self.relation_trie = self._build_trie(relations)
+
+        # tokens that are skipped when parsing a prefix and never copied from the source
+        self._skip_ids = {tokenizer.bos_token_id, tokenizer.pad_token_id}
+        self._structural_ids = (
+            self._skip_ids
+            | self.head_type_ids
+            | self.tail_type_ids
+            | {self.triplet_token_id, self.eos_token_id}
+        )
+        self._space_variants: Dict[int, Optional[int]] = {}
+
+    def _build_trie(self, phrases: Iterable[str]) -> dict:
+        trie = {}
+        for phrase in phrases:
+            # relation phrases follow a type token and may or may not be tokenized with a leading space
+            for text in {phrase, " " + phrase}:
+                node = trie
+                for token_id in self.tokenizer.encode(text, add_special_tokens=False):
+                    node = node.setdefault(token_id, {})
+                node[TERMINAL] = {}
+        return trie
+
+    def _space_variant(self, token_id: int) -> Optional[int]:
+        """Returns the id of the same subword with (or without) the byte-level BPE leading space marker"""
+        if token_id not in self._space_variants:
+            token = self.tokenizer.convert_ids_to_tokens(token_id)
+            variant = token[1:] if token.startswith("Ġ") else "Ġ" + token
+            variant_id = self.tokenizer.convert_tokens_to_ids(variant)
+            self._space_variants[token_id] = (
+                None if variant_id == self.tokenizer.unk_token_id else variant_id
+            )
+        return self._space_variants[token_id]
+
+    def source_token_ids(self, input_ids: List[int]) -> List[int]:
+        """Returns the subword ids that may be copied from the given source into head and tail spans"""
+        token_ids = set(input_ids) - self._structural_ids
+        variants = {self._space_variant(token_id) for token_id in token_ids}
+        return sorted((token_ids | variants) - {None} - self._structural_ids)
+
+    @staticmethod
+    def initial_state() -> Tuple[int, int, Optional[dict]]:
+        """Returns the state, length of the current span (START: of the prefix) and relation trie node of an empty
+        prefix"""
+        return START, 0, None
+
+    def step(self, parsed: Tuple[int, int, Optional[dict]], token_id: int) -> Tuple[int, int, Optional[dict]]:
+        """Returns the parse state after appending `token_id` to a prefix with the given parse state"""
+        state, span_length, node = parsed
+
+        if state == START and token_id != self.triplet_token_id:
+            # decoder start token and "<s>"
+            span_length += 1
+        elif token_id in self._skip_ids:
+            pass
+        elif token_id == self.triplet_token_id:
+            state, span_length = HEAD, 0
+        elif state == HEAD and span_length > 0 and token_id in self.head_type_ids:
+            state, span_length = TAIL, 0
+        elif state == TAIL and span_length > 0 and token_id in self.tail_type_ids:
+            state, node = RELATION, self.relation_trie
+        elif state == RELATION:
+            if token_id in node:
+                node = node[token_id]
+            elif TERMINAL in node and token_id in self.head_type_ids:
+                # further tail of the same head
+                state, span_length = TAIL, 0
+        else:
+            span_length += 1
+
+        return state, span_length, node
+
+    def parse(self, tokens: List[int]) -> Tuple[int, int, Optional[dict]]:
+        """Returns the state, length of the current span and relation trie node after the given prefix (starting
+        with the decoder start token)"""
+        parsed = self.initial_state()
+        for token_id in tokens:
+            parsed = self.step(parsed, token_id)
+        return parsed
+
+    def forced_token_id(self, parsed: Tuple[int, int, Optional[dict]]) -> Optional[int]:
+        """Returns the only possible continuation of an incomplete relation phrase, None if there is a choice"""
+        state, _, node = parsed
+        if state == RELATION and len(node) == 1 and TERMINAL not in node:
+            return next(iter(node))
+        return None
+
+    def allowed_token_ids(self, tokens: List[int], source_ids: List[int]) -> List[int]:
+        """Returns the ids of the tokens that may follow the given prefix"""
+        return self.allowed_token_ids_after(self.parse(tokens), source_ids)
+
+    def allowed_token_ids_after(self, parsed: Tuple[int, int, Optional[dict]], source_ids: List[int]) -> List[int]:
+        """Returns the ids of the tokens that may follow a prefix with the given parse state"""
+        state, span_length, node = parsed
+        allowed = [self.eos_token_id]
+
+        if state == START:
+            allowed.append(self.triplet_token_id)
+            if span_length == 1:
+                # "<s>" of the tokenized target after the decoder start token
+                allowed.append(self.bos_token_id)
+        elif state == HEAD:
+            allowed.extend(source_ids)
+            if span_length > 0:
+                allowed.extend(self.head_type_ids)
+        elif state == TAIL:
+            allowed.extend(source_ids)
+            if span_length > 0:
+                allowed.extend(self.tail_type_ids)
+        else:
+            allowed.extend(token_id for token_id in node if token_id != TERMINAL)
+            if TERMINAL in node:
+                allowed.append(self.triplet_token_id)
+                allowed.extend(self.head_type_ids)
+
+        return allowed
+
+    def logits_processor(self, input_ids: torch.Tensor, num_beams: int) -> "MaintieTripletLogitsProcessor":
+        return MaintieTripletLogitsProcessor(self, input_ids, num_beams)
+
+
+class MaintieTripletLogitsProcessor(LogitsProcessor):
+    """
+    Restricts the scores of each beam to the tokens allowed by a `MaintieTripletGrammar`.
+
+    The parse state of each beam is extended by the last token only, looked up by the prefix of the previous step
+    (beams are reordered and duplicated between steps), and the source subwords are applied as precomputed masks.
+
+    Parameters:
+    - grammar (MaintieTripletGrammar): The grammar of the linearization.
+    - input_ids (torch.Tensor): The (not beam expanded) source input ids of the batch.
+    - num_beams (int): The number of beams per source.
+    """
+
+    def __init__(self, grammar: MaintieTripletGrammar, input_ids: torch.Tensor, num_beams: int):
+        self.grammar = grammar
+        self.num_beams = num_beams
+        self.source_ids = [grammar.source_token_ids(row) for row in input_ids.tolist()]
+        self._source_masks = None
+        # parse states of the prefixes of the previous step
+        self._states: Dict[Tuple[int, ...], Tuple[int, int, Optional[dict]]] = {}
+
+    def _parse_state(self, prefix: Tuple[int, ...]) -> Tuple[int, int, Optional[dict]]:
+        parsed = self._states.get(prefix[:-1])
+        if parsed is None:
+            return self.grammar.parse(prefix)
+        return self.grammar.step(parsed, prefix[-1])
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        if self._source_masks is None:
+            self._source_masks = torch.zeros(
+                [len(self.source_ids), scores.shape[-1]], dtype=torch.bool, device=scores.device
+            )
+            for source, token_ids in enumerate(self.source_ids):
+                self._source_masks[source, token_ids] = True
+
+        states = {}
+        copy_rows, copy_sources = [], []
+        rows, token_ids = [], []
+        for row, tokens in enumerate(input_ids.tolist()):
+            prefix = tuple(tokens)
+            if prefix not in states:
+                states[prefix] = self._parse_state(prefix)
+            parsed = states[prefix]
+
+            if parsed[0] in (HEAD, TAIL):
+                copy_rows.append(row)
+                copy_sources.append(row // self.num_beams)
+            allowed = self.grammar.allowed_token_ids_after(parsed, [])
+            rows.extend([row] * len(allowed))
+            token_ids.extend(allowed)
+        self._states = states
+
+        allowed_mask = torch.zeros_like(scores, dtype=torch.bool)
+        if copy_rows:
+            allowed_mask[copy_rows] = self._source_masks[copy_sources]
+        allowed_mask[rows, token_ids] = True
+
+        return scores.masked_fill(~allowed_mask, float("-inf"))
+
+
+class TrieGuidedDecoder:
+    """
+    Greedy decoding of linearized MaintIE triplets that follows a `MaintieTripletGrammar`.
+
+    - The `lm_head` projection is only computed over the tokens allowed for each sequence (source subwords, type
+      tokens or the continuations in the relation trie) instead of the whole vocabulary.
+    - Deterministic continuations, i.e. relation phrase subwords without an alternative, are appended without being
+      predicted. If every unfinished sequence of the batch has such a continuation, the forced tokens are fed to the
+      decoder in bulk, so that several positions are processed in a single decoder step.
+    """
+
+    def __init__(self, grammar: MaintieTripletGrammar):
+        self.grammar = grammar
+
+    @staticmethod
+    def _restricted_argmax(
+        hidden_states: torch.Tensor,
+        allowed: List[List[int]],
+        weight: torch.Tensor,
+        bias: Optional[torch.Tensor],
+    ) -> List[int]:
+        # pad with the first allowed token of each row, duplicates do not change the argmax
+        width = max(len(token_ids) for token_ids in allowed)
+        index = torch.tensor(
+            [token_ids + token_ids[:1] * (width - len(token_ids)) for token_ids in allowed],
+            device=hidden_states.device,
+        )
+
+        logits = torch.einsum("bd,bkd->bk", hidden_states, weight[index])
+        if bias is not None:
+            logits = logits + bias[0, index]
+
+        return index.gather(1, logits.argmax(-1, keepdim=True)).squeeze(1).tolist()
+
+    @torch.no_grad()
+    def generate(
+        self,
+        model,
+        input_ids: torch.Tensor,
+        attention_mask: torch.Tensor,
+        max_length: int,
+    ) -> torch.Tensor:
+        """
+        Generates the linearized triplets of a batch.
+
+        Parameters:
+        - model (BartForConditionalGeneration): The (transformers or vendored) BART model.
+        - input_ids (torch.Tensor): The source input ids.
+        - attention_mask (torch.Tensor): The source attention mask.
+        - max_length (int): The maximum length of the generated sequences (including the decoder start token).
+
+        Returns:
+        - torch.Tensor: The generated token ids, starting with the decoder start token (like `generate`).
+        """
+        grammar = self.grammar
+        config = model.config
+        batch_size = input_ids.shape[0]
+
+        encoder_hidden_states = model.get_encoder()(
+            input_ids=input_ids, attention_mask=attention_mask, return_dict=True
+        ).last_hidden_state
+        source_ids = [grammar.source_token_ids(row) for row in input_ids.tolist()]
+
+        weight = model.get_output_embeddings().weight
+        bias = getattr(model, "final_logits_bias", None)
+
+        sequences = [[config.decoder_start_token_id] for _ in range(batch_size)]
+        states = [
+            grammar.step(grammar.initial_state(), config.decoder_start_token_id)
+            for _ in range(batch_size)
+        ]
+        finished = [False] * batch_size
+        past_key_values = None
+        # number of trailing tokens of each sequence that have not been fed to the decoder yet
+        pending = 1
+
+        while not all(finished) and len(sequences[0]) < max_length:
+            outputs = model.get_decoder()(
+                input_ids=torch.tensor(
+                    [sequence[-pending:] for sequence in sequences], device=input_ids.device
+                ),
+                encoder_hidden_states=encoder_hidden_states,
+                encoder_attention_mask=attention_mask,
+                past_key_values=past_key_values,
+                use_cache=True,
+                return_dict=True,
+            )
+            past_key_values = outputs.past_key_values
+
+            allowed = [
+                [config.pad_token_id]
+                if finished[i]
+                else grammar.allowed_token_ids_after(states[i], source_ids[i])
+                for i in range(batch_size)
+            ]
+            next_tokens = self._restricted_argmax(
+                outputs.last_hidden_state[:, -1], allowed, weight, bias
+            )
+
+            for i, token_id in enumerate(next_tokens):
+                sequences[i].append(token_id)
+                if not finished[i]:
+                    states[i] = grammar.step(states[i], token_id)
+                    finished[i] = token_id == config.eos_token_id
+            pending = 1
+
+            # bulk append deterministic continuations while all unfinished sequences have one
+            while not all(finished) and len(sequences[0]) < max_length:
+                forced = [
+                    None if finished[i] else grammar.forced_token_id(states[i])
+                    for i in range(batch_size)
+                ]
+                if any(forced[i] is None for i in range(batch_size) if not finished[i]):
+                    break
+
+                for i, token_id in enumerate(forced):
+                    if finished[i]:
+                        sequences[i].append(config.pad_token_id)
+                    else:
+                        sequences[i].append(token_id)
+                        states[i] = grammar.step(states[i], token_id)
+                pending += 1
+
+        return torch.tensor(sequences, device=input_ids.device)
@@ -44,7 +44,7 @@ from transformers.modeling_outputs import (
 )
 from transformers.modeling_utils import PreTrainedModel
 from transformers.utils import logging
-from transformers.models.configuration_bart import BartConfig
+from transformers.models.bart.configuration_bart import BartConfig
 
 
 logger = logging.get_logger(__name__)
@@ -124,6 +124,84 @@ class BartLearnedPositionalEmbedding(nn.Embedding):
         return super().forward(positions + self.offset)
 
 
+class BartStaticCache:
+    """
+    Preallocated, fixed-capacity decoder self-attention cache for incremental decoding.
+
+    The keys and values of all decoder layers are stored in a single time-major buffer of shape :obj:`(max_length, 2
+    * num_layers, batch_size, num_heads, head_dim)`. New positions are written in place (no :obj:`torch.cat` per
+    step) and beams are reordered with a single :obj:`index_select` over the filled part of the buffer. The
+    cross-attention keys/values are identical for all beams of a sample and are therefore never reordered.
+    """
+
+    def __init__(self, num_layers: int, max_length: int):
+        self.num_layers = num_layers
+        self.max_length = max_length
+        self.length = 0
+        self.cross_attention = [None] * num_layers
+
+        # allocated lazily, once the (beam expanded) batch size is known
+        self._buffer = None
+        self._spare = None
+
+    def __getitem__(self, idx: int):
+        return BartStaticLayerCache(self, idx)
+
+    def __len__(self):
+        return self.num_layers
+
+    def update(self, layer_idx: int, key_states: torch.Tensor, value_states: torch.Tensor):
+        """Writes :obj:`(batch, heads, tgt_len, head_dim)` key/value states of a layer at the current position and
+        returns the keys/values of all cached positions (views into the buffer)"""
+        bsz, num_heads, tgt_len, head_dim = key_states.shape
+
+        if self._buffer is None:
+            shape = (self.max_length, 2 * self.num_layers, bsz, num_heads, head_dim)
+            self._buffer = key_states.new_empty(shape)
+            self._spare = key_states.new_empty(shape)
+
+        end = self.length + tgt_len
+        if end > self.max_length:
+            raise ValueError(f"Static cache capacity exceeded ({end} > max_length={self.max_length})")
+
+        self._buffer[self.length : end, 2 * layer_idx] = key_states.permute(2, 0, 1, 3)
+        self._buffer[self.length : end, 2 * layer_idx + 1] = value_states.permute(2, 0, 1, 3)
+
+        key_states = self._buffer[:end, 2 * layer_idx].permute(1, 2, 0, 3)
+        value_states = self._buffer[:end, 2 * layer_idx + 1].permute(1, 2, 0, 3)
+        return key_states, value_states
+
+    def advance(self, tgt_len: int):
+        self.length += tgt_len
+
+    def reorder(self, beam_idx: torch.Tensor):
+        if self._buffer is None or self.length == 0:
+            return
+
+        # single gather over all layers, keys and values, written into the spare buffer which then becomes active
+        torch.index_select(self._buffer[: self.length], 2, beam_idx, out=self._spare[: self.length])
+        self._buffer, self._spare = self._spare, self._buffer
+
+
+class BartStaticLayerCache:
+    """View of a single decoder layer of a :class:`BartStaticCache`"""
+
+    def __init__(self, cache: BartStaticCache, layer_idx: int):
+        self.cache = cache
+        self.layer_idx = layer_idx
+
+    def update(self, key_states: torch.Tensor, value_states: torch.Tensor):
+        return self.cache.update(self.layer_idx, key_states, value_states)
+
+    @property
+    def cross_attention(self):
+        return self.cache.cross_attention[self.layer_idx]
+
+    @cross_attention.setter
+    def cross_attention(self, value):
+        self.cache.cross_attention[self.layer_idx] = value
+
+
 class BartAttention(nn.Module):
     """Multi-headed attention from 'Attention Is All You Need' paper"""
 
@@ -181,6 +259,11 @@ class BartAttention(nn.Module):
             # cross_attentions
             key_states = self._shape(self.k_proj(key_value_states), -1, bsz)
             value_states = self._shape(self.v_proj(key_value_states), -1, bsz)
+        elif isinstance(past_key_value, BartStaticLayerCache):
+            # write k, v in place into the preallocated cache and attend over all cached positions
+            key_states, value_states = past_key_value.update(
+                self._shape(self.k_proj(hidden_states), -1, bsz), self._shape(self.v_proj(hidden_states), -1, bsz)
+            )
         elif past_key_value is not None:
             # reuse k, v, self_attention
             key_states = self._shape(self.k_proj(hidden_states), -1, bsz)
@@ -200,12 +283,14 @@ class BartAttention(nn.Module):
             # all previous decoder key/value_states. Further calls to uni-directional self-attention
             # can concat previous decoder key/value_states to current projected key/value_states (third "elif" case)
             # if encoder bi-directional self-attention `past_key_value` is always `None`
-            past_key_value = (key_states, value_states)
+            # a static cache already holds the key/value_states and is passed on as is
+            if not isinstance(past_key_value, BartStaticLayerCache):
+                past_key_value = (key_states, value_states)
 
         proj_shape = (bsz * self.num_heads, -1, self.head_dim)
         query_states = self._shape(query_states, tgt_len, bsz).view(*proj_shape)
-        key_states = key_states.view(*proj_shape)
-        value_states = value_states.view(*proj_shape)
+        key_states = key_states.reshape(*proj_shape)
+        value_states = value_states.reshape(*proj_shape)
 
         src_len = key_states.size(1)
         attn_weights = torch.bmm(query_states, key_states.transpose(1, 2))
@@ -389,10 +474,14 @@ class BartDecoderLayer(nn.Module):
                 returned tensors for more detail.
         """
         residual = hidden_states
+        static_cache = isinstance(past_key_value, BartStaticLayerCache)
 
         # Self Attention
         # decoder uni-directional self-attention cached key/values tuple is at positions 1,2
-        self_attn_past_key_value = past_key_value[:2] if past_key_value is not None else None
+        if static_cache:
+            self_attn_past_key_value = past_key_value
+        else:
+            self_attn_past_key_value = past_key_value[:2] if past_key_value is not None else None
         # add present self-attn cache to positions 1,2 of present_key_value tuple
         hidden_states, self_attn_weights, present_key_value = self.self_attn(
             hidden_states=hidden_states,
@@ -412,7 +501,10 @@ class BartDecoderLayer(nn.Module):
             residual = hidden_states
 
             # cross_attn cached key/values tuple is at positions 3,4 of present_key_value tuple
-            cross_attn_past_key_value = past_key_value[-2:] if past_key_value is not None else None
+            if static_cache:
+                cross_attn_past_key_value = past_key_value.cross_attention
+            else:
+                cross_attn_past_key_value = past_key_value[-2:] if past_key_value is not None else None
             hidden_states, cross_attn_weights, cross_attn_present_key_value = self.encoder_attn(
                 hidden_states=hidden_states,
                 key_value_states=encoder_hidden_states,
@@ -426,7 +518,10 @@ class BartDecoderLayer(nn.Module):
             hidden_states = self.encoder_attn_layer_norm(hidden_states)
 
             # add cross-attn to positions 3,4 of present_key_value tuple
-            present_key_value = present_key_value + cross_attn_present_key_value
+            if static_cache:
+                past_key_value.cross_attention = cross_attn_present_key_value
+            else:
+                present_key_value = present_key_value + cross_attn_present_key_value
 
         # Fully Connected
         residual = hidden_states
@@ -964,7 +1059,11 @@ class BartDecoder(BartPretrainedModel):
             raise ValueError("You have to specify either decoder_input_ids or decoder_inputs_embeds")
 
         # past_key_values_length
-        past_key_values_length = past_key_values[0][0].shape[2] if past_key_values is not None else 0
+        static_cache = isinstance(past_key_values, BartStaticCache)
+        if static_cache:
+            past_key_values_length = past_key_values.length
+        else:
+            past_key_values_length = past_key_values[0][0].shape[2] if past_key_values is not None else 0
 
         if inputs_embeds is None:
             inputs_embeds = self.embed_tokens(input_ids) * self.embed_scale
@@ -1062,6 +1161,11 @@ class BartDecoder(BartPretrainedModel):
             all_hidden_states += (hidden_states,)
 
         next_cache = next_decoder_cache if use_cache else None
+        if static_cache:
+            # all layers have written their key/value_states, the cache itself is passed on to the next step
+            past_key_values.advance(input_shape[-1])
+            next_cache = past_key_values if use_cache else None
+
         if not return_dict:
             return tuple(
                 v
@@ -1325,11 +1429,20 @@ class BartForConditionalGeneration(BartPretrainedModel):
         head_mask=None,
         use_cache=None,
         encoder_outputs=None,
+        past_key_values=None,
+        static_cache_length=None,
         **kwargs
     ):
+        # newer versions of `generate` pass the cache as `past_key_values`
+        if past is None:
+            past = past_key_values
+
         # cut decoder_input_ids if past is used
         if past is not None:
             decoder_input_ids = decoder_input_ids[:, -1:]
+        elif static_cache_length is not None and use_cache is not False:
+            # first step: preallocate the cache for up to `static_cache_length` decoder positions
+            past = BartStaticCache(self.config.decoder_layers, static_cache_length)
 
         return {
             "input_ids": None,  # encoder_outputs is defined. input_ids not needed
@@ -1346,6 +1459,10 @@ class BartForConditionalGeneration(BartPretrainedModel):
 
     @staticmethod
     def _reorder_cache(past, beam_idx):
+        if isinstance(past, BartStaticCache):
+            past.reorder(beam_idx)
+            return past
+
         reordered_past = ()
         for layer_past in past:
             # cached cross_attention states don't have to be reordered -> they are always the same
@@ -15,6 +15,8 @@ from transformers import (
     set_seed,
 )
 
+from samplers import MaxTokensBatchSampler, SortishSampler, padding_ratio
+
 
 class BasePLDataModule(pl.LightningDataModule):
     """
@@ -165,37 +167,102 @@ class BasePLDataModule(pl.LightningDataModule):
             )
 
     def train_dataloader(self, *args, **kwargs) -> DataLoader:
-        return DataLoader(
+        return self._dataloader(
             self.train_dataset,
+            "train",
             batch_size=self.conf.train_batch_size,
-            # sampler=train_sampler,
-            collate_fn=self.data_collator,
-            drop_last=self.conf.dataloader_drop_last,
-            num_workers=self.conf.dataloader_num_workers,
-            pin_memory=self.conf.dataloader_pin_memory,
+            max_tokens=self.conf.get("max_tokens"),
+            group_by_length=self.conf.group_by_length or self.conf.sortish_sampler,
             shuffle=True,
         )
 
     def val_dataloader(self, *args, **kwargs) -> Union[DataLoader, List[DataLoader]]:
-        return DataLoader(
+        return self._dataloader(
             self.eval_dataset,
+            "validation",
             batch_size=self.conf.eval_batch_size,
-            # sampler=train_sampler,
-            collate_fn=self.data_collator,
-            drop_last=self.conf.dataloader_drop_last,
-            num_workers=self.conf.dataloader_num_workers,
-            pin_memory=self.conf.dataloader_pin_memory,
+            max_tokens=self.conf.get("eval_max_tokens"),
+            group_by_length=self.conf.group_by_length,
+            shuffle=False,
         )
 
     def test_dataloader(self, *args, **kwargs) -> Union[DataLoader, List[DataLoader]]:
-        return DataLoader(
+        return self._dataloader(
             self.test_dataset,
+            "test",
             batch_size=self.conf.eval_batch_size,
-            # sampler=train_sampler,
+            max_tokens=self.conf.get("eval_max_tokens"),
+            group_by_length=self.conf.group_by_length,
+            shuffle=False,
+        )
+
+    def _dataloader(
+        self, dataset, label, batch_size, max_tokens, group_by_length, shuffle
+    ) -> DataLoader:
+        """
+        With a token budget (`max_tokens` / `eval_max_tokens`) the batches (of at most `batch_size` samples) are
+        formed by `MaxTokensBatchSampler`, with `group_by_length` (training: or `sortish_sampler`) batches of
+        `batch_size` samples with similar lengths by `SortishSampler`. Otherwise the samples are shuffled
+        (training) or in dataset order.
+        """
+        source_lengths = [len(ids) for ids in dataset["input_ids"]]
+        target_lengths = [len(ids) for ids in dataset["labels"]]
+        seed = self.conf.seed if self.conf.seed is not None else 0
+
+        if max_tokens:
+            batch_sampler = MaxTokensBatchSampler(
+                source_lengths,
+                target_lengths,
+                max_tokens,
+                max_batch_size=batch_size,
+                shuffle=shuffle,
+                seed=seed,
+            )
+            loader_kwargs = {"batch_sampler": batch_sampler}
+            batches = batch_sampler.batches()
+        else:
+            if group_by_length:
+                sampler = SortishSampler(
+                    source_lengths,
+                    target_lengths,
+                    batch_size,
+                    shuffle=shuffle,
+                    seed=seed,
+                )
+                loader_kwargs = {"sampler": sampler}
+                order = list(sampler)
+            else:
+                loader_kwargs = {"shuffle": shuffle}
+                order = (
+                    torch.randperm(len(dataset)).tolist()
+                    if shuffle
+                    else list(range(len(dataset)))
+                )
+            loader_kwargs["batch_size"] = batch_size
+            loader_kwargs["drop_last"] = self.conf.dataloader_drop_last
+            batches = [
+                order[start : start + batch_size]
+                for start in range(0, len(order), batch_size)
+            ]
+
+        if not self.conf.pad_to_max_length:
+            # pad tokens of the batches, padded to the longest source / target. Shuffled batches are only an
+            # estimate: a random order (not the one of the data loader) or the batches of the first epoch
+            estimate = " (estimate)" if shuffle else ""
+            source_padding = padding_ratio(source_lengths, batches)
+            target_padding = padding_ratio(target_lengths, batches)
+            print(
+                f"{label} batches: {len(batches)}, "
+                f"source padding{estimate}: {source_padding:.1%}, "
+                f"target padding{estimate}: {target_padding:.1%}"
+            )
+
+        return DataLoader(
+            dataset,
             collate_fn=self.data_collator,
-            drop_last=self.conf.dataloader_drop_last,
             num_workers=self.conf.dataloader_num_workers,
             pin_memory=self.conf.dataloader_pin_memory,
+            **loader_kwargs,
         )
 
     # def transfer_batch_to_device(self, batch: Any, device: torch.device) -> Any:
@@ -232,4 +299,7 @@ class BasePLDataModule(pl.LightningDataModule):
         # model_inputs["decoder_attention_mask"] = labels["attention_mask"]
         # model_inputs["labels"] = shift_tokens_left(labels["input_ids"], self.tokenizer.pad_token_id)
         model_inputs["labels"] = labels["input_ids"]
+        if "weight" in examples:
+            # sample weights of deduplicated datasets, see `BasePLModule.forward`
+            model_inputs["weight"] = examples["weight"]
         return model_inputs
@@ -6,7 +6,12 @@ import torch
 import numpy as np
 import pandas as pd
 from score import score, re_score
-from transformers import AutoConfig, AutoModelForSeq2SeqLM, AutoTokenizer
+from transformers import (
+    AutoConfig,
+    AutoModelForSeq2SeqLM,
+    AutoTokenizer,
+    LogitsProcessorList,
+)
 from transformers.optimization import (
     Adafactor,
     AdamW,
@@ -20,6 +25,7 @@ from transformers.optimization import (
 from scheduler import get_inverse_square_root_schedule_with_warmup
 from datasets import load_dataset, load_metric
 from torch.nn.utils.rnn import pad_sequence
+from constrained_decoding import MaintieTripletGrammar, TrieGuidedDecoder
 from utils import (
     BartTripletHead,
     shift_tokens_left,
@@ -72,6 +78,9 @@ class BasePLModule(pl.LightningModule):
         self.validation_step_outputs = []
         self.test_step_outputs = []
 
+        # built on first use of constrained decoding
+        self._triplet_grammar = None
+
     def forward(self, inputs, labels, **kwargs) -> dict:
         """
         Method for the forward pass.
@@ -82,6 +91,9 @@ class BasePLModule(pl.LightningModule):
             output_dict: forward output containing the predictions (output logits ecc...) and the loss if any.
 
         """
+        # sample weights of deduplicated datasets (collapsed duplicates), not a model input
+        weights = inputs.pop("weight", None)
+
         if self.hparams.label_smoothing == 0:
             if self.hparams is not None and self.hparams.ignore_pad_token_for_loss:
                 # force training to ignore pad token
@@ -92,9 +104,12 @@ class BasePLModule(pl.LightningModule):
                     output_hidden_states=True,
                 )
                 logits = outputs["logits"]
-                loss = self.loss_fn(
-                    logits.view(-1, logits.shape[-1]), labels.view(-1)
-                )  # , ignore_index=self.config.pad_token_id)
+                if weights is None:
+                    loss = self.loss_fn(
+                        logits.view(-1, logits.shape[-1]), labels.view(-1)
+                    )  # , ignore_index=self.config.pad_token_id)
+                else:
+                    loss = self._weighted_loss(logits, labels, weights)
             else:
                 # compute usual loss via models
                 outputs = self.model(
@@ -104,8 +119,13 @@ class BasePLModule(pl.LightningModule):
                     return_dict=True,
                     output_hidden_states=True,
                 )
-                loss = outputs["loss"]
                 logits = outputs["logits"]
+                # the model's loss is unweighted (the same token cross entropy)
+                loss = (
+                    outputs["loss"]
+                    if weights is None
+                    else self._weighted_loss(logits, labels, weights)
+                )
         else:
             # compute label smoothed loss
             outputs = self.model(
@@ -120,11 +140,27 @@ class BasePLModule(pl.LightningModule):
                 labels,
                 self.hparams.label_smoothing,
                 ignore_index=self.config.pad_token_id,
+                weights=weights,
             )
         output_dict = {"loss": loss, "logits": logits}
         # return loss, logits
         return output_dict
 
+    @staticmethod
+    def _weighted_loss(
+        logits: torch.Tensor, labels: torch.Tensor, weights: torch.Tensor
+    ) -> torch.Tensor:
+        """Token cross entropy, averaged with the sample weight of each sequence"""
+        token_loss = torch.nn.functional.cross_entropy(
+            logits.view(-1, logits.shape[-1]),
+            labels.view(-1),
+            ignore_index=-100,
+            reduction="none",
+        ).view(labels.shape)
+        token_weights = (labels != -100).to(token_loss.dtype)
+        token_weights = token_weights * weights.to(token_loss.dtype).unsqueeze(-1)
+        return (token_loss * token_weights).sum() / token_weights.sum()
+
     def training_step(self, batch: dict, batch_idx: int) -> torch.Tensor:
         labels = batch.pop("labels")
         labels_original = labels.clone()
@@ -162,6 +198,303 @@ class BasePLModule(pl.LightningModule):
         padded_tensor[:, : tensor.shape[-1]] = tensor
         return padded_tensor
 
+    def _get_maintie_mapping_types(self) -> dict:
+        """Returns the type token to MaintIE type mapping of the configured level (empty for the untyped level 0)"""
+        dataset_file = self.hparams.dataset_name.split("/")[-1]
+        if "_3" in dataset_file:
+            # Level 3 MaintIE data
+
+            return {
+                v: k
+                for k, v in {
+                    "PhysicalObject": "<physical object>",
+                    "PhysicalObject/Substance": "<substance>",
+                    "PhysicalObject/Substance/Gas": "<gas>",
+                    "PhysicalObject/Substance/Liquid": "<liquid>",
+                    "PhysicalObject/Substance/Solid": "<solid>",
+                    "PhysicalObject/Substance/Mixture": "<mixture>",
+                    "PhysicalObject/Organism": "<organism>",
+                    "PhysicalObject/Organism/Person": "<person>",
+                    "PhysicalObject/SensingObject": "<sensing object>",
+                    "PhysicalObject/SensingObject/ElectricPotentialSensingObject": "<electric potential sensing object>",
+                    "PhysicalObject/SensingObject/ResistivitySensingObject": "<resistivity sensing object>",
+                    "PhysicalObject/SensingObject/ElectricCurrentSensingObject": "<electric current sensing object>",
+                    "PhysicalObject/SensingObject/DensitySensingObject": "<density sensing object>",
+                    "PhysicalObject/SensingObject/FieldSensingObject": "<field sensing object>",
+                    "PhysicalObject/SensingObject/FlowSensingObject": "<flow sensing object>",
+                    "PhysicalObject/SensingObject/PhysicalDimensionSensingObject": "<physical dimension sensing object>",
+                    "PhysicalObject/SensingObject/EnergySensingObject": "<energy sensing object>",
+                    "PhysicalObject/SensingObject/PowerSensingObject": "<power sensing object>",
+                    "PhysicalObject/SensingObject/TimeSensingObject": "<time sensing object>",
+                    "PhysicalObject/SensingObject/LevelSensingObject": "<level sensing object>",
+                    "PhysicalObject/SensingObject/HumiditySensingObject": "<humidity sensing object>",
+                    "PhysicalObject/SensingObject/PressureSensingObject": "<pressure sensing object>",
+                    "PhysicalObject/SensingObject/ConcentrationSensingObject": "<concentration sensing object>",
+                    "PhysicalObject/SensingObject/RadiationSensingObject": "<radiation sensing object>",
+                    "PhysicalObject/SensingObject/TimeRatingObject": "<time rating object>",
+                    "PhysicalObject/SensingObject/TemperatureSensingObject": "<temperature sensing object>",
+                    "PhysicalObject/SensingObject/MultiQuantitySensingObject": "<multi quantity sensing object>",
+                    "PhysicalObject/SensingObject/ForceSensingObject": "<force sensing object>",
+                    "PhysicalObject/SensingObject/AudioVisualSensingObject": "<audio visual sensing object>",
+                    "PhysicalObject/SensingObject/InformationSensingObject": "<information sensing object>",
+                    "PhysicalObject/SensingObject/IncidentSensingObject": "<incident sensing object>",
+                    "PhysicalObject/StoringObject": "<storing object>",
+                    "PhysicalObject/StoringObject/CapacitiveStoringObject": "<capacitive storing object>",
+                    "PhysicalObject/StoringObject/InductiveStoringObject": "<inductive storing object>",
+                    "PhysicalObject/StoringObject/ElectrochemicalStoringObject": "<electrochemical storing object>",
+                    "PhysicalObject/StoringObject/InformationStoringObject": "<information storing object>",
+                    "PhysicalObject/StoringObject/OpenStationaryStoringObject": "<open stationary storing object>",
+                    "PhysicalObject/StoringObject/EnclosedStationaryStoringObject": "<enclosed stationary storing object>",
+                    "PhysicalObject/StoringObject/MoveableStoringObject": "<moveable storing object>",
+                    "PhysicalObject/StoringObject/ThermalEnergyStoringObject": "<thermal energy storing object>",
+                    "PhysicalObject/StoringObject/MechanicalEnergyStoringObject": "<mechanical energy storing object>",
+                    "PhysicalObject/EmittingObject": "<emitting object>",
+                    "PhysicalObject/EmittingObject/LightObject": "<light object>",
+                    "PhysicalObject/EmittingObject/ElectricHeatingObject": "<electric heating object>",
+                    "PhysicalObject/EmittingObject/ElectricCoolingObject": "<electric cooling object>",
+                    "PhysicalObject/EmittingObject/WirelessPowerObject": "<wireless power object>",
+                    "PhysicalObject/EmittingObject/ThermalEnergyTransferObject": "<thermal energy transfer object>",
+                    "PhysicalObject/EmittingObject/CombustionHeatingObject": "<combustion heating object>",
+                    "PhysicalObject/EmittingObject/ThermalHeatingObject": "<thermal heating object>",
+                    "PhysicalObject/EmittingObject/ThermalCoolingObject": "<thermal cooling object>",
+                    "PhysicalObject/EmittingObject/NuclearPoweredHeatingObject": "<nuclear powered heating object>",
+                    "PhysicalObject/EmittingObject/ParticleEmittingObject": "<particle emitting object>",
+                    "PhysicalObject/EmittingObject/AcousticWaveEmittingObject": "<acoustic wave emitting object>",
+                    "PhysicalObject/ProtectingObject": "<protecting object>",
+                    "PhysicalObject/ProtectingObject/OvervoltageProtectingObject": "<overvoltage protecting object>",
+                    "PhysicalObject/ProtectingObject/EarthFaultCurrentProtectingObject": "<earth fault current protecting object>",
+                    "PhysicalObject/ProtectingObject/OvercurrentProtectingObject": "<overcurrent protecting object>",
+                    "PhysicalObject/ProtectingObject/FieldProtectingObject": "<field protecting object>",
+                    "PhysicalObject/ProtectingObject/PressureProtectingObject": "<pressure protecting object>",
+                    "PhysicalObject/ProtectingObject/FireProtectingObject": "<fire protecting object>",
+                    "PhysicalObject/ProtectingObject/MechanicalForceProtectingObject": "<mechanical force protecting object>",
+                    "PhysicalObject/ProtectingObject/PreventiveProtectingObject": "<preventive protecting object>",
+                    "PhysicalObject/ProtectingObject/WearProtectingObject": "<wear protecting object>",
+                    "PhysicalObject/ProtectingObject/EnvironmentProtectingObject": "<environment protecting object>",
+                    "PhysicalObject/ProtectingObject/TemperatureProtectingObject": "<temperature protecting object>",
+                    "PhysicalObject/GeneratingObject": "<generating object>",
+                    "PhysicalObject/GeneratingObject/MechanicalToElectricalEnergyGeneratingObject": "<mechanical to electrical energy generating object>",
+                    "PhysicalObject/GeneratingObject/ChemicalToElectricalEnergyGeneratingObject": "<chemical to electrical energy generating object>",
+                    "PhysicalObject/GeneratingObject/SolarToElectricalEnergyGeneratingObject": "<solar to electrical energy generating object>",
+                    "PhysicalObject/GeneratingObject/SignalGeneratingObject": "<signal generating object>",
+                    "PhysicalObject/GeneratingObject/ContinuousTransferObject": "<continuous transfer object>",
+                    "PhysicalObject/GeneratingObject/DiscontinuousTransferObject": "<discontinuous transfer object>",
+                    "PhysicalObject/GeneratingObject/LiquidFlowGeneratingObject": "<liquid flow generating object>",
+                    "PhysicalObject/GeneratingObject/GaseousFlowGeneratingObject": "<gaseous flow generating object>",
+                    "PhysicalObject/GeneratingObject/SolarToThermalEnergyGeneratingObject": "<solar to thermal energy generating object>",
+                    "PhysicalObject/MatterProcessingObject": "<matter processing object>",
+                    "PhysicalObject/MatterProcessingObject/PrimaryFormingObject": "<primary forming object>",
+                    "PhysicalObject/MatterProcessingObject/SurfaceTreatmentObject": "<surface treatment object>",
+                    "PhysicalObject/MatterProcessingObject/AssemblingObject": "<assembling object>",
+                    "PhysicalObject/MatterProcessingObject/ForceSeparatingObject": "<force separating object>",
+                    "PhysicalObject/MatterProcessingObject/ThermalSeparatingObject": "<thermal separating object>",
+                    "PhysicalObject/MatterProcessingObject/MechanicalSeparatingObject": "<mechanical separating object>",
+                    "PhysicalObject/MatterProcessingObject/ElectricOrMagneticSeparatingObject": "<electric or magnetic separating object>",
+                    "PhysicalObject/MatterProcessingObject/ChemicalSeparatingObject": "<chemical separating object>",
+                    "PhysicalObject/MatterProcessingObject/GrindingAndCrushingObject": "<grinding and crushing object>",
+                    "PhysicalObject/MatterProcessingObject/AgglomeratingObject": "<agglomerating object>",
+                    "PhysicalObject/MatterProcessingObject/MixingObject": "<mixing object>",
+                    "PhysicalObject/MatterProcessingObject/ReactingObject": "<reacting object>",
+                    "PhysicalObject/InformationProcessingObject": "<information processing object>",
+                    "PhysicalObject/InformationProcessingObject/ElectricSignalProcessingObject": "<electric signal processing object>",
+                    "PhysicalObject/InformationProcessingObject/ElectricSignalRelayingObject": "<electric signal relaying object>",
+                    "PhysicalObject/InformationProcessingObject/OpticalSignallingObject": "<optical signalling object>",
+                    "PhysicalObject/InformationProcessingObject/FluidSignallingObject": "<fluid signalling object>",
+                    "PhysicalObject/InformationProcessingObject/MechanicalSignallingObject": "<mechanical signalling object>",
+                    "PhysicalObject/InformationProcessingObject/MultipleKindSignallingObject": "<multiple kind signalling object>",
+                    "PhysicalObject/DrivingObject": "<driving object>",
+                    "PhysicalObject/DrivingObject/ElectromagneticRotationalDrivingObject": "<electromagnetic rotational driving object>",
+                    "PhysicalObject/DrivingObject/ElectromagneticLinearDrivingObject": "<electromagnetic linear driving object>",
+                    "PhysicalObject/DrivingObject/MagneticForceDrivingObject": "<magnetic force driving object>",
+                    "PhysicalObject/DrivingObject/PiezoelectricDrivingObject": "<piezoelectric driving object>",
+                    "PhysicalObject/DrivingObject/MechanicalEnergyDrivingObject": "<mechanical energy driving object>",
+                    "PhysicalObject/DrivingObject/FluidPoweredDrivingObject": "<fluid powered driving object>",
+                    "PhysicalObject/DrivingObject/CombustionEngine": "<combustion engine>",
+                    "PhysicalObject/DrivingObject/HeatEngine": "<heat engine>",
+                    "PhysicalObject/CoveringObject": "<covering object>",
+                    "PhysicalObject/CoveringObject/InfillingObject": "<infilling object>",
+                    "PhysicalObject/CoveringObject/ClosureObject": "<closure object>",
+                    "PhysicalObject/CoveringObject/FinishingObject": "<finishing object>",
+                    "PhysicalObject/CoveringObject/TerminatingObject": "<terminating object>",
+                    "PhysicalObject/CoveringObject/HidingObject": "<hiding object>",
+                    "PhysicalObject/PresentingObject": "<presenting object>",
+                    "PhysicalObject/PresentingObject/VisibleStateIndicator": "<visible state indicator>",
+                    "PhysicalObject/PresentingObject/ScalarDisplay": "<scalar display>",
+                    "PhysicalObject/PresentingObject/GraphicalDisplay": "<graphical display>",
+                    "PhysicalObject/PresentingObject/AcousticDevice": "<acoustic device>",
+                    "PhysicalObject/PresentingObject/TactileDevice": "<tactile device>",
+                    "PhysicalObject/PresentingObject/OrnamentalObject": "<ornamental object>",
+                    "PhysicalObject/PresentingObject/MultipleFormPresentingObject": "<multiple form presenting object>",
+                    "PhysicalObject/ControllingObject": "<controlling object>",
+                    "PhysicalObject/ControllingObject/ElectricControllingObject": "<electric controlling object>",
+                    "PhysicalObject/ControllingObject/ElectricSeparatingObject": "<electric separating object>",
+                    "PhysicalObject/ControllingObject/ElectricEarthingObject": "<electric earthing object>",
+                    "PhysicalObject/ControllingObject/SealedFluidSwitchingObject": "<sealed fluid switching object>",
+                    "PhysicalObject/ControllingObject/SealedFluidVaryingObject": "<sealed fluid varying object>",
+                    "PhysicalObject/ControllingObject/OpenFlowControllingObject": "<open flow controlling object>",
+                    "PhysicalObject/ControllingObject/SpaceAccessObject": "<space access object>",
+                    "PhysicalObject/ControllingObject/SolidSubstanceFlowVaryingObject": "<solid substance flow varying object>",
+                    "PhysicalObject/ControllingObject/MechanicalMovementControllingObject": "<mechanical movement controlling object>",
+                    "PhysicalObject/ControllingObject/MultipleMeasureControllingObject": "<multiple measure controlling object>",
+                    "PhysicalObject/RestrictingObject": "<restricting object>",
+                    "PhysicalObject/RestrictingObject/ElectricityRestrictingObject": "<electricity restricting object>",
+                    "PhysicalObject/RestrictingObject/ElectricityStabilisingObject": "<electricity stabilising object>",
+                    "PhysicalObject/RestrictingObject/SignalStabilisingObject": "<signal stabilising object>",
+                    "PhysicalObject/RestrictingObject/MovementRestrictingObject": "<movement restricting object>",
+                    "PhysicalObject/RestrictingObject/ReturnFlowRestrictingObject": "<return flow restricting object>",
+                    "PhysicalObject/RestrictingObject/FlowRestrictor": "<flow restrictor>",
+                    "PhysicalObject/RestrictingObject/LocalClimateStabilisingObject": "<local climate stabilising object>",
+                    "PhysicalObject/RestrictingObject/AccessRestrictingObject": "<access restricting object>",
+                    "PhysicalObject/HumanInteractionObject": "<human interaction object>",
+                    "PhysicalObject/HumanInteractionObject/FaceInteractionObject": "<face interaction object>",
+                    "PhysicalObject/HumanInteractionObject/HandInteractionObject": "<hand interaction object>",
+                    "PhysicalObject/HumanInteractionObject/FootInteractionObject": "<foot interaction object>",
+                    "PhysicalObject/HumanInteractionObject/FingerInteractionObject": "<finger interaction object>",
+                    "PhysicalObject/HumanInteractionObject/MovementInteractionObject": "<movement interaction object>",
+                    "PhysicalObject/HumanInteractionObject/MultiInteractionObject": "<multi interaction object>",
+                    "PhysicalObject/TransformingObject": "<transforming object>",
+                    "PhysicalObject/TransformingObject/ElectricEnergyTransformingObject": "<electric energy transforming object>",
+                    "PhysicalObject/TransformingObject/ElectricEnergyConvertingObject": "<electric energy converting object>",
+                    "PhysicalObject/TransformingObject/UniversalPowerSupply": "<universal power supply>",
+                    "PhysicalObject/TransformingObject/SignalConvertingObject": "<signal converting object>",
+                    "PhysicalObject/TransformingObject/MechanicalEnergyTransformingObject": "<mechanical energy transforming object>",
+                    "PhysicalObject/TransformingObject/MassReductionObject": "<mass reduction object>",
+                    "PhysicalObject/TransformingObject/MatterReshapingObject": "<matter reshaping object>",
+                    "PhysicalObject/TransformingObject/OrganicPlant": "<organic plant>",
+                    "PhysicalObject/HoldingObject": "<holding object>",
+                    "PhysicalObject/HoldingObject/PositioningObject": "<positioning object>",
+                    "PhysicalObject/HoldingObject/CarryingObject": "<carrying object>",
+                    "PhysicalObject/HoldingObject/EnclosingObject": "<enclosing object>",
+                    "PhysicalObject/HoldingObject/StructuralSupportingObject": "<structural supporting object>",
+                    "PhysicalObject/HoldingObject/ReinforcingObject": "<reinforcing object>",
+                    "PhysicalObject/HoldingObject/FramingObject": "<framing object>",
+                    "PhysicalObject/HoldingObject/JointingObject": "<jointing object>",
+                    "PhysicalObject/HoldingObject/FasteningObject": "<fastening object>",
+                    "PhysicalObject/HoldingObject/LevellingObject": "<levelling object>",
+                    "PhysicalObject/HoldingObject/ExistingGround": "<existing ground>",
+                    "PhysicalObject/GuidingObject": "<guiding object>",
+                    "PhysicalObject/GuidingObject/ElectricEnergyGuidingObject": "<electric energy guiding object>",
+                    "PhysicalObject/GuidingObject/ReferencingPotentialGuidingObject": "<referencing potential guiding object>",
+                    "PhysicalObject/GuidingObject/ElectricSignalGuidingObject": "<electric signal guiding object>",
+                    "PhysicalObject/GuidingObject/LightGuidingObject": "<light guiding object>",
+                    "PhysicalObject/GuidingObject/SoundGuidingObject": "<sound guiding object>",
+                    "PhysicalObject/GuidingObject/SolidMatterGuidingObject": "<solid matter guiding object>",
+                    "PhysicalObject/GuidingObject/OpenEnclosureGuidingObject": "<open enclosure guiding object>",
+                    "PhysicalObject/GuidingObject/ClosedEnclosureGuidingObject": "<closed enclosure guiding object>",
+                    "PhysicalObject/GuidingObject/MechanicalEnergyGuidingObject": "<mechanical energy guiding object>",
+                    "PhysicalObject/GuidingObject/RailObject": "<rail object>",
+                    "PhysicalObject/GuidingObject/ThermalEnergyGuidingObject": "<thermal energy guiding object>",
+                    "PhysicalObject/GuidingObject/MultipleFlowGuidingObject": "<multiple flow guiding object>",
+                    "PhysicalObject/GuidingObject/HighVoltageElectricEnergyGuidingObject": "<high voltage electric energy guiding object>",
+                    "PhysicalObject/GuidingObject/LowVoltageElectricEnergyGuidingObject": "<low voltage electric energy guiding object>",
+                    "PhysicalObject/InterfacingObject": "<interfacing object>",
+                    "PhysicalObject/InterfacingObject/HighVoltageConnectingObject": "<high voltage connecting object>",
+                    "PhysicalObject/InterfacingObject/LowVoltageConnectingObject": "<low voltage connecting object>",
+                    "PhysicalObject/InterfacingObject/PotentialConnectingObject": "<potential connecting object>",
+                    "PhysicalObject/InterfacingObject/ElectricSignalConnectingObject": "<electric signal connecting object>",
+                    "PhysicalObject/InterfacingObject/LightCollectingObject": "<light collecting object>",
+                    "PhysicalObject/InterfacingObject/CollectingInterfacingObject": "<collecting interfacing object>",
+                    "PhysicalObject/InterfacingObject/SealedFlowConnectingObject": "<sealed flow connecting object>",
+                    "PhysicalObject/InterfacingObject/NonDetachableCoupling": "<non detachable coupling>",
+                    "PhysicalObject/InterfacingObject/DetachableCoupling": "<detachable coupling>",
+                    "PhysicalObject/InterfacingObject/LevelConnectingObject": "<level connecting object>",
+                    "PhysicalObject/InterfacingObject/SpaceLinkingObject": "<space linking object>",
+                    "PhysicalObject/InterfacingObject/MultipleFlowConnectorObject": "<multiple flow connector object>",
+                    "Activity": "<activity>",
+                    "Activity/MaintenanceActivity": "<maintenance activity>",
+                    "Activity/MaintenanceActivity/Adjust": "<adjust>",
+                    "Activity/MaintenanceActivity/Calibrate": "<calibrate>",
+                    "Activity/MaintenanceActivity/Diagnose": "<diagnose>",
+                    "Activity/MaintenanceActivity/Inspect": "<inspect>",
+                    "Activity/MaintenanceActivity/Replace": "<replace>",
+                    "Activity/MaintenanceActivity/Repair": "<repair>",
+                    "Activity/MaintenanceActivity/Service": "<service>",
+                    "Activity/SupportingActivity": "<supporting activity>",
+                    "Activity/SupportingActivity/Admin": "<admin>",
+                    "Activity/SupportingActivity/Assemble": "<assemble>",
+                    "Activity/SupportingActivity/Isolate": "<isolate>",
+                    "Activity/SupportingActivity/Measure": "<measure>",
+                    "Activity/SupportingActivity/Modify": "<modify>",
+                    "Activity/SupportingActivity/Move": "<move>",
+                    "Activity/SupportingActivity/Operate": "<operate>",
+                    "Activity/SupportingActivity/Perform": "<perform>",
+                    "Activity/SupportingActivity/Teamwork": "<teamwork>",
+                    "State": "<state>",
+                    "State/DesirableState": "<desirable state>",
+                    "State/DesirableState/NormalState": "<normal state>",
+                    "State/UndesirableState": "<undesirable state>",
+                    "State/UndesirableState/DegradedState": "<degraded state>",
+                    "State/UndesirableState/FailedState": "<failed state>",
+                    "Process": "<process>",
+                    "Process/DesirableProcess": "<desirable process>",
+                    "Process/UndesirableProcess": "<undesirable process>",
+                    "Property": "<property>",
+                    "Property/DesirableProperty": "<desirable property>",
+                    "Property/UndesirableProperty": "<undesirable property>",
+                }.items()
+            }
+        elif "_2" in dataset_file:
+            return {
+                v: k
+                for k, v in {
+                    "PhysicalObject/CoveringObject": "<covering object>",
+                    "PhysicalObject/Substance": "<substance>",
+                    "PhysicalObject/GuidingObject": "<guiding object>",
+                    "State/DesirableState": "<desirable state>",
+                    "PhysicalObject/GeneratingObject": "<generating object>",
+                    "PhysicalObject/TransformingObject": "<transforming object>",
+                    "PhysicalObject/MatterProcessingObject": "<matter processing object>",
+                    "Process": "<process>",
+                    "Property/UndesirableProperty": "<undesirable property>",
+                    "State": "<state>",
+                    "Process/UndesirableProcess": "<undesirable process>",
+                    "PhysicalObject/InterfacingObject": "<interfacing object>",
+                    "PhysicalObject/StoringObject": "<storing object>",
+                    "PhysicalObject/EmittingObject": "<emitting object>",
+                    "PhysicalObject/PresentingObject": "<presenting object>",
+                    "Activity/MaintenanceActivity": "<maintenance activity>",
+                    "PhysicalObject/RestrictingObject": "<restricting object>",
+                    "Activity/SupportingActivity": "<supporting activity>",
+                    "Property/DesirableProperty": "<desirable property>",
+                    "PhysicalObject/ControllingObject": "<controlling object>",
+                    "Property": "<property>",
+                    "PhysicalObject/HumanInteractionObject": "<human interaction object>",
+                    "Activity": "<activity>",
+                    "PhysicalObject/DrivingObject": "<driving object>",
+                    "State/UndesirableState": "<undesirable state>",
+                    "PhysicalObject/InformationProcessingObject": "<information processing object>",
+                    "PhysicalObject": "<physical object>",
+                    "PhysicalObject/Organism": "<organism>",
+                    "PhysicalObject/HoldingObject": "<holding object>",
+                    "Process/DesirableProcess": "<desirable process>",
+                    "PhysicalObject/SensingObject": "<sensing object>",
+                    "PhysicalObject/ProtectingObject": "<protecting object>",
+                }.items()
+            }
+        elif "_1" in dataset_file:
+            return {
+                v: k
+                for k, v in {
+                    "PhysicalObject": "<physical object>",
+                    "Process": "<process>",
+                    "Property": "<property>",
+                    "Activity": "<activity>",
+                    "State": "<state>",
+                }.items()
+            }
+        elif "_0" in dataset_file:
+            # Untyped MaintIE configuration.
+            return {}
+        else:
+            raise NotImplementedError("MaintIE level not implemented yet!")
+
+    def _get_triplet_grammar(self) -> MaintieTripletGrammar:
+        if self._triplet_grammar is None:
+            self._triplet_grammar = MaintieTripletGrammar(
+                self.tokenizer, type_tokens=list(self._get_maintie_mapping_types())
+            )
+        return self._triplet_grammar
+
     def generate_triples(
         self,
         batch,
@@ -179,12 +512,33 @@ class BasePLModule(pl.LightningModule):
             else self.config.num_beams,
         }
 
-        generated_tokens = self.model.generate(
-            batch["input_ids"].to(self.model.device),
-            attention_mask=batch["attention_mask"].to(self.model.device),
-            use_cache=True,
-            **gen_kwargs,
-        )
+        maintie = "maintie" in self.hparams.dataset_name.split("/")[-1]
+
+        if self.hparams.get("trie_decoding", False) and maintie:
+            # greedy, grammar guided decoding with restricted lm_head and bulk forced relation subwords
+            generated_tokens = TrieGuidedDecoder(self._get_triplet_grammar()).generate(
+                self.model,
+                batch["input_ids"].to(self.model.device),
+                batch["attention_mask"].to(self.model.device),
+                gen_kwargs["max_length"],
+            )
+        else:
+            if self.hparams.get("constrained_decoding", False) and maintie:
+                # only well-formed triplets: source spans, types of the active level and MaintIE relations
+                gen_kwargs["logits_processor"] = LogitsProcessorList(
+                    [
+                        self._get_triplet_grammar().logits_processor(
+                            batch["input_ids"], gen_kwargs["num_beams"]
+                        )
+                    ]
+                )
+
+            generated_tokens = self.model.generate(
+                batch["input_ids"].to(self.model.device),
+                attention_mask=batch["attention_mask"].to(self.model.device),
+                use_cache=True,
+                **gen_kwargs,
+            )
 
         decoded_preds = self.tokenizer.batch_decode(
             generated_tokens, skip_special_tokens=False
@@ -200,294 +554,12 @@ class BasePLModule(pl.LightningModule):
             ]
 
         if "maintie" in self.hparams.dataset_name.split("/")[-1]:
-            if "_3" in self.hparams.dataset_name.split("/")[-1]:
-                # Level 3 MaintIE data
-
-                maintie_mapping_types = {
-                    v: k
-                    for k, v in {
-                        "PhysicalObject": "<physical object>",
-                        "PhysicalObject/Substance": "<substance>",
-                        "PhysicalObject/Substance/Gas": "<gas>",
-                        "PhysicalObject/Substance/Liquid": "<liquid>",
-                        "PhysicalObject/Substance/Solid": "<solid>",
-                        "PhysicalObject/Substance/Mixture": "<mixture>",
-                        "PhysicalObject/Organism": "<organism>",
-                        "PhysicalObject/Organism/Person": "<person>",
-                        "PhysicalObject/SensingObject": "<sensing object>",
-                        "PhysicalObject/SensingObject/ElectricPotentialSensingObject": "<electric potential sensing object>",
-                        "PhysicalObject/SensingObject/ResistivitySensingObject": "<resistivity sensing object>",
-                        "PhysicalObject/SensingObject/ElectricCurrentSensingObject": "<electric current sensing object>",
-                        "PhysicalObject/SensingObject/DensitySensingObject": "<density sensing object>",
-                        "PhysicalObject/SensingObject/FieldSensingObject": "<field sensing object>",
-                        "PhysicalObject/SensingObject/FlowSensingObject": "<flow sensing object>",
-                        "PhysicalObject/SensingObject/PhysicalDimensionSensingObject": "<physical dimension sensing object>",
-                        "PhysicalObject/SensingObject/EnergySensingObject": "<energy sensing object>",
-                        "PhysicalObject/SensingObject/PowerSensingObject": "<power sensing object>",
-                        "PhysicalObject/SensingObject/TimeSensingObject": "<time sensing object>",
-                        "PhysicalObject/SensingObject/LevelSensingObject": "<level sensing object>",
-                        "PhysicalObject/SensingObject/HumiditySensingObject": "<humidity sensing object>",
-                        "PhysicalObject/SensingObject/PressureSensingObject": "<pressure sensing object>",
-                        "PhysicalObject/SensingObject/ConcentrationSensingObject": "<concentration sensing object>",
-                        "PhysicalObject/SensingObject/RadiationSensingObject": "<radiation sensing object>",
-                        "PhysicalObject/SensingObject/TimeRatingObject": "<time rating object>",
-                        "PhysicalObject/SensingObject/TemperatureSensingObject": "<temperature sensing object>",
-                        "PhysicalObject/SensingObject/MultiQuantitySensingObject": "<multi quantity sensing object>",
-                        "PhysicalObject/SensingObject/ForceSensingObject": "<force sensing object>",
-                        "PhysicalObject/SensingObject/AudioVisualSensingObject": "<audio visual sensing object>",
-                        "PhysicalObject/SensingObject/InformationSensingObject": "<information sensing object>",
-                        "PhysicalObject/SensingObject/IncidentSensingObject": "<incident sensing object>",
-                        "PhysicalObject/StoringObject": "<storing object>",
-                        "PhysicalObject/StoringObject/CapacitiveStoringObject": "<capacitive storing object>",
-                        "PhysicalObject/StoringObject/InductiveStoringObject": "<inductive storing object>",
-                        "PhysicalObject/StoringObject/ElectrochemicalStoringObject": "<electrochemical storing object>",
-                        "PhysicalObject/StoringObject/InformationStoringObject": "<information storing object>",
-                        "PhysicalObject/StoringObject/OpenStationaryStoringObject": "<open stationary storing object>",
-                        "PhysicalObject/StoringObject/EnclosedStationaryStoringObject": "<enclosed stationary storing object>",
-                        "PhysicalObject/StoringObject/MoveableStoringObject": "<moveable storing object>",
-                        "PhysicalObject/StoringObject/ThermalEnergyStoringObject": "<thermal energy storing object>",
-                        "PhysicalObject/StoringObject/MechanicalEnergyStoringObject": "<mechanical energy storing object>",
-                        "PhysicalObject/EmittingObject": "<emitting object>",
-                        "PhysicalObject/EmittingObject/LightObject": "<light object>",
-                        "PhysicalObject/EmittingObject/ElectricHeatingObject": "<electric heating object>",
-                        "PhysicalObject/EmittingObject/ElectricCoolingObject": "<electric cooling object>",
-                        "PhysicalObject/EmittingObject/WirelessPowerObject": "<wireless power object>",
-                        "PhysicalObject/EmittingObject/ThermalEnergyTransferObject": "<thermal energy transfer object>",
-                        "PhysicalObject/EmittingObject/CombustionHeatingObject": "<combustion heating object>",
-                        "PhysicalObject/EmittingObject/ThermalHeatingObject": "<thermal heating object>",
-                        "PhysicalObject/EmittingObject/ThermalCoolingObject": "<thermal cooling object>",
-                        "PhysicalObject/EmittingObject/NuclearPoweredHeatingObject": "<nuclear powered heating object>",
-                        "PhysicalObject/EmittingObject/ParticleEmittingObject": "<particle emitting object>",
-                        "PhysicalObject/EmittingObject/AcousticWaveEmittingObject": "<acoustic wave emitting object>",
-                        "PhysicalObject/ProtectingObject": "<protecting object>",
-                        "PhysicalObject/ProtectingObject/OvervoltageProtectingObject": "<overvoltage protecting object>",
-                        "PhysicalObject/ProtectingObject/EarthFaultCurrentProtectingObject": "<earth fault current protecting object>",
-                        "PhysicalObject/ProtectingObject/OvercurrentProtectingObject": "<overcurrent protecting object>",
-                        "PhysicalObject/ProtectingObject/FieldProtectingObject": "<field protecting object>",
-                        "PhysicalObject/ProtectingObject/PressureProtectingObject": "<pressure protecting object>",
-                        "PhysicalObject/ProtectingObject/FireProtectingObject": "<fire protecting object>",
-                        "PhysicalObject/ProtectingObject/MechanicalForceProtectingObject": "<mechanical force protecting object>",
-                        "PhysicalObject/ProtectingObject/PreventiveProtectingObject": "<preventive protecting object>",
-                        "PhysicalObject/ProtectingObject/WearProtectingObject": "<wear protecting object>",
-                        "PhysicalObject/ProtectingObject/EnvironmentProtectingObject": "<environment protecting object>",
-                        "PhysicalObject/ProtectingObject/TemperatureProtectingObject": "<temperature protecting object>",
-                        "PhysicalObject/GeneratingObject": "<generating object>",
-                        "PhysicalObject/GeneratingObject/MechanicalToElectricalEnergyGeneratingObject": "<mechanical to electrical energy generating object>",
-                        "PhysicalObject/GeneratingObject/ChemicalToElectricalEnergyGeneratingObject": "<chemical to electrical energy generating object>",
-                        "PhysicalObject/GeneratingObject/SolarToElectricalEnergyGeneratingObject": "<solar to electrical energy generating object>",
-                        "PhysicalObject/GeneratingObject/SignalGeneratingObject": "<signal generating object>",
-                        "PhysicalObject/GeneratingObject/ContinuousTransferObject": "<continuous transfer object>",
-                        "PhysicalObject/GeneratingObject/DiscontinuousTransferObject": "<discontinuous transfer object>",
-                        "PhysicalObject/GeneratingObject/LiquidFlowGeneratingObject": "<liquid flow generating object>",
-                        "PhysicalObject/GeneratingObject/GaseousFlowGeneratingObject": "<gaseous flow generating object>",
-                        "PhysicalObject/GeneratingObject/SolarToThermalEnergyGeneratingObject": "<solar to thermal energy generating object>",
-                        "PhysicalObject/MatterProcessingObject": "<matter processing object>",
-                        "PhysicalObject/MatterProcessingObject/PrimaryFormingObject": "<primary forming object>",
-                        "PhysicalObject/MatterProcessingObject/SurfaceTreatmentObject": "<surface treatment object>",
-                        "PhysicalObject/MatterProcessingObject/AssemblingObject": "<assembling object>",
-                        "PhysicalObject/MatterProcessingObject/ForceSeparatingObject": "<force separating object>",
-                        "PhysicalObject/MatterProcessingObject/ThermalSeparatingObject": "<thermal separating object>",
-                        "PhysicalObject/MatterProcessingObject/MechanicalSeparatingObject": "<mechanical separating object>",
-                        "PhysicalObject/MatterProcessingObject/ElectricOrMagneticSeparatingObject": "<electric or magnetic separating object>",
-                        "PhysicalObject/MatterProcessingObject/ChemicalSeparatingObject": "<chemical separating object>",
-                        "PhysicalObject/MatterProcessingObject/GrindingAndCrushingObject": "<grinding and crushing object>",
-                        "PhysicalObject/MatterProcessingObject/AgglomeratingObject": "<agglomerating object>",
-                        "PhysicalObject/MatterProcessingObject/MixingObject": "<mixing object>",
-                        "PhysicalObject/MatterProcessingObject/ReactingObject": "<reacting object>",
-                        "PhysicalObject/InformationProcessingObject": "<information processing object>",
-                        "PhysicalObject/InformationProcessingObject/ElectricSignalProcessingObject": "<electric signal processing object>",
-                        "PhysicalObject/InformationProcessingObject/ElectricSignalRelayingObject": "<electric signal relaying object>",
-                        "PhysicalObject/InformationProcessingObject/OpticalSignallingObject": "<optical signalling object>",
-                        "PhysicalObject/InformationProcessingObject/FluidSignallingObject": "<fluid signalling object>",
-                        "PhysicalObject/InformationProcessingObject/MechanicalSignallingObject": "<mechanical signalling object>",
-                        "PhysicalObject/InformationProcessingObject/MultipleKindSignallingObject": "<multiple kind signalling object>",
-                        "PhysicalObject/DrivingObject": "<driving object>",
-                        "PhysicalObject/DrivingObject/ElectromagneticRotationalDrivingObject": "<electromagnetic rotational driving object>",
-                        "PhysicalObject/DrivingObject/ElectromagneticLinearDrivingObject": "<electromagnetic linear driving object>",
-                        "PhysicalObject/DrivingObject/MagneticForceDrivingObject": "<magnetic force driving object>",
-                        "PhysicalObject/DrivingObject/PiezoelectricDrivingObject": "<piezoelectric driving object>",
-                        "PhysicalObject/DrivingObject/MechanicalEnergyDrivingObject": "<mechanical energy driving object>",
-                        "PhysicalObject/DrivingObject/FluidPoweredDrivingObject": "<fluid powered driving object>",
-                        "PhysicalObject/DrivingObject/CombustionEngine": "<combustion engine>",
-                        "PhysicalObject/DrivingObject/HeatEngine": "<heat engine>",
-                        "PhysicalObject/CoveringObject": "<covering object>",
-                        "PhysicalObject/CoveringObject/InfillingObject": "<infilling object>",
-                        "PhysicalObject/CoveringObject/ClosureObject": "<closure object>",
-                        "PhysicalObject/CoveringObject/FinishingObject": "<finishing object>",
-                        "PhysicalObject/CoveringObject/TerminatingObject": "<terminating object>",
-                        "PhysicalObject/CoveringObject/HidingObject": "<hiding object>",
-                        "PhysicalObject/PresentingObject": "<presenting object>",
-                        "PhysicalObject/PresentingObject/VisibleStateIndicator": "<visible state indicator>",
-                        "PhysicalObject/PresentingObject/ScalarDisplay": "<scalar display>",
-                        "PhysicalObject/PresentingObject/GraphicalDisplay": "<graphical display>",
-                        "PhysicalObject/PresentingObject/AcousticDevice": "<acoustic device>",
-                        "PhysicalObject/PresentingObject/TactileDevice": "<tactile device>",
-                        "PhysicalObject/PresentingObject/OrnamentalObject": "<ornamental object>",
-                        "PhysicalObject/PresentingObject/MultipleFormPresentingObject": "<multiple form presenting object>",
-                        "PhysicalObject/ControllingObject": "<controlling object>",
-                        "PhysicalObject/ControllingObject/ElectricControllingObject": "<electric controlling object>",
-                        "PhysicalObject/ControllingObject/ElectricSeparatingObject": "<electric separating object>",
-                        "PhysicalObject/ControllingObject/ElectricEarthingObject": "<electric earthing object>",
-                        "PhysicalObject/ControllingObject/SealedFluidSwitchingObject": "<sealed fluid switching object>",
-                        "PhysicalObject/ControllingObject/SealedFluidVaryingObject": "<sealed fluid varying object>",
-                        "PhysicalObject/ControllingObject/OpenFlowControllingObject": "<open flow controlling object>",
-                        "PhysicalObject/ControllingObject/SpaceAccessObject": "<space access object>",
-                        "PhysicalObject/ControllingObject/SolidSubstanceFlowVaryingObject": "<solid substance flow varying object>",
-                        "PhysicalObject/ControllingObject/MechanicalMovementControllingObject": "<mechanical movement controlling object>",
-                        "PhysicalObject/ControllingObject/MultipleMeasureControllingObject": "<multiple measure controlling object>",
-                        "PhysicalObject/RestrictingObject": "<restricting object>",
-                        "PhysicalObject/RestrictingObject/ElectricityRestrictingObject": "<electricity restricting object>",
-                        "PhysicalObject/RestrictingObject/ElectricityStabilisingObject": "<electricity stabilising object>",
-                        "PhysicalObject/RestrictingObject/SignalStabilisingObject": "<signal stabilising object>",
-                        "PhysicalObject/RestrictingObject/MovementRestrictingObject": "<movement restricting object>",
-                        "PhysicalObject/RestrictingObject/ReturnFlowRestrictingObject": "<return flow restricting object>",
-                        "PhysicalObject/RestrictingObject/FlowRestrictor": "<flow restrictor>",
-                        "PhysicalObject/RestrictingObject/LocalClimateStabilisingObject": "<local climate stabilising object>",
-                        "PhysicalObject/RestrictingObject/AccessRestrictingObject": "<access restricting object>",
-                        "PhysicalObject/HumanInteractionObject": "<human interaction object>",
-                        "PhysicalObject/HumanInteractionObject/FaceInteractionObject": "<face interaction object>",
-                        "PhysicalObject/HumanInteractionObject/HandInteractionObject": "<hand interaction object>",
-                        "PhysicalObject/HumanInteractionObject/FootInteractionObject": "<foot interaction object>",
-                        "PhysicalObject/HumanInteractionObject/FingerInteractionObject": "<finger interaction object>",
-                        "PhysicalObject/HumanInteractionObject/MovementInteractionObject": "<movement interaction object>",
-                        "PhysicalObject/HumanInteractionObject/MultiInteractionObject": "<multi interaction object>",
-                        "PhysicalObject/TransformingObject": "<transforming object>",
-                        "PhysicalObject/TransformingObject/ElectricEnergyTransformingObject": "<electric energy transforming object>",
-                        "PhysicalObject/TransformingObject/ElectricEnergyConvertingObject": "<electric energy converting object>",
-                        "PhysicalObject/TransformingObject/UniversalPowerSupply": "<universal power supply>",
-                        "PhysicalObject/TransformingObject/SignalConvertingObject": "<signal converting object>",
-                        "PhysicalObject/TransformingObject/MechanicalEnergyTransformingObject": "<mechanical energy transforming object>",
-                        "PhysicalObject/TransformingObject/MassReductionObject": "<mass reduction object>",
-                        "PhysicalObject/TransformingObject/MatterReshapingObject": "<matter reshaping object>",
-                        "PhysicalObject/TransformingObject/OrganicPlant": "<organic plant>",
-                        "PhysicalObject/HoldingObject": "<holding object>",
-                        "PhysicalObject/HoldingObject/PositioningObject": "<positioning object>",
-                        "PhysicalObject/HoldingObject/CarryingObject": "<carrying object>",
-                        "PhysicalObject/HoldingObject/EnclosingObject": "<enclosing object>",
-                        "PhysicalObject/HoldingObject/StructuralSupportingObject": "<structural supporting object>",
-                        "PhysicalObject/HoldingObject/ReinforcingObject": "<reinforcing object>",
-                        "PhysicalObject/HoldingObject/FramingObject": "<framing object>",
-                        "PhysicalObject/HoldingObject/JointingObject": "<jointing object>",
-                        "PhysicalObject/HoldingObject/FasteningObject": "<fastening object>",
-                        "PhysicalObject/HoldingObject/LevellingObject": "<levelling object>",
-                        "PhysicalObject/HoldingObject/ExistingGround": "<existing ground>",
-                        "PhysicalObject/GuidingObject": "<guiding object>",
-                        "PhysicalObject/GuidingObject/ElectricEnergyGuidingObject": "<electric energy guiding object>",
-                        "PhysicalObject/GuidingObject/ReferencingPotentialGuidingObject": "<referencing potential guiding object>",
-                        "PhysicalObject/GuidingObject/ElectricSignalGuidingObject": "<electric signal guiding object>",
-                        "PhysicalObject/GuidingObject/LightGuidingObject": "<light guiding object>",
-                        "PhysicalObject/GuidingObject/SoundGuidingObject": "<sound guiding object>",
-                        "PhysicalObject/GuidingObject/SolidMatterGuidingObject": "<solid matter guiding object>",
-                        "PhysicalObject/GuidingObject/OpenEnclosureGuidingObject": "<open enclosure guiding object>",
-                        "PhysicalObject/GuidingObject/ClosedEnclosureGuidingObject": "<closed enclosure guiding object>",
-                        "PhysicalObject/GuidingObject/MechanicalEnergyGuidingObject": "<mechanical energy guiding object>",
-                        "PhysicalObject/GuidingObject/RailObject": "<rail object>",
-                        "PhysicalObject/GuidingObject/ThermalEnergyGuidingObject": "<thermal energy guiding object>",
-                        "PhysicalObject/GuidingObject/MultipleFlowGuidingObject": "<multiple flow guiding object>",
-                        "PhysicalObject/GuidingObject/HighVoltageElectricEnergyGuidingObject": "<high voltage electric energy guiding object>",
-                        "PhysicalObject/GuidingObject/LowVoltageElectricEnergyGuidingObject": "<low voltage electric energy guiding object>",
-                        "PhysicalObject/InterfacingObject": "<interfacing object>",
-                        "PhysicalObject/InterfacingObject/HighVoltageConnectingObject": "<high voltage connecting object>",
-                        "PhysicalObject/InterfacingObject/LowVoltageConnectingObject": "<low voltage connecting object>",
-                        "PhysicalObject/InterfacingObject/PotentialConnectingObject": "<potential connecting object>",
-                        "PhysicalObject/InterfacingObject/ElectricSignalConnectingObject": "<electric signal connecting object>",
-                        "PhysicalObject/InterfacingObject/LightCollectingObject": "<light collecting object>",
-                        "PhysicalObject/InterfacingObject/CollectingInterfacingObject": "<collecting interfacing object>",
-                        "PhysicalObject/InterfacingObject/SealedFlowConnectingObject": "<sealed flow connecting object>",
-                        "PhysicalObject/InterfacingObject/NonDetachableCoupling": "<non detachable coupling>",
-                        "PhysicalObject/InterfacingObject/DetachableCoupling": "<detachable coupling>",
-                        "PhysicalObject/InterfacingObject/LevelConnectingObject": "<level connecting object>",
-                        "PhysicalObject/InterfacingObject/SpaceLinkingObject": "<space linking object>",
-                        "PhysicalObject/InterfacingObject/MultipleFlowConnectorObject": "<multiple flow connector object>",
-                        "Activity": "<activity>",
-                        "Activity/MaintenanceActivity": "<maintenance activity>",
-                        "Activity/MaintenanceActivity/Adjust": "<adjust>",
-                        "Activity/MaintenanceActivity/Calibrate": "<calibrate>",
-                        "Activity/MaintenanceActivity/Diagnose": "<diagnose>",
-                        "Activity/MaintenanceActivity/Inspect": "<inspect>",
-                        "Activity/MaintenanceActivity/Replace": "<replace>",
-                        "Activity/MaintenanceActivity/Repair": "<repair>",
-                        "Activity/MaintenanceActivity/Service": "<service>",
-                        "Activity/SupportingActivity": "<supporting activity>",
-                        "Activity/SupportingActivity/Admin": "<admin>",
-                        "Activity/SupportingActivity/Assemble": "<assemble>",
-                        "Activity/SupportingActivity/Isolate": "<isolate>",
-                        "Activity/SupportingActivity/Measure": "<measure>",
-                        "Activity/SupportingActivity/Modify": "<modify>",
-                        "Activity/SupportingActivity/Move": "<move>",
-                        "Activity/SupportingActivity/Operate": "<operate>",
-                        "Activity/SupportingActivity/Perform": "<perform>",
-                        "Activity/SupportingActivity/Teamwork": "<teamwork>",
-                        "State": "<state>",
-                        "State/DesirableState": "<desirable state>",
-                        "State/DesirableState/NormalState": "<normal state>",
-                        "State/UndesirableState": "<undesirable state>",
-                        "State/UndesirableState/DegradedState": "<degraded state>",
-                        "State/UndesirableState/FailedState": "<failed state>",
-                        "Process": "<process>",
-                        "Process/DesirableProcess": "<desirable process>",
-                        "Process/UndesirableProcess": "<undesirable process>",
-                        "Property": "<property>",
-                        "Property/DesirableProperty": "<desirable property>",
-                        "Property/UndesirableProperty": "<undesirable property>",
-                    }.items()
-                }
-            elif "_2" in self.hparams.dataset_name.split("/")[-1]:
-                maintie_mapping_types = {
-                    v: k
-                    for k, v in {
-                        "PhysicalObject/CoveringObject": "<covering object>",
-                        "PhysicalObject/Substance": "<substance>",
-                        "PhysicalObject/GuidingObject": "<guiding object>",
-                        "State/DesirableState": "<desirable state>",
-                        "PhysicalObject/GeneratingObject": "<generating object>",
-                        "PhysicalObject/TransformingObject": "<transforming object>",
-                        "PhysicalObject/MatterProcessingObject": "<matter processing object>",
-                        "Process": "<process>",
-                        "Property/UndesirableProperty": "<undesirable property>",
-                        "State": "<state>",
-                        "Process/UndesirableProcess": "<undesirable process>",
-                        "PhysicalObject/InterfacingObject": "<interfacing object>",
-                        "PhysicalObject/StoringObject": "<storing object>",
-                        "PhysicalObject/EmittingObject": "<emitting object>",
-                        "PhysicalObject/PresentingObject": "<presenting object>",
-                        "Activity/MaintenanceActivity": "<maintenance activity>",
-                        "PhysicalObject/RestrictingObject": "<restricting object>",
-                        "Activity/SupportingActivity": "<supporting activity>",
-                        "Property/DesirableProperty": "<desirable property>",
-                        "PhysicalObject/ControllingObject": "<controlling object>",
-                        "Property": "<property>",
-                        "PhysicalObject/HumanInteractionObject": "<human interaction object>",
-                        "Activity": "<activity>",
-                        "PhysicalObject/DrivingObject": "<driving object>",
-                        "State/UndesirableState": "<undesirable state>",
-                        "PhysicalObject/InformationProcessingObject": "<information processing object>",
-                        "PhysicalObject": "<physical object>",
-                        "PhysicalObject/Organism": "<organism>",
-                        "PhysicalObject/HoldingObject": "<holding object>",
-                        "Process/DesirableProcess": "<desirable process>",
-                        "PhysicalObject/SensingObject": "<sensing object>",
-                        "PhysicalObject/ProtectingObject": "<protecting object>",
-                    }.items()
-                }
-            elif "_1" in self.hparams.dataset_name.split("/")[-1]:
-                maintie_mapping_types = {
-                    v: k
-                    for k, v in {
-                        "PhysicalObject": "<physical object>",
-                        "Process": "<process>",
-                        "Property": "<property>",
-                        "Activity": "<activity>",
-                        "State": "<state>",
-                    }.items()
-                }
-            elif "_0" in self.hparams.dataset_name.split("/")[-1]:
+            maintie_mapping_types = self._get_maintie_mapping_types()
+            if not maintie_mapping_types:
                 # Untyped MaintIE configuration.
                 _preds = [extract_triplets(rel) for rel in decoded_preds]
                 _gts = [extract_triplets(rel) for rel in decoded_labels]
                 return _preds, _gts
-            else:
-                raise NotImplementedError("MaintIE level not implemented yet!")
             _preds = [
                 extract_maintie_triplets_typed(rel, mapping_types=maintie_mapping_types)
                 for rel in decoded_preds
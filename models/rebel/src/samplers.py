@@ -0,0 +1,210 @@
+from typing import Iterator, List, Optional, Sequence
+
+import numpy as np
+from torch.utils.data import Sampler
+
+# Number of batches whose samples are sorted together by the sortish order (as in fairseq / transformers)
+CHUNK_BATCHES = 50
+
+
+def length_order(
+    source_lengths: Sequence[int],
+    target_lengths: Sequence[int],
+    chunk_size: Optional[int] = None,
+    rng: Optional[np.random.Generator] = None,
+) -> List[int]:
+    """
+    Indices ordered by (source, target) length, longest first.
+
+    If `rng` is given, the order is sortish: the indices are shuffled, split into chunks of `chunk_size` and only
+    sorted within each chunk, so that neighbouring samples have similar lengths but every epoch sees a different
+    order. Otherwise the indices are sorted completely (evaluation).
+    """
+    source_lengths = np.asarray(source_lengths)
+    target_lengths = np.asarray(target_lengths)
+
+    if rng is None:
+        return np.lexsort((-target_lengths, -source_lengths)).tolist()
+
+    permutation = rng.permutation(len(source_lengths))
+    order = []
+    for start in range(0, len(permutation), max(1, chunk_size or len(permutation))):
+        chunk = permutation[start : start + chunk_size]
+        chunk = chunk[np.lexsort((-target_lengths[chunk], -source_lengths[chunk]))]
+        order.extend(chunk.tolist())
+    return order
+
+
+def shuffle_batches(
+    batches: List[List[int]], lengths: Sequence[int], rng: np.random.Generator
+) -> List[List[int]]:
+    """Random order of the batches, except that the batch with the longest sample comes first, so that an
+    out-of-memory error surfaces at the first step instead of somewhere in the epoch"""
+    if not batches:
+        return batches
+    longest = max(
+        range(len(batches)), key=lambda i: max(lengths[j] for j in batches[i])
+    )
+    rest = [
+        batches[i] for i in rng.permutation(len(batches)).tolist() if i != longest
+    ]
+    return [batches[longest]] + rest
+
+
+def padding_ratio(lengths: Sequence[int], batches: Iterator[List[int]]) -> float:
+    """Share of pad tokens if every batch is padded to its longest sample (`DataCollatorForSeq2Seq`)"""
+    tokens, padded = 0, 0
+    for batch in batches:
+        batch_lengths = [lengths[i] for i in batch]
+        tokens += sum(batch_lengths)
+        padded += len(batch_lengths) * max(batch_lengths)
+    return 1.0 - tokens / padded if padded else 0.0
+
+
+class SortishSampler(Sampler):
+    """
+    Sample order in which consecutive `batch_size` samples have similar source and target lengths, which reduces
+    the padding of `DataCollatorForSeq2Seq` (use as `DataLoader(sampler=...)` with the same `batch_size`).
+
+    Parameters:
+    - source_lengths (Sequence[int]): Number of input ids of every sample.
+    - target_lengths (Sequence[int]): Number of label ids of every sample.
+    - batch_size (int): Batch size of the data loader.
+    - shuffle (bool): If true (training), the order is sortish and the batches are shuffled every epoch (see
+      `set_epoch`), otherwise the samples are sorted by length (evaluation).
+    - seed (int): Seed of the shuffling.
+    """
+
+    def __init__(
+        self,
+        source_lengths: Sequence[int],
+        target_lengths: Sequence[int],
+        batch_size: int,
+        shuffle: bool = True,
+        seed: int = 0,
+    ):
+        self.source_lengths = source_lengths
+        self.target_lengths = target_lengths
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch: int) -> None:
+        self.epoch = epoch
+
+    def __iter__(self) -> Iterator[int]:
+        if not self.shuffle:
+            return iter(length_order(self.source_lengths, self.target_lengths))
+
+        rng = np.random.default_rng(self.seed + self.epoch)
+        order = length_order(
+            self.source_lengths,
+            self.target_lengths,
+            chunk_size=self.batch_size * CHUNK_BATCHES,
+            rng=rng,
+        )
+        batches = [
+            order[start : start + self.batch_size]
+            for start in range(0, len(order), self.batch_size)
+        ]
+        # a last incomplete batch stays last, as it is dropped with `drop_last`
+        last = (
+            [batches.pop()] if batches and len(batches[-1]) < self.batch_size else []
+        )
+        batches = shuffle_batches(batches, self.source_lengths, rng) + last
+        return iter([index for batch in batches for index in batch])
+
+    def __len__(self) -> int:
+        return len(self.source_lengths)
+
+
+class MaxTokensBatchSampler(Sampler):
+    """
+    Batches of samples with similar lengths whose padded source and padded target each have at most `max_tokens`
+    tokens, i.e. small batches of long samples and large batches of short ones (use as
+    `DataLoader(batch_sampler=...)`). A sample that exceeds `max_tokens` on its own forms a single sample batch.
+
+    Parameters:
+    - source_lengths (Sequence[int]): Number of input ids of every sample.
+    - target_lengths (Sequence[int]): Number of label ids of every sample.
+    - max_tokens (int): Token budget of the padded source and of the padded target of a batch.
+    - max_batch_size (int, optional): Maximum number of samples of a batch.
+    - shuffle (bool): If true (training), the order is sortish and the batches are shuffled every epoch (see
+      `set_epoch`), otherwise the samples are sorted by length (evaluation).
+    - seed (int): Seed of the shuffling.
+    """
+
+    def __init__(
+        self,
+        source_lengths: Sequence[int],
+        target_lengths: Sequence[int],
+        max_tokens: int,
+        max_batch_size: Optional[int] = None,
+        shuffle: bool = True,
+        seed: int = 0,
+    ):
+        self.source_lengths = source_lengths
+        self.target_lengths = target_lengths
+        self.max_tokens = max_tokens
+        self.max_batch_size = max_batch_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+        self._batches = None
+        self._batches_epoch = None
+
+    def set_epoch(self, epoch: int) -> None:
+        self.epoch = epoch
+
+    def batches(self) -> List[List[int]]:
+        """The batches of the current epoch"""
+        if self._batches is None or (
+            self.shuffle and self._batches_epoch != self.epoch
+        ):
+            self._batches = self._create_batches()
+            self._batches_epoch = self.epoch
+        return self._batches
+
+    def _create_batches(self) -> List[List[int]]:
+        rng = np.random.default_rng(self.seed + self.epoch) if self.shuffle else None
+        # chunks of roughly CHUNK_BATCHES batches
+        mean_length = (
+            max(1, int(np.mean(self.source_lengths))) if self.source_lengths else 1
+        )
+        order = length_order(
+            self.source_lengths,
+            self.target_lengths,
+            chunk_size=CHUNK_BATCHES * max(1, self.max_tokens // mean_length),
+            rng=rng,
+        )
+
+        batches = []
+        batch, source_max, target_max = [], 0, 0
+        for index in order:
+            source_length = max(source_max, self.source_lengths[index])
+            target_length = max(target_max, self.target_lengths[index])
+            size = len(batch) + 1
+            if batch and (
+                size * source_length > self.max_tokens
+                or size * target_length > self.max_tokens
+                or (self.max_batch_size and size > self.max_batch_size)
+            ):
+                batches.append(batch)
+                batch = []
+                source_length = self.source_lengths[index]
+                target_length = self.target_lengths[index]
+            batch.append(index)
+            source_max, target_max = source_length, target_length
+        if batch:
+            batches.append(batch)
+
+        if self.shuffle:
+            batches = shuffle_batches(batches, self.source_lengths, rng)
+        return batches
+
+    def __iter__(self) -> Iterator[List[int]]:
+        return iter(self.batches())
+
+    def __len__(self) -> int:
+        return len(self.batches())
@@ -11,8 +11,8 @@ from torch.nn.parameter import Parameter
 from transformers.models.bart.modeling_bart import shift_tokens_right
 
 
-def label_smoothed_nll_loss(lprobs, target, epsilon, ignore_index=-100):
-    """From fairseq"""
+def label_smoothed_nll_loss(lprobs, target, epsilon, ignore_index=-100, weights=None):
+    """From fairseq (optionally with per sequence sample weights)"""
     if target.dim() == lprobs.dim() - 1:
         target = target.unsqueeze(-1)
     nll_loss = -lprobs.gather(dim=-1, index=target)
@@ -25,6 +25,11 @@ def label_smoothed_nll_loss(lprobs, target, epsilon, ignore_index=-100):
         nll_loss = nll_loss.squeeze(-1)
         smooth_loss = smooth_loss.squeeze(-1)
 
+    if weights is not None:
+        weights = weights.to(nll_loss.dtype).view(-1, *([1] * (nll_loss.dim() - 1)))
+        nll_loss = nll_loss * weights
+        smooth_loss = smooth_loss * weights
+
     nll_loss = nll_loss.sum()  # mean()? Scared to break other math.
     smooth_loss = smooth_loss.sum()
     eps_i = epsilon / lprobs.size(-1)
@@ -14,9 +14,16 @@ def _add_common_args(arg_parser):
                             help="If true, input is lowercased during preprocessing")
     arg_parser.add_argument('--sampling_processes', type=int, default=4,
                             help="Number of sampling processes. 0 = no multiprocessing for sampling")
+    arg_parser.add_argument('--dataset_memory_path', type=str, default=None,
+                            help="Directory of the memory mapped dataset arrays, which are shared by the sampling "
+                                 "processes (default: '/dev/shm' if available, else the temporary directory)")
 
     # Model / Training / Evaluation
     arg_parser.add_argument('--model_path', type=str, help="Path to directory that contains model checkpoints")
+    arg_parser.add_argument('--bundle_path', type=str, default=None,
+                            help="Path to a single-file model bundle (see 'spert.py bundle'). If given, model, "
+                                 "tokenizer, types and model type are read from the bundle instead of model_path, "
+                                 "tokenizer_path, types_path and model_type")
     arg_parser.add_argument('--model_type', type=str, default="spert", help="Type of model")
     arg_parser.add_argument('--cpu', action='store_true', default=False,
                             help="If true, train/evaluate on CPU even if a CUDA device is available")
@@ -30,12 +37,32 @@ def _add_common_args(arg_parser):
     arg_parser.add_argument('--no_overlapping', action='store_true', default=False,
                             help="If true, do not evaluate on overlapping entities "
                                  "and relations with overlapping entities")
+    arg_parser.add_argument('--static_shapes', action='store_true', default=False,
+                            help="If true, pad inference batches (context, entity and relation candidates) "
+                                 "to power-of-two buckets, so that each shape is only compiled once")
+    arg_parser.add_argument('--compile', action='store_true', default=False,
+                            help="If true, compile the model with torch.compile for inference (implies static_shapes)")
+    arg_parser.add_argument('--window_size', type=int, default=0,
+                            help="If > 0, documents with more sub-words are encoded in overlapping windows of this "
+                                 "size (e.g. 512), otherwise in a single pass")
+    arg_parser.add_argument('--window_stride', type=int, default=None,
+                            help="Offset between consecutive windows (default: window_size / 2)")
+    arg_parser.add_argument('--window_pooling', type=str, default='max', choices=['max', 'mean'],
+                            help="Pooling of the hidden states of tokens covered by several windows")
+    arg_parser.add_argument('--encoder_cache_size', type=int, default=0,
+                            help="If > 0, cache the encoder's hidden states of documents for evaluation/prediction "
+                                 "(maximum size in MB), so that repeated texts are only encoded once")
 
     # Misc
     arg_parser.add_argument('--seed', type=int, default=None, help="Seed")
     arg_parser.add_argument('--cache_path', type=str, default=None,
                             help="Path to cache transformer models (for HuggingFace transformers library)")
     arg_parser.add_argument('--debug', action='store_true', default=False, help="Debugging mode on/off")
+    arg_parser.add_argument('--profile', action='store_true', default=False,
+                            help="If true, time the stages of every step (data wait, collate, host to device copy, "
+                                 "encoder, span pooling, relation classification, ...) and log a summary per epoch")
+    arg_parser.add_argument('--profile_steps', type=int, default=0,
+                            help="If > 0, record a torch.profiler trace of this many steps (viewable in TensorBoard)")
 
 
 def _add_logging_args(arg_parser):
@@ -47,6 +74,20 @@ def _add_logging_args(arg_parser):
                             help="If true, store evaluation examples on disc (in log directory)")
     arg_parser.add_argument('--example_count', type=int, default=None,
                             help="Count of evaluation example to store (if store_examples == True)")
+    arg_parser.add_argument('--log_flush_interval', type=float, default=30.0,
+                            help="Seconds between writes of the buffered CSV/TensorBoard metrics (also written at "
+                                 "the end of every epoch). 0: write every row immediately")
+    arg_parser.add_argument('--disable_metric_logging', action='store_true', default=False,
+                            help="If true, do not write CSV/TensorBoard metrics (e.g. for benchmarking)")
+
+
+def _add_distributed_args(arg_parser):
+    arg_parser.add_argument('--distributed', action='store_true', default=False,
+                            help="If true, train/evaluate with DistributedDataParallel (one process per device, "
+                                 "start with 'torchrun --nproc_per_node <n> ./spert.py ...')")
+    arg_parser.add_argument('--dist_backend', type=str, default=None,
+                            help="Backend of the process group ('gloo' or 'nccl'). Default: 'nccl' if CUDA is "
+                                 "available, else 'gloo'")
 
 
 def train_argparser():
@@ -62,6 +103,15 @@ def train_argparser():
                             help="If true, evaluate validation set before training")
     arg_parser.add_argument('--save_optimizer', action='store_true', default=False,
                             help="Save optimizer alongside model")
+    arg_parser.add_argument('--keep_last_checkpoints', type=int, default=0,
+                            help="Save a checkpoint after every epoch and keep the last x of them (0: only the final "
+                                 "model)")
+    arg_parser.add_argument('--save_bundle', action='store_true', default=False,
+                            help="Additionally save the final model as single-file model bundle "
+                                 "('final_model_bundle.safetensors', see 'bundle_path')")
+    arg_parser.add_argument('--save_best', action='store_true', default=False,
+                            help="Keep the model with the best validation relation F1 (strict, micro) in "
+                                 "'model_valid_best'")
     arg_parser.add_argument('--train_log_iter', type=int, default=100, help="Log training process every x iterations")
     arg_parser.add_argument('--final_eval', action='store_true', default=False,
                             help="Evaluate the model only after training, not at every epoch")
@@ -81,6 +131,27 @@ def train_argparser():
 
     _add_common_args(arg_parser)
     _add_logging_args(arg_parser)
+    _add_distributed_args(arg_parser)
+
+    return arg_parser
+
+
+def distill_argparser():
+    arg_parser = train_argparser()
+
+    # Teacher (the model of the run, i.e. 'model_path', is the student)
+    arg_parser.add_argument('--teacher_path', type=str, default=None,
+                            help="Path to the teacher model (checkpoint directory or model bundle), e.g. SpERT on "
+                                 "BERT base trained on the gold corpus")
+    arg_parser.add_argument('--teacher_model_type', type=str, default="spert",
+                            help="Type of the teacher model (of a checkpoint directory)")
+    arg_parser.add_argument('--silver_path', type=str, default=None,
+                            help="Path to the corpus that the teacher labels (e.g. the silver corpus). The student is "
+                                 "trained on these documents (soft labels) and the documents of train_path")
+    arg_parser.add_argument('--teacher_labels_path', type=str, default=None,
+                            help="Path to a corpus already labeled by a teacher, used instead of labeling silver_path. "
+                                 "Predictions of 'spert.py predict' (entities and relations with 'proba') or of "
+                                 "another model in the same format (without 'proba': hard labels)")
 
     return arg_parser
 
@@ -93,6 +164,7 @@ def eval_argparser():
 
     _add_common_args(arg_parser)
     _add_logging_args(arg_parser)
+    _add_distributed_args(arg_parser)
 
     return arg_parser
 
@@ -104,6 +176,30 @@ def predict_argparser():
     arg_parser.add_argument('--dataset_path', type=str, help="Path to dataset")
     arg_parser.add_argument('--predictions_path', type=str, help="Path to store predictions")
     arg_parser.add_argument('--spacy_model', type=str, help="Label of SpaCy model (used for tokenization)")
+    arg_parser.add_argument('--stream', action='store_true', default=False,
+                            help="If true, parse the documents while predicting instead of reading the whole "
+                                 "dataset first (constant memory, use JSON lines '.jsonl' for dataset and "
+                                 "predictions)")
+
+    _add_common_args(arg_parser)
+
+    return arg_parser
+
+
+def bundle_argparser():
+    arg_parser = argparse.ArgumentParser()
+
+    # Output
+    arg_parser.add_argument('--output_path', type=str,
+                            help="Path of the model bundle to create (e.g. 'maintie_g_3.safetensors')")
+    arg_parser.add_argument('--trim_corpus_paths', type=str, nargs='+', default=None,
+                            help="If given, the vocabulary (tokenizer and word embeddings) is trimmed to the sub-words "
+                                 "of these corpora (e.g. train and silver corpus) before bundling")
+    arg_parser.add_argument('--trim_margin', type=int, default=1000,
+                            help="Additionally kept sub-words (the most frequent ones of the original vocabulary)")
+    arg_parser.add_argument('--trim_verify_count', type=int, default=500,
+                            help="Documents of the corpora on which the trimmed model must predict exactly as the "
+                                 "original model")
 
     _add_common_args(arg_parser)
 
@@ -0,0 +1,630 @@
+import argparse
+import functools
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+import torch
+from torch.utils.data import DataLoader
+from transformers import BertConfig
+from transformers import BertTokenizer
+
+from spert import bundling
+from spert import models
+from spert import sampling
+from spert import util
+from spert.checkpointing import CheckpointWriter
+from spert.entities import Dataset
+from spert.input_reader import JsonInputReader
+from spert.metric_logger import MetricLogger
+
+
+def _add_common_args(arg_parser):
+    arg_parser.add_argument('--doc_count', type=int, default=256, help="Number of synthetic documents")
+    arg_parser.add_argument('--min_tokens', type=int, default=3, help="Minimum tokens per synthetic document")
+    arg_parser.add_argument('--max_tokens', type=int, default=40, help="Maximum tokens per synthetic document")
+    arg_parser.add_argument('--batch_size', type=int, default=8, help="Batch size")
+    arg_parser.add_argument('--max_span_size', type=int, default=10, help="Maximum size of spans")
+    arg_parser.add_argument('--max_pairs', type=int, default=1000, help="Maximum entity pairs per chunk")
+    arg_parser.add_argument('--entity_types', type=int, default=6, help="Entity types (including 'None')")
+    arg_parser.add_argument('--relation_types', type=int, default=7, help="Relation types (excluding 'None')")
+    arg_parser.add_argument('--hidden_size', type=int, default=128, help="Hidden size of the (random) encoder")
+    arg_parser.add_argument('--layers', type=int, default=2, help="Layers of the (random) encoder")
+    arg_parser.add_argument('--none_bias', type=float, default=1.0,
+                            help="Bias towards the 'None' entity type (controls the number of predicted entities "
+                                 "and thereby relation candidates of the random model)")
+    arg_parser.add_argument('--repeat', type=int, default=3, help="Timed passes over the data")
+    arg_parser.add_argument('--seed', type=int, default=42, help="Seed")
+
+
+def _create_dataset(args, label='benchmark'):
+    """ Synthetic dataset of random documents (one sub-word per token) """
+    rng = random.Random(args.seed)
+    dataset = Dataset(label, rel_types=[None] * (args.relation_types + 1), entity_types=None,
+                      neg_entity_count=100, neg_rel_count=100, max_span_size=args.max_span_size)
+
+    for _ in range(args.doc_count):
+        token_count = rng.randint(args.min_tokens, args.max_tokens)
+        encoding = [101] + [rng.randint(1000, 20000) for _ in range(token_count)] + [102]
+        tokens = [dataset.create_token(i, i + 1, i + 2, str(encoding[i + 1])) for i in range(token_count)]
+        dataset.create_document(tokens, [], [], encoding)
+
+    dataset.switch_mode(Dataset.EVAL_MODE)
+    return dataset
+
+
+def _create_model(args, model_class=models.SpERT, **kwargs):
+    """ Randomly initialized (small) SpERT model, no download required """
+    config = BertConfig(vocab_size=30522, hidden_size=args.hidden_size, num_hidden_layers=args.layers,
+                        num_attention_heads=max(args.hidden_size // 64, 1), intermediate_size=args.hidden_size * 4)
+    model = model_class(config, cls_token=101, relation_types=args.relation_types,
+                         entity_types=args.entity_types, size_embedding=25, prop_drop=0.1,
+                         freeze_transformer=False, max_pairs=args.max_pairs, **kwargs)
+    model.entity_classifier.bias.data[0] += args.none_bias
+    model.eval()
+    return model
+
+
+def _run_inference(model, data_loader):
+    doc_count = 0
+
+    with torch.no_grad():
+        for batch in data_loader:
+            model(encodings=batch['encodings'], context_masks=batch['context_masks'],
+                  entity_masks=batch['entity_masks'], entity_sizes=batch['entity_sizes'],
+                  entity_spans=batch['entity_spans'], entity_sample_masks=batch['entity_sample_masks'],
+                  inference=True)
+            doc_count += batch['encodings'].shape[0]
+
+    return doc_count
+
+
+def _print_table(columns, rows):
+    row_fmt = "%24s" + (" %16s" * (len(columns) - 1))
+    print(row_fmt % tuple(columns))
+
+    for row in rows:
+        print(row_fmt % tuple(row))
+
+
+def _static_shapes():
+    arg_parser = argparse.ArgumentParser()
+    _add_common_args(arg_parser)
+    args, _ = arg_parser.parse_known_args()
+
+    torch.manual_seed(args.seed)
+    dataset = _create_dataset(args)
+
+    from torch._dynamo.utils import counters
+
+    settings = [('eager', False, False), ('compiled', False, True), ('compiled + buckets', True, True)]
+    rows = []
+
+    for label, static_shapes, compile_model in settings:
+        torch._dynamo.reset()
+        counters.clear()
+
+        model = _create_model(args, static_shapes=static_shapes)
+        if compile_model:
+            model.compile_inference(dynamic=False)
+
+        collate_fn = sampling.collate_fn_padding_bucketed if static_shapes else sampling.collate_fn_padding
+        data_loader = DataLoader(dataset, batch_size=args.batch_size, shuffle=False, collate_fn=collate_fn)
+
+        # warm up: compiles every shape that occurs in the data
+        start = time.perf_counter()
+        _run_inference(model, data_loader)
+        warmup_time = time.perf_counter() - start
+
+        # steady state
+        start = time.perf_counter()
+        doc_count = sum(_run_inference(model, data_loader) for _ in range(args.repeat))
+        steady_time = time.perf_counter() - start
+
+        rows.append((label, counters['stats']['unique_graphs'], '%.2f' % warmup_time,
+                     '%.1f' % (doc_count / steady_time)))
+
+    print("Static shape inference (CPU, %s documents, batch size %s)" % (args.doc_count, args.batch_size))
+    _print_table(('setting', 'compiled graphs', 'warm up [s]', 'docs/s'), rows)
+
+
+def _create_hierarchy(level_sizes):
+    """ Synthetic type hierarchy (parent indices per level), types are assigned to parents round robin """
+    parents = [[0] + [1] * level_sizes[0]]
+    for level in range(1, len(level_sizes)):
+        parents.append([0] + [1 + i % level_sizes[level - 1] for i in range(level_sizes[level])])
+    return parents
+
+
+def _entity_classifier_flops(model, span_count, entity_count):
+    """ Multiply-accumulate operations of the entity classification (excluding span pooling) """
+    repr_size = model.entity_classifier.in_features
+
+    if isinstance(model, models.FactorizedSpERT):
+        flops = span_count * repr_size * model.level_sizes[0]
+        for level in range(1, len(model.level_sizes)):
+            children, _ = model.level_children(level)
+            flops += entity_count * repr_size * children.shape[1]
+        return flops
+    if isinstance(model, models.HierarchicalSpERT):
+        return span_count * repr_size * sum(model.level_sizes)
+    return span_count * repr_size * model.entity_classifier.out_features
+
+
+def _factorized_classifier():
+    arg_parser = argparse.ArgumentParser()
+    _add_common_args(arg_parser)
+    arg_parser.add_argument('--level_sizes', type=str, default="5,32,224",
+                            help="Types per level of the (synthetic) hierarchy, excluding 'None'")
+    args, _ = arg_parser.parse_known_args()
+
+    level_sizes = [int(size) for size in args.level_sizes.split(',')]
+    parents = _create_hierarchy(level_sizes)
+    args.entity_types = level_sizes[-1] + 1
+
+    torch.manual_seed(args.seed)
+    dataset = _create_dataset(args)
+    data_loader = DataLoader(dataset, batch_size=args.batch_size, shuffle=False,
+                             collate_fn=sampling.collate_fn_padding)
+
+    settings = [('flat', models.SpERT, {}),
+                ('hierarchical', models.HierarchicalSpERT, dict(entity_type_parents=parents)),
+                ('factorized', models.FactorizedSpERT, dict(entity_type_parents=parents))]
+    rows = []
+
+    for label, model_class, kwargs in settings:
+        torch.manual_seed(args.seed)
+        model = _create_model(args, model_class=model_class, **kwargs)
+        if isinstance(model, models.HierarchicalSpERT):
+            # entity/None gate
+            model.level_entity_classifiers[0].bias.data[0] += args.none_bias
+
+        # time the entity classification only (encoder excluded)
+        classify_time, span_count, entity_count = 0.0, 0, 0
+        with torch.no_grad():
+            for _ in range(args.repeat):
+                for batch in data_loader:
+                    h = model._encode(batch['encodings'], batch['context_masks'])
+                    size_embeddings = model.size_embeddings(batch['entity_sizes'])
+
+                    start = time.perf_counter()
+                    entity_clf, _ = model._classify_entities(batch['encodings'], h, batch['entity_masks'],
+                                                             size_embeddings, inference=True)
+                    classify_time += time.perf_counter() - start
+
+                    sample_masks = batch['entity_sample_masks']
+                    span_count += sample_masks.sum().item()
+                    entity_count += ((entity_clf.argmax(dim=-1) != 0) & sample_masks).sum().item()
+
+        flops = _entity_classifier_flops(model, span_count, entity_count)
+        rows.append((label, '%.1f' % (flops / span_count), '%.1f%%' % (100 * entity_count / span_count),
+                     '%.2f' % (1000 * classify_time / args.repeat)))
+
+    print("Entity classification (CPU, %s documents with %s-%s tokens, %s levels: %s)"
+          % (args.doc_count, args.min_tokens, args.max_tokens, len(level_sizes), args.level_sizes))
+    _print_table(('classifier', 'MACs / span', 'entity spans', 'time / pass [ms]'), rows)
+
+
+def _load_model(args, input_reader, tokenizer, **kwargs):
+    """ Trained SpERT model (see 'model_path' of the eval configurations) """
+    model = models.SpERT.from_pretrained(args.model_path, cls_token=tokenizer.convert_tokens_to_ids('[CLS]'),
+                                         relation_types=input_reader.relation_type_count - 1,
+                                         entity_types=input_reader.entity_type_count, size_embedding=25,
+                                         prop_drop=0.1, freeze_transformer=False, max_pairs=args.max_pairs,
+                                         **kwargs)
+    model.eval()
+    return model
+
+
+def _predicted_relations(rel_clf, relations, threshold):
+    """ Relations (head entity, tail entity, type) of every document of a batch whose score reaches 'threshold'.
+    Padded relation candidates (whose number differs between full and compacted batches) score 0 """
+    documents = []
+    for doc_rel_clf, doc_relations in zip(rel_clf, relations):
+        candidates, types = (doc_rel_clf >= threshold).nonzero(as_tuple=True)
+        documents.append({(*doc_relations[candidate].tolist(), rel_type)
+                          for candidate, rel_type in zip(candidates.tolist(), types.tolist())})
+    return documents
+
+
+def _early_exit():
+    arg_parser = argparse.ArgumentParser()
+    _add_common_args(arg_parser)
+    arg_parser.add_argument('--model_path', type=str, default=None,
+                            help="Trained model (random model on synthetic documents if not given)")
+    arg_parser.add_argument('--dataset_path', type=str, default=None, help="Dataset, e.g. the MaintIE test split")
+    arg_parser.add_argument('--types_path', type=str, default=None, help="Types of the dataset")
+    arg_parser.add_argument('--rel_filter_threshold', type=float, default=0.4, help="Filter threshold for relations")
+    args, _ = arg_parser.parse_known_args()
+
+    torch.manual_seed(args.seed)
+
+    if args.model_path:
+        tokenizer = BertTokenizer.from_pretrained(args.model_path, do_lower_case=False)
+        input_reader = JsonInputReader(args.types_path, tokenizer, max_span_size=args.max_span_size)
+        dataset = input_reader.read(args.dataset_path, 'benchmark')
+        dataset.switch_mode(Dataset.EVAL_MODE)
+        model = _load_model(args, input_reader, tokenizer)
+    else:
+        dataset = _create_dataset(args)
+        model = _create_model(args)
+
+    data_loader = DataLoader(dataset, batch_size=args.batch_size, shuffle=False,
+                             collate_fn=sampling.collate_fn_padding)
+    rows = []
+    outputs = {}
+
+    # the same model (weights) in both settings
+    for label, early_exit in [('full', False), ('early exit', True)]:
+        model._early_exit = early_exit
+
+        # warm up
+        _run_inference(model, data_loader)
+
+        start = time.perf_counter()
+        doc_count = sum(_run_inference(model, data_loader) for _ in range(args.repeat))
+        elapsed = time.perf_counter() - start
+
+        with torch.no_grad():
+            outputs[label] = [model(encodings=batch['encodings'], context_masks=batch['context_masks'],
+                                    entity_masks=batch['entity_masks'], entity_sizes=batch['entity_sizes'],
+                                    entity_spans=batch['entity_spans'],
+                                    entity_sample_masks=batch['entity_sample_masks'], inference=True)
+                              for batch in data_loader]
+        rows.append((label, '%.1f' % (doc_count / elapsed)))
+
+    # documents with less than two predicted entities (no relation candidates)
+    skipped = sum((((entity_clf.argmax(dim=-1) != 0) & batch['entity_sample_masks']).sum(dim=-1) < 2).sum().item()
+                  for (entity_clf, _, _), batch in zip(outputs['full'], data_loader))
+    identical = all(_predicted_relations(full_rel_clf, full_relations, args.rel_filter_threshold)
+                    == _predicted_relations(rel_clf, relations, args.rel_filter_threshold)
+                    for (_, full_rel_clf, full_relations), (_, rel_clf, relations)
+                    in zip(outputs['full'], outputs['early exit']))
+
+    print("Relation early exit (CPU, %s documents, batch size %s)" % (len(dataset), args.batch_size))
+    _print_table(('setting', 'docs/s'), rows)
+    print("documents without relation candidates: %.1f%%, speed up: %.2fx, identical relations: %s"
+          % (100 * skipped / len(dataset), float(rows[1][1]) / float(rows[0][1]), identical))
+
+
+def _data_loader():
+    arg_parser = argparse.ArgumentParser()
+    _add_common_args(arg_parser)
+    arg_parser.add_argument('--sampling_processes', type=int, default=4, help="Data loader workers")
+    arg_parser.add_argument('--epochs', type=int, default=3, help="Epochs per setting")
+    args, _ = arg_parser.parse_known_args()
+
+    rows = []
+    for label, persistent in [('per epoch', False), ('persistent + shared', True)]:
+        dataset = _create_dataset(args)
+        dataset.switch_mode(Dataset.TRAIN_MODE)
+        if persistent:
+            dataset.share()
+
+        data_loader = DataLoader(dataset, batch_size=args.batch_size, shuffle=True,
+                                 num_workers=args.sampling_processes, persistent_workers=persistent,
+                                 collate_fn=sampling.collate_fn_padding)
+
+        for epoch in range(args.epochs):
+            start = time.perf_counter()
+            batches = iter(data_loader)
+            next(batches)
+            startup = time.perf_counter() - start
+
+            for _ in range(len(data_loader) - 2):
+                next(batches)
+
+            # workers are still running before the last batch
+            workers = [util.process_memory(pid) for pid in util.child_processes()]
+            workers = [memory for memory in workers if memory is not None] or [(0.0, 0.0)]
+            for _ in batches:
+                pass
+            elapsed = time.perf_counter() - start
+
+            rows.append((label, str(epoch), '%.3f' % startup, '%.3f' % elapsed,
+                         '%.1f' % (sum(rss for rss, _ in workers) / len(workers)),
+                         '%.1f' % (sum(unique for _, unique in workers) / len(workers))))
+
+    print("Data loader (CPU, %s documents, batch size %s, %s workers)"
+          % (args.doc_count, args.batch_size, args.sampling_processes))
+    _print_table(('setting', 'epoch', 'startup s', 'epoch s', 'worker RSS MB', 'worker unique MB'), rows)
+
+
+def _collate_stacked(batch):
+    """ Previous collate function: every sample is extended to the padded shape, then the samples are stacked """
+    padded_batch = dict()
+    for key in batch[0].keys():
+        samples = [s[key] for s in batch]
+        shape = util.max_shape(samples)
+        padded_batch[key] = torch.stack([util.extend_tensor(s, shape) for s in samples])
+    return padded_batch
+
+
+def _to_device_per_key(batch, device):
+    return {key: tensor.to(device) for key, tensor in batch.items()}
+
+
+def _collate():
+    arg_parser = argparse.ArgumentParser()
+    _add_common_args(arg_parser)
+    args, _ = arg_parser.parse_known_args()
+
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    dataset = _create_dataset(args)
+    random.seed(args.seed)
+
+    rows = []
+    for mode in (Dataset.TRAIN_MODE, Dataset.EVAL_MODE):
+        dataset.switch_mode(mode)
+        samples = [dataset[i] for i in range(len(dataset))]
+        batches = [samples[i:i + args.batch_size] for i in range(0, len(samples), args.batch_size)]
+
+        for label, collate_fn, to_device in [
+                ('stacked, per key copies', _collate_stacked, _to_device_per_key),
+                ('preallocated, single copy', sampling.collate_fn_padding, util.to_device),
+                ('preallocated pinned, single copy', functools.partial(sampling.collate_fn_padding,
+                                                                       pin_memory=device.type == 'cuda'),
+                 util.to_device)]:
+            collate_time, transfer_time = 0.0, 0.0
+            for _ in range(args.repeat):
+                for batch in batches:
+                    start = time.perf_counter()
+                    padded_batch = collate_fn(batch)
+                    collate_time += time.perf_counter() - start
+
+                    start = time.perf_counter()
+                    to_device(padded_batch, device)
+                    if device.type == 'cuda':
+                        torch.cuda.synchronize()
+                    transfer_time += time.perf_counter() - start
+
+            batch_count = len(batches) * args.repeat
+            rows.append((mode, label, '%.3f' % (1000 * collate_time / batch_count),
+                         '%.3f' % (1000 * transfer_time / batch_count),
+                         '%.1f' % (len(samples) * args.repeat / (collate_time + transfer_time))))
+
+    print("Batch construction (%s, %s documents, batch size %s)" % (device.type, args.doc_count, args.batch_size))
+    _print_table(('mode', 'setting', 'collate ms', 'to device ms', 'docs/s'), rows)
+
+
+def _batch_index_loop(tensor, index):
+    """ Previous 'util.batch_index': one indexing operation per batch element """
+    return torch.stack([tensor[i][index[i]] for i in range(index.shape[0])])
+
+
+def _padded_nonzero_loop(tensor, padding=0):
+    """ Previous 'util.padded_nonzero' """
+    return util.padded_stack([tensor[i].nonzero().view(-1) for i in range(tensor.shape[0])], padding)
+
+
+def _time(fn, repeat):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return 1000 * (time.perf_counter() - start) / repeat
+
+
+def _gather():
+    arg_parser = argparse.ArgumentParser()
+    _add_common_args(arg_parser)
+    arg_parser.add_argument('--batch_sizes', type=int, nargs='+', default=[1, 8, 32, 128], help="Batch sizes")
+    arg_parser.add_argument('--pair_counts', type=int, nargs='+', default=[10, 100, 1000], help="Pairs per document")
+    arg_parser.add_argument('--candidates', type=int, default=400, help="Entity candidates per document")
+    args, _ = arg_parser.parse_known_args()
+
+    torch.manual_seed(args.seed)
+    repeat = max(args.repeat, 10)
+
+    rows = []
+    for batch_size in args.batch_sizes:
+        for pair_count in args.pair_counts:
+            # 'SpERT._classify_relations': max pooled entity candidates and size embeddings of the pairs
+            entity_spans = torch.randn(batch_size, args.candidates, args.hidden_size)
+            relations = torch.randint(0, args.candidates, (batch_size, pair_count, 2))
+            loop = _time(lambda: _batch_index_loop(entity_spans, relations), repeat)
+            gather = _time(lambda: util.batch_index(entity_spans, relations), repeat)
+            assert torch.equal(_batch_index_loop(entity_spans, relations), util.batch_index(entity_spans, relations))
+            rows.append(('batch_index', str(batch_size), str(pair_count), '%.3f' % loop, '%.3f' % gather,
+                         '%.1fx' % (loop / gather)))
+
+        # entity candidates classified as entities
+        entity_masks = torch.rand(batch_size, args.candidates) < 0.05
+        loop = _time(lambda: _padded_nonzero_loop(entity_masks), repeat)
+        gather = _time(lambda: util.padded_nonzero(entity_masks), repeat)
+        assert torch.equal(_padded_nonzero_loop(entity_masks), util.padded_nonzero(entity_masks))
+        rows.append(('padded_nonzero', str(batch_size), '-', '%.3f' % loop, '%.3f' % gather,
+                     '%.1fx' % (loop / gather)))
+
+    print("Batched gathers (CPU, %s entity candidates, hidden size %s)" % (args.candidates, args.hidden_size))
+    _print_table(('operation', 'batch size', 'pairs', 'loop ms', 'gather ms', 'speed up'), rows)
+
+
+def _log_steps(append, iterations, paths):
+    """ Rows of 'SpERTTrainer._log_train' (loss, average loss and learning rate) of every iteration """
+    start = time.perf_counter()
+    for i in range(iterations):
+        for path in paths:
+            append(path, 0.5 / (i + 1), 0, i, i)
+    return 1e6 * (time.perf_counter() - start) / iterations
+
+
+def _metric_logging():
+    arg_parser = argparse.ArgumentParser()
+    _add_common_args(arg_parser)
+    arg_parser.add_argument('--iterations', type=int, default=20000, help="Logged training iterations")
+    arg_parser.add_argument('--log_dir', type=str, default=None,
+                            help="Directory of the CSV files, e.g. on a network filesystem (default: temporary)")
+    args, _ = arg_parser.parse_known_args()
+
+    rows = []
+    with tempfile.TemporaryDirectory(dir=args.log_dir) as log_dir:
+        files = dict()
+        for name in ('append_csv', 'buffered', 'disabled'):
+            paths = [os.path.join(log_dir, '%s_%s.csv' % (key, name)) for key in ('loss', 'loss_avg', 'lr')]
+            for path in paths:
+                util.create_csv(path, 'value', 'epoch', 'iteration', 'global_iteration')
+
+            if name == 'append_csv':
+                # previous '_log_csv': open, write one row and close the file per call
+                step_us = _log_steps(util.append_csv, args.iterations, paths)
+            else:
+                metric_logger = MetricLogger(enabled=name == 'buffered')
+                step_us = _log_steps(metric_logger.append, args.iterations, paths)
+                start = time.perf_counter()
+                metric_logger.close()
+                step_us += 1e6 * (time.perf_counter() - start) / args.iterations
+
+            files[name] = [open(path).read() for path in paths]
+            rows.append((name, '%.2f' % step_us, '%.2f' % (args.iterations * step_us / 1e6)))
+
+        # the buffered rows are written in the same format
+        assert files['append_csv'] == files['buffered']
+
+    print("CSV metric logging (%s iterations, 3 rows per iteration)" % args.iterations)
+    _print_table(('logger', 'us per iteration', 'total s'), rows)
+
+
+def _load_checkpoint(args, path):
+    """ Model loading of 'SpERTTrainer._load_model' (version check and 'from_pretrained') """
+    start = time.perf_counter()
+    config = BertConfig.from_pretrained(path)
+    util.check_version(config, models.SpERT, path)
+    models.SpERT.from_pretrained(path, config=config, cls_token=101, relation_types=args.relation_types,
+                                 entity_types=args.entity_types, size_embedding=25, prop_drop=0.1,
+                                 freeze_transformer=False, max_pairs=args.max_pairs)
+    return time.perf_counter() - start
+
+
+def _checkpoint():
+    arg_parser = argparse.ArgumentParser()
+    _add_common_args(arg_parser)
+    arg_parser.add_argument('--save_dir', type=str, default=None,
+                            help="Directory of the checkpoints (default: temporary)")
+    args, _ = arg_parser.parse_known_args()
+
+    torch.manual_seed(args.seed)
+    model = _create_model(args)
+    model.config.spert_version = models.SpERT.VERSION
+
+    # one optimizer step, i.e. the optimizer state holds two moments per parameter
+    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-5)
+    model.entity_classifier.weight.sum().backward()
+    optimizer.step()
+
+    rows = []
+    with tempfile.TemporaryDirectory(dir=args.save_dir) as save_dir:
+        vocab_path = os.path.join(save_dir, 'vocab.txt')
+        with open(vocab_path, 'w') as f:
+            f.write('\n'.join(['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]']))
+        tokenizer = BertTokenizer(vocab_path)
+
+        # previous '_save_model': weights, vocabulary and optimizer state written on the training thread
+        path = os.path.join(save_dir, 'synchronous')
+        start = time.perf_counter()
+        os.makedirs(path)
+        model.save_pretrained(path, safe_serialization=False)
+        tokenizer.save_pretrained(path)
+        torch.save(dict(iteration=0, optimizer=optimizer.state_dict()), os.path.join(path, 'extra.state'))
+        blocked = total = time.perf_counter() - start
+        rows.append(('pytorch_model.bin, synchronous', '%.3f' % blocked, '%.3f' % total,
+                     '%.3f' % _load_checkpoint(args, path)))
+
+        path = os.path.join(save_dir, 'background')
+        writer = CheckpointWriter()
+        start = time.perf_counter()
+        writer.save(path, model, tokenizer, dict(iteration=0), optimizer=optimizer)
+        blocked = time.perf_counter() - start
+        writer.close()
+        total = time.perf_counter() - start
+        rows.append(('safetensors, background thread', '%.3f' % blocked, '%.3f' % total,
+                     '%.3f' % _load_checkpoint(args, path)))
+
+    parameters = sum(p.numel() for p in model.parameters())
+    print("Checkpointing (%.1fM parameters, with optimizer state)" % (parameters / 1e6))
+    _print_table(('checkpoint', 'training blocked s', 'written s', 'load s'), rows)
+
+
+def _cold_start():
+    arg_parser = argparse.ArgumentParser()
+    _add_common_args(arg_parser)
+    args, _ = arg_parser.parse_known_args()
+
+    torch.manual_seed(args.seed)
+    model = _create_model(args)
+    model.config.spert_version = models.SpERT.VERSION
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # checkpoint directory in the format of the released models, and the same model as bundle
+        model_dir = os.path.join(tmp_dir, 'model')
+        model.save_pretrained(model_dir, safe_serialization=False)
+
+        vocab_path = os.path.join(tmp_dir, 'vocab.txt')
+        with open(vocab_path, 'w') as f:
+            f.write('\n'.join(['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]'] + ['w%s' % i for i in range(100)]))
+        tokenizer = BertTokenizer(vocab_path)
+        tokenizer.save_pretrained(model_dir)
+
+        types = dict(entities={'E%s' % i: dict(short='E%s' % i, verbose='E%s' % i)
+                               for i in range(args.entity_types - 1)},
+                     relations={'R%s' % i: dict(short='R%s' % i, verbose='R%s' % i, symmetric=False)
+                                for i in range(args.relation_types)})
+        types_path = os.path.join(tmp_dir, 'types.json')
+        with open(types_path, 'w') as f:
+            json.dump(types, f)
+
+        bundle_path = os.path.join(tmp_dir, 'model.safetensors')
+        bundling.save_bundle(bundle_path, model, tokenizer, types, 'spert')
+
+        dataset_path = os.path.join(tmp_dir, 'dataset.json')
+        with open(dataset_path, 'w') as f:
+            json.dump([['w%s' % i for i in range(20)]], f)
+
+        for name, model_args in (('model_path', ['--model_path', model_dir, '--tokenizer_path', model_dir,
+                                                 '--types_path', types_path]),
+                                 ('bundle_path', ['--bundle_path', bundle_path])):
+            command = [sys.executable, os.path.join(os.path.dirname(os.path.realpath(__file__)), 'spert.py'),
+                       'predict', '--dataset_path', dataset_path, '--sampling_processes', '0', '--cpu',
+                       '--predictions_path', os.path.join(tmp_dir, 'predictions.json')] + model_args
+
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+                elapsed = time.perf_counter() - start
+
+                first_prediction = re.search(r'First prediction ([\d.]+)s', output)
+                rows.append((name, '%.2f' % elapsed, first_prediction.group(1) if first_prediction else '-'))
+
+    print("Cold start of 'spert.py predict' (one document, %s layers, hidden size %s)" % (args.layers,
+                                                                                          args.hidden_size))
+    _print_table(('model', 'total s', 'first prediction s'), rows)
+
+
+_BENCHMARKS = {
+    'static_shapes': _static_shapes,
+    'factorized_classifier': _factorized_classifier,
+    'early_exit': _early_exit,
+    'data_loader': _data_loader,
+    'collate': _collate,
+    'gather': _gather,
+    'metric_logging': _metric_logging,
+    'checkpoint': _checkpoint,
+    'cold_start': _cold_start,
+}
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(add_help=False)
+    arg_parser.add_argument("benchmark", type=str, help="Benchmark: %s" % ", ".join(_BENCHMARKS))
+    args, _ = arg_parser.parse_known_args()
+
+    if args.benchmark not in _BENCHMARKS:
+        raise Exception("Benchmark not in %s, e.g. 'python benchmark.py static_shapes ...'" % list(_BENCHMARKS))
+
+    _BENCHMARKS[args.benchmark]()
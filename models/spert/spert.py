@@ -1,9 +1,16 @@
 import argparse
 
-from args import train_argparser, eval_argparser, predict_argparser
+from args import (
+    train_argparser,
+    eval_argparser,
+    predict_argparser,
+    bundle_argparser,
+    distill_argparser,
+)
 from config_reader import process_configs
-from spert import input_reader
-from spert.spert_trainer import SpERTTrainer
+
+# the trainer stack (torch, transformers, ...) is only imported by the spawned run processes ('__train', ...), not by
+# the process that parses the arguments and starts them
 
 
 def _train():
@@ -12,6 +19,9 @@ def _train():
 
 
 def __train(run_args):
+    from spert import input_reader
+    from spert.spert_trainer import SpERTTrainer
+
     trainer = SpERTTrainer(run_args)
     print("train run_args", run_args)
     trainer.train(
@@ -28,6 +38,9 @@ def _eval():
 
 
 def __eval(run_args):
+    from spert import input_reader
+    from spert.spert_trainer import SpERTTrainer
+
     trainer = SpERTTrainer(run_args)
     trainer.eval(
         dataset_path=run_args.dataset_path,
@@ -42,6 +55,9 @@ def _predict():
 
 
 def __predict(run_args):
+    from spert import input_reader
+    from spert.spert_trainer import SpERTTrainer
+
     trainer = SpERTTrainer(run_args)
     trainer.predict(
         dataset_path=run_args.dataset_path,
@@ -50,9 +66,50 @@ def __predict(run_args):
     )
 
 
+def _bundle():
+    arg_parser = bundle_argparser()
+    process_configs(target=__bundle, arg_parser=arg_parser)
+
+
+def __bundle(run_args):
+    from spert import input_reader
+    from spert.spert_trainer import SpERTTrainer
+
+    trainer = SpERTTrainer(run_args)
+    trainer.bundle(
+        output_path=run_args.output_path,
+        types_path=run_args.types_path,
+        input_reader_cls=input_reader.JsonPredictionInputReader,
+    )
+
+
+def _distill():
+    arg_parser = distill_argparser()
+    process_configs(target=__distill, arg_parser=arg_parser)
+
+
+def __distill(run_args):
+    from spert import input_reader
+    from spert.spert_trainer import SpERTTrainer
+
+    trainer = SpERTTrainer(run_args)
+    trainer.distill(
+        train_path=run_args.train_path,
+        valid_path=run_args.valid_path,
+        silver_path=run_args.silver_path,
+        types_path=run_args.types_path,
+        input_reader_cls=input_reader.JsonInputReader,
+        prediction_reader_cls=input_reader.JsonPredictionInputReader,
+    )
+
+
 if __name__ == "__main__":
     arg_parser = argparse.ArgumentParser(add_help=False)
-    arg_parser.add_argument("mode", type=str, help="Mode: 'train' or 'eval'")
+    arg_parser.add_argument(
+        "mode",
+        type=str,
+        help="Mode: 'train', 'eval', 'predict', 'bundle' or 'distill'",
+    )
     args, _ = arg_parser.parse_known_args()
 
     if args.mode == "train":
@@ -61,7 +118,11 @@ if __name__ == "__main__":
         _eval()
     elif args.mode == "predict":
         _predict()
+    elif args.mode == "bundle":
+        _bundle()
+    elif args.mode == "distill":
+        _distill()
     else:
         raise Exception(
-            "Mode not in ['train', 'eval', 'predict'], e.g. 'python spert.py train ...'"
+            "Mode not in ['train', 'eval', 'predict', 'bundle', 'distill'], e.g. 'python spert.py train ...'"
         )
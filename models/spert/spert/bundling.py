@@ -0,0 +1,82 @@
+import itertools
+import json
+import os
+import tempfile
+from collections import OrderedDict
+
+import torch
+from safetensors import safe_open
+from safetensors.torch import load_file, save_file
+from transformers import BertConfig, BertTokenizer
+
+BUNDLE_VERSION = '1'
+
+
+def save_bundle(path: str, model: torch.nn.Module, tokenizer: BertTokenizer, types: dict, model_type: str):
+    """ Writes everything needed for evaluation/prediction into a single safetensors file: the weights (parameters and
+    buffers) as tensors and the config, model type, entity/relation types and tokenizer vocabulary as metadata """
+    tensors = {name: tensor.detach().to('cpu', copy=True).contiguous()
+               for name, tensor in itertools.chain(model.named_parameters(), model.named_buffers())}
+
+    vocab = sorted(tokenizer.vocab.items(), key=lambda item: item[1])
+    metadata = dict(format='pt', spert_bundle=BUNDLE_VERSION, model_type=model_type,
+                    config=model.config.to_json_string(), types=json.dumps(types),
+                    vocab='\n'.join(token for token, _ in vocab), do_lower_case=json.dumps(tokenizer.do_lower_case))
+
+    save_file(tensors, path, metadata=metadata)
+
+
+class ModelBundle:
+    """ Model bundle written by 'save_bundle'. Only the header is read on creation, the weights are read once by
+    'load_model' (memory mapped) into a model that is created without allocating or initializing weights """
+
+    def __init__(self, path: str):
+        with safe_open(path, framework='pt') as f:
+            metadata = f.metadata() or dict()
+
+        if 'spert_bundle' not in metadata:
+            raise Exception("'%s' is not a SpERT model bundle (see 'spert.py bundle')" % path)
+
+        self.path = path
+        self.model_type = metadata['model_type']
+        self.config = BertConfig.from_dict(json.loads(metadata['config']))
+        self.types = json.loads(metadata['types'], object_pairs_hook=OrderedDict)
+
+        self._vocab = metadata['vocab']
+        self._do_lower_case = json.loads(metadata['do_lower_case'])
+
+    def tokenizer(self) -> BertTokenizer:
+        # 'BertTokenizer' reads its vocabulary from a file
+        with tempfile.TemporaryDirectory() as vocab_dir:
+            vocab_path = os.path.join(vocab_dir, 'vocab.txt')
+            with open(vocab_path, 'w', encoding='utf-8') as f:
+                f.write(self._vocab + '\n')
+
+            return BertTokenizer(vocab_path, do_lower_case=self._do_lower_case)
+
+    def load_model(self, model_class, **kwargs):
+        with torch.device('meta'):
+            model = model_class(self.config, **kwargs)
+
+        for name, tensor in load_file(self.path).items():
+            module_name, _, attribute = name.rpartition('.')
+            module = model.get_submodule(module_name)
+
+            current = getattr(module, attribute, None)
+            if current is not None and current.shape != tensor.shape:
+                raise Exception("Shape of '%s' in the model bundle (%s) does not match the model (%s)"
+                                % (name, list(tensor.shape), list(current.shape)))
+
+            if attribute in module._parameters:
+                requires_grad = module._parameters[attribute].requires_grad
+                module._parameters[attribute] = torch.nn.Parameter(tensor, requires_grad=requires_grad)
+            else:
+                module._buffers[attribute] = tensor
+
+        missing = [name for name, tensor in itertools.chain(model.named_parameters(), model.named_buffers())
+                   if tensor.is_meta]
+        if missing:
+            raise Exception("The model bundle '%s' does not match the model, missing: %s" % (self.path, missing))
+
+        model.eval()
+        return model
@@ -0,0 +1,51 @@
+from collections import OrderedDict
+
+import torch
+
+
+class EncoderCache:
+    """ LRU cache of the encoder's hidden states of documents, keyed by the (unpadded) encoding.
+    Repeated texts, e.g. duplicate work orders, are only encoded once during inference """
+
+    def __init__(self, max_bytes: int):
+        self._max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple):
+        h = self._entries.get(key)
+        if h is not None:
+            self._entries.move_to_end(key)
+        return h
+
+    def put(self, key: tuple, h: torch.tensor):
+        size = h.numel() * h.element_size()
+        if size > self._max_bytes or key in self._entries:
+            return
+
+        self._entries[key] = h
+        self._bytes += size
+
+        # evict least recently used entries
+        while self._bytes > self._max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.numel() * evicted.element_size()
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    @property
+    def size_bytes(self):
+        return self._bytes
+
+    def __len__(self):
+        return len(self._entries)
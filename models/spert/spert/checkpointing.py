@@ -0,0 +1,123 @@
+import json
+import os
+import shutil
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+from safetensors import safe_open
+from safetensors.torch import save_file
+
+SAFE_WEIGHTS_NAME = 'model.safetensors'
+WEIGHTS_NAME = 'pytorch_model.bin'
+OPTIMIZER_NAME = 'optimizer.safetensors'
+EXTRA_NAME = 'extra.state'
+
+
+class CheckpointWriter:
+    """ Writes checkpoints (safetensors weights, config, tokenizer, optimizer state and extra state) in a background
+    thread. 'save' snapshots the weights and optimizer state to CPU memory, so training continues while the snapshot is
+    written. At most one checkpoint is in flight (a further 'save' waits for it), which bounds the memory of the
+    snapshots. Checkpoints of a 'group' (e.g. the epoch checkpoints) are removed when more than 'keep_last' of them
+    were written """
+
+    def __init__(self, keep_last: int = 0):
+        self._keep_last = keep_last
+        self._groups = dict()
+
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='checkpoint')
+        self._pending = None
+
+    def save(self, dir_path: str, model, tokenizer, extra_state: dict, optimizer=None, group: str = None):
+        self.wait()
+
+        state_dict = {k: v.detach().to('cpu', copy=True).contiguous() for k, v in model.state_dict().items()}
+        optimizer_state = _snapshot_optimizer(optimizer.state_dict()) if optimizer is not None else None
+
+        self._pending = self._executor.submit(self._write, dir_path, model, tokenizer, state_dict, optimizer_state,
+                                              extra_state, group)
+
+    def _write(self, dir_path, model, tokenizer, state_dict, optimizer_state, extra_state, group):
+        # written next to the target and moved into place, an interrupted write never replaces a complete checkpoint
+        tmp_path = dir_path.rstrip(os.sep) + '.tmp'
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+
+        model.save_pretrained(tmp_path, state_dict=state_dict, safe_serialization=True)
+        tokenizer.save_pretrained(tmp_path)
+        if optimizer_state is not None:
+            tensors, metadata = optimizer_state
+            save_file(tensors, os.path.join(tmp_path, OPTIMIZER_NAME), metadata=metadata)
+        torch.save(extra_state, os.path.join(tmp_path, EXTRA_NAME))
+
+        if os.path.exists(dir_path):
+            shutil.rmtree(dir_path)
+        os.rename(tmp_path, dir_path)
+
+        if group is not None:
+            written = self._groups.setdefault(group, deque())
+            if dir_path not in written:
+                written.append(dir_path)
+            while len(written) > self._keep_last:
+                shutil.rmtree(written.popleft(), ignore_errors=True)
+
+    def wait(self):
+        """ Blocks until the checkpoint in flight is written (and raises its exception, if any) """
+        if self._pending is not None:
+            pending, self._pending = self._pending, None
+            pending.result()
+
+    def close(self):
+        self.wait()
+        self._executor.shutdown()
+
+
+def _snapshot_optimizer(state_dict: dict):
+    """ Tensors of the optimizer state ('state.<param>.<name>', on CPU) and the remaining state (param groups,
+    non-tensor values such as the step of 'transformers.AdamW') as JSON metadata """
+    tensors = dict()
+    values = dict()
+    for param, param_state in state_dict['state'].items():
+        for name, value in param_state.items():
+            if torch.is_tensor(value):
+                tensors['state.%s.%s' % (param, name)] = value.detach().to('cpu', copy=True).contiguous()
+            else:
+                values['%s.%s' % (param, name)] = value
+
+    metadata = dict(param_groups=json.dumps(state_dict['param_groups']), values=json.dumps(values))
+    return tensors, metadata
+
+
+def load_optimizer_state(path: str) -> dict:
+    """ State dict of an 'optimizer.safetensors' file (see 'CheckpointWriter') for 'Optimizer.load_state_dict' """
+    state = dict()
+    with safe_open(path, framework='pt') as f:
+        metadata = f.metadata()
+        for key in f.keys():
+            _, param, name = key.split('.', 2)
+            state.setdefault(int(param), dict())[name] = f.get_tensor(key)
+
+    for key, value in json.loads(metadata['values']).items():
+        param, name = key.split('.', 1)
+        state.setdefault(int(param), dict())[name] = value
+
+    return dict(state=state, param_groups=json.loads(metadata['param_groups']))
+
+
+def state_dict_keys(model_path: str) -> set:
+    """ Parameter names of a checkpoint (directory, weights file or model bundle), without reading the tensors:
+    safetensors headers are parsed, PyTorch weights ('.bin') are memory mapped """
+    if os.path.isdir(model_path):
+        safe_path = os.path.join(model_path, SAFE_WEIGHTS_NAME)
+        model_path = safe_path if os.path.exists(safe_path) else os.path.join(model_path, WEIGHTS_NAME)
+
+    if not model_path.endswith('.bin'):
+        with safe_open(model_path, framework='pt') as f:
+            return set(f.keys())
+
+    try:
+        return set(torch.load(model_path, map_location='cpu', mmap=True))
+    except RuntimeError:
+        # legacy (non zip) serialization cannot be memory mapped
+        return set(torch.load(model_path, map_location='cpu'))
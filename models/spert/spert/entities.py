@@ -1,6 +1,12 @@
-from collections import OrderedDict
-from typing import List
+import array
+import os
+import tempfile
+import weakref
+from typing import Callable, Iterable
+
+import numpy as np
 from torch.utils.data import Dataset as TorchDataset
+from torch.utils.data import IterableDataset, get_worker_info
 
 from spert import sampling
 
@@ -80,106 +86,318 @@ class EntityType:
         return hash(self._identifier)
 
 
+def _remove_shared_file(path, pid):
+    if os.getpid() == pid and os.path.exists(path):
+        os.remove(path)
+
+
+class DocumentStore:
+    """ Struct-of-arrays storage of the tokens, entity mentions, relations and documents of a dataset. Rows are
+    appended to flat arrays while reading and frozen into NumPy arrays before sampling. 'Token', 'TokenSpan',
+    'Entity', 'Relation' and 'Document' are light views (indices into the store), so a corpus is not held as millions
+    of Python objects, which data loader workers would otherwise copy (reference counting writes to their pages) """
+
+    # flat columns and their array type codes, pairs (spans, token ranges, head/tail) are stored consecutively
+    COLUMNS = dict(
+        token_indices='i',  # original token index in document
+        token_spans='i',  # (start, end) of token span in document encoding, end exclusive
+        entity_types='i',  # entity type index
+        entity_tokens='i',  # (first, last + 1) token id of entity mention
+        entity_spans='i',  # (start, end) of entity span in document encoding, end exclusive
+        entity_probas='f',  # probability of the entity type (1 for gold labels, < 1 for soft labels of a teacher)
+        relation_types='i',  # relation type index
+        relation_entities='i',  # (head, tail) entity id of relation
+        relation_reverse='b',
+        relation_probas='f',  # probability of the relation type (see 'entity_probas')
+        doc_tokens='q',  # offsets of the tokens, entities, relations and encoding of every document
+        doc_entities='q',
+        doc_relations='q',
+        doc_encodings='q',
+        encodings='i',  # byte-pair document encodings including special tokens ([CLS] and [SEP])
+        doc_weights='f',  # training sample weight (e.g. number of collapsed duplicates)
+    )
+    OFFSET_COLUMNS = ('doc_tokens', 'doc_entities', 'doc_relations', 'doc_encodings')
+
+    def __init__(self):
+        self._columns = {name: array.array(code) for name, code in DocumentStore.COLUMNS.items()}
+        for name in DocumentStore.OFFSET_COLUMNS:
+            self._columns[name].append(0)
+        self._token_phrases = []
+
+        # frozen columns (and UTF-8 encoded token phrases)
+        self._arrays = None
+
+        # file of the memory mapped arrays (see 'share')
+        self._shared_path = None
+        self._shared_layout = None
+        self._shared_cleanup = None
+
+        # type objects by index
+        self._entity_types = dict()
+        self._relation_types = dict()
+
+    def add_token(self, idx, span_start, span_end, phrase) -> int:
+        self._thaw()
+        self._columns['token_indices'].append(idx)
+        self._columns['token_spans'].extend((span_start, span_end))
+        self._token_phrases.append(phrase)
+        return self.token_count - 1
+
+    def add_entity(self, entity_type, first_token: int, end_token: int, proba: float = 1.0) -> int:
+        self._thaw()
+        token_spans = self._columns['token_spans']
+        self._entity_types[entity_type.index] = entity_type
+        self._columns['entity_types'].append(entity_type.index)
+        self._columns['entity_tokens'].extend((first_token, end_token))
+        self._columns['entity_spans'].extend((token_spans[2 * first_token], token_spans[2 * end_token - 1]))
+        self._columns['entity_probas'].append(proba)
+        return self.entity_count - 1
+
+    def add_relation(self, relation_type, head: int, tail: int, reverse: bool, proba: float = 1.0) -> int:
+        self._thaw()
+        self._relation_types[relation_type.index] = relation_type
+        self._columns['relation_types'].append(relation_type.index)
+        self._columns['relation_entities'].extend((head, tail))
+        self._columns['relation_reverse'].append(reverse)
+        self._columns['relation_probas'].append(proba)
+        return self.relation_count - 1
+
+    def add_document(self, encoding, weight) -> int:
+        """ The document consists of the tokens, entities and relations added since the previous document """
+        self._thaw()
+        columns = self._columns
+        columns['doc_tokens'].append(self.token_count)
+        columns['doc_entities'].append(self.entity_count)
+        columns['doc_relations'].append(self.relation_count)
+        columns['encodings'].extend(encoding)
+        columns['doc_encodings'].append(len(columns['encodings']))
+        columns['doc_weights'].append(weight)
+        return self.document_count - 1
+
+    def freeze(self):
+        """ Converts the columns to (read-only) NumPy arrays, which are shared by forked data loader workers """
+        if self._arrays is not None:
+            return
+
+        # NumPy arrays share the memory of the columns
+        self._arrays = {name: np.frombuffer(column, dtype=column.typecode) if column else
+                        np.zeros(0, dtype=column.typecode) for name, column in self._columns.items()}
+        self._columns = None
+
+        phrases = [p.encode('utf-8') for p in self._token_phrases]
+        self._arrays['phrases'] = np.frombuffer(b''.join(phrases), dtype=np.uint8)
+        self._arrays['phrase_offsets'] = np.zeros(len(phrases) + 1, dtype=np.int64)
+        np.cumsum([len(p) for p in phrases], out=self._arrays['phrase_offsets'][1:])
+        self._token_phrases = None
+
+    def share(self, directory: str = None):
+        """ Moves the frozen arrays into a single memory mapped file (by default in '/dev/shm', i.e. shared memory on
+        Linux). Forked data loader workers share its pages, spawned workers map the file again when unpickling the
+        store, so no worker holds a private copy of the dataset """
+        self.freeze()
+        if self._shared_path is not None:
+            return
+
+        if directory is None and os.path.isdir('/dev/shm'):
+            directory = '/dev/shm'
+
+        # arrays are aligned to 8 bytes
+        layout, file_size = [], 0
+        for name, a in self._arrays.items():
+            layout.append((name, a.dtype.str, file_size, a.size))
+            file_size += -(-a.nbytes // 8) * 8
+
+        fd, path = tempfile.mkstemp(prefix='spert_dataset_', suffix='.bin', dir=directory)
+        with os.fdopen(fd, 'wb') as f:
+            for name, _, offset, _ in layout:
+                f.seek(offset)
+                f.write(self._arrays[name].tobytes())
+            f.truncate(file_size)
+
+        self._shared_path, self._shared_layout = path, layout
+        self._arrays = self._map_shared()
+        # the file is removed with the store of the creating process (not by forked workers)
+        self._shared_cleanup = weakref.finalize(self, _remove_shared_file, path, os.getpid())
+
+    def _map_shared(self):
+        data = np.memmap(self._shared_path, dtype=np.uint8, mode='r')
+        return {name: data[offset:offset + size * np.dtype(dtype).itemsize].view(dtype)
+                for name, dtype, offset, size in self._shared_layout}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_shared_cleanup'] = None
+        if self._shared_path is not None:
+            # pickled stores (e.g. spawned workers) map the file instead of copying the arrays
+            state['_arrays'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self._shared_path is not None:
+            self._arrays = self._map_shared()
+
+    def _thaw(self):
+        # documents are appended after the store has been frozen (e.g. by sampling while reading)
+        if self._arrays is None:
+            return
+
+        self._token_phrases = [self.token_phrase(tid) for tid in range(len(self._arrays['phrase_offsets']) - 1)]
+        self._columns = {name: array.array(code, self._arrays[name].tobytes())
+                         for name, code in DocumentStore.COLUMNS.items()}
+        self._arrays = None
+
+        # appended documents are not shared
+        if self._shared_cleanup is not None:
+            self._shared_cleanup()
+        self._shared_path, self._shared_layout, self._shared_cleanup = None, None, None
+
+    def column(self, name):
+        """ Flat column (array or NumPy array if frozen) for element access """
+        return self._columns[name] if self._arrays is None else self._arrays[name]
+
+    def array(self, name) -> np.ndarray:
+        """ Flat NumPy array of a column, freezes the store """
+        self.freeze()
+        return self._arrays[name]
+
+    def token_phrase(self, tid: int) -> str:
+        if self._arrays is None:
+            return self._token_phrases[tid]
+        offsets = self._arrays['phrase_offsets']
+        return self._arrays['phrases'][offsets[tid]:offsets[tid + 1]].tobytes().decode('utf-8')
+
+    def entity_type(self, idx: int):
+        return self._entity_types[idx]
+
+    def relation_type(self, idx: int):
+        return self._relation_types[idx]
+
+    def offsets(self, name, doc_id: int):
+        column = self.column(name)
+        return int(column[doc_id]), int(column[doc_id + 1])
+
+    @property
+    def token_count(self):
+        return len(self.column('token_indices'))
+
+    @property
+    def entity_count(self):
+        return len(self.column('entity_types'))
+
+    @property
+    def relation_count(self):
+        return len(self.column('relation_types'))
+
+    @property
+    def document_count(self):
+        return len(self.column('doc_weights'))
+
+
 class Token:
-    def __init__(self, tid: int, index: int, span_start: int, span_end: int, phrase: str):
-        self._tid = tid  # ID within the corresponding dataset
-        self._index = index  # original token index in document
+    __slots__ = ('_store', '_tid')
 
-        self._span_start = span_start  # start of token span in document (inclusive)
-        self._span_end = span_end  # end of token span in document (exclusive)
-        self._phrase = phrase
+    def __init__(self, store: DocumentStore, tid: int):
+        self._store = store
+        self._tid = tid  # ID within the corresponding dataset
 
     @property
     def index(self):
-        return self._index
+        return int(self._store.column('token_indices')[self._tid])
 
     @property
     def span_start(self):
-        return self._span_start
+        return int(self._store.column('token_spans')[2 * self._tid])
 
     @property
     def span_end(self):
-        return self._span_end
+        return int(self._store.column('token_spans')[2 * self._tid + 1])
 
     @property
     def span(self):
-        return self._span_start, self._span_end
+        return self.span_start, self.span_end
 
     @property
     def phrase(self):
-        return self._phrase
+        return self._store.token_phrase(self._tid)
 
     def __eq__(self, other):
         if isinstance(other, Token):
-            return self._tid == other._tid
+            return self._store is other._store and self._tid == other._tid
         return False
 
     def __hash__(self):
         return hash(self._tid)
 
     def __str__(self):
-        return self._phrase
+        return self.phrase
 
     def __repr__(self):
-        return self._phrase
+        return self.phrase
 
 
 class TokenSpan:
-    def __init__(self, tokens):
-        self._tokens = tokens
+    __slots__ = ('_store', '_start', '_end')
+
+    def __init__(self, store: DocumentStore, start: int, end: int):
+        self._store = store
+        # token ids (end exclusive)
+        self._start = start
+        self._end = end
 
     @property
     def span_start(self):
-        return self._tokens[0].span_start
+        return self[0].span_start
 
     @property
     def span_end(self):
-        return self._tokens[-1].span_end
+        return self[-1].span_end
 
     @property
     def span(self):
         return self.span_start, self.span_end
 
     def __getitem__(self, s):
+        tids = range(self._start, self._end)[s]
         if isinstance(s, slice):
-            return TokenSpan(self._tokens[s.start:s.stop:s.step])
+            assert tids.step == 1, "token spans are contiguous"
+            return TokenSpan(self._store, tids.start, tids.start + len(tids))
         else:
-            return self._tokens[s]
+            return Token(self._store, tids)
 
     def __iter__(self):
-        return iter(self._tokens)
+        return (Token(self._store, tid) for tid in range(self._start, self._end))
 
     def __len__(self):
-        return len(self._tokens)
+        return self._end - self._start
 
 
 class Entity:
-    def __init__(self, eid: int, entity_type: EntityType, tokens: List[Token], phrase: str):
-        self._eid = eid  # ID within the corresponding dataset
+    __slots__ = ('_store', '_eid')
 
-        self._entity_type = entity_type
-
-        self._tokens = tokens
-        self._phrase = phrase
+    def __init__(self, store: DocumentStore, eid: int):
+        self._store = store
+        self._eid = eid  # ID within the corresponding dataset
 
     def as_tuple(self):
-        return self.span_start, self.span_end, self._entity_type
+        return self.span_start, self.span_end, self.entity_type
 
     @property
     def entity_type(self):
-        return self._entity_type
+        return self._store.entity_type(int(self._store.column('entity_types')[self._eid]))
 
     @property
     def tokens(self):
-        return TokenSpan(self._tokens)
+        entity_tokens = self._store.column('entity_tokens')
+        return TokenSpan(self._store, int(entity_tokens[2 * self._eid]), int(entity_tokens[2 * self._eid + 1]))
 
     @property
     def span_start(self):
-        return self._tokens[0].span_start
+        return int(self._store.column('entity_spans')[2 * self._eid])
 
     @property
     def span_end(self):
-        return self._tokens[-1].span_end
+        return int(self._store.column('entity_spans')[2 * self._eid + 1])
 
     @property
     def span(self):
@@ -187,71 +405,72 @@ class Entity:
 
     @property
     def phrase(self):
-        return self._phrase
+        return " ".join([t.phrase for t in self.tokens])
+
+    @property
+    def proba(self):
+        return float(self._store.column('entity_probas')[self._eid])
 
     def __eq__(self, other):
         if isinstance(other, Entity):
-            return self._eid == other._eid
+            return self._store is other._store and self._eid == other._eid
         return False
 
     def __hash__(self):
         return hash(self._eid)
 
     def __str__(self):
-        return self._phrase
+        return self.phrase
 
 
 class Relation:
-    def __init__(self, rid: int, relation_type: RelationType, head_entity: Entity,
-                 tail_entity: Entity, reverse: bool = False):
-        self._rid = rid  # ID within the corresponding dataset
-        self._relation_type = relation_type
-
-        self._head_entity = head_entity
-        self._tail_entity = tail_entity
-
-        self._reverse = reverse
+    __slots__ = ('_store', '_rid')
 
-        self._first_entity = head_entity if not reverse else tail_entity
-        self._second_entity = tail_entity if not reverse else head_entity
+    def __init__(self, store: DocumentStore, rid: int):
+        self._store = store
+        self._rid = rid  # ID within the corresponding dataset
 
     def as_tuple(self):
-        head = self._head_entity
-        tail = self._tail_entity
+        head = self.head_entity
+        tail = self.tail_entity
         head_start, head_end = (head.span_start, head.span_end)
         tail_start, tail_end = (tail.span_start, tail.span_end)
 
         t = ((head_start, head_end, head.entity_type),
-             (tail_start, tail_end, tail.entity_type), self._relation_type)
+             (tail_start, tail_end, tail.entity_type), self.relation_type)
         return t
 
     @property
     def relation_type(self):
-        return self._relation_type
+        return self._store.relation_type(int(self._store.column('relation_types')[self._rid]))
 
     @property
     def head_entity(self):
-        return self._head_entity
+        return Entity(self._store, int(self._store.column('relation_entities')[2 * self._rid]))
 
     @property
     def tail_entity(self):
-        return self._tail_entity
+        return Entity(self._store, int(self._store.column('relation_entities')[2 * self._rid + 1]))
 
     @property
     def first_entity(self):
-        return self._first_entity
+        return self.head_entity if not self.reverse else self.tail_entity
 
     @property
     def second_entity(self):
-        return self._second_entity
+        return self.tail_entity if not self.reverse else self.head_entity
 
     @property
     def reverse(self):
-        return self._reverse
+        return bool(self._store.column('relation_reverse')[self._rid])
+
+    @property
+    def proba(self):
+        return float(self._store.column('relation_probas')[self._rid])
 
     def __eq__(self, other):
         if isinstance(other, Relation):
-            return self._rid == other._rid
+            return self._store is other._store and self._rid == other._rid
         return False
 
     def __hash__(self):
@@ -259,16 +478,11 @@ class Relation:
 
 
 class Document:
-    def __init__(self, doc_id: int, tokens: List[Token], entities: List[Entity], relations: List[Relation],
-                 encoding: List[int]):
-        self._doc_id = doc_id  # ID within the corresponding dataset
+    __slots__ = ('_store', '_doc_id')
 
-        self._tokens = tokens
-        self._entities = entities
-        self._relations = relations
-
-        # byte-pair document encoding including special tokens ([CLS] and [SEP])
-        self._encoding = encoding
+    def __init__(self, store: DocumentStore, doc_id: int):
+        self._store = store
+        self._doc_id = doc_id  # ID within the corresponding dataset
 
     @property
     def doc_id(self):
@@ -276,27 +490,76 @@ class Document:
 
     @property
     def entities(self):
-        return self._entities
+        start, end = self._store.offsets('doc_entities', self._doc_id)
+        return [Entity(self._store, eid) for eid in range(start, end)]
 
     @property
     def relations(self):
-        return self._relations
+        start, end = self._store.offsets('doc_relations', self._doc_id)
+        return [Relation(self._store, rid) for rid in range(start, end)]
 
     @property
     def tokens(self):
-        return TokenSpan(self._tokens)
+        return TokenSpan(self._store, *self._store.offsets('doc_tokens', self._doc_id))
 
     @property
     def encoding(self):
-        return self._encoding
+        start, end = self._store.offsets('doc_encodings', self._doc_id)
+        return self._store.column('encodings')[start:end].tolist()
 
-    @encoding.setter
-    def encoding(self, value):
-        self._encoding = value
+    @property
+    def weight(self):
+        return float(self._store.column('doc_weights')[self._doc_id])
+
+    # array views of the document (used for sampling)
+
+    @property
+    def token_spans(self) -> np.ndarray:
+        start, end = self._store.offsets('doc_tokens', self._doc_id)
+        return self._store.array('token_spans')[2 * start:2 * end].reshape(-1, 2)
+
+    @property
+    def entity_spans(self) -> np.ndarray:
+        start, end = self._store.offsets('doc_entities', self._doc_id)
+        return self._store.array('entity_spans')[2 * start:2 * end].reshape(-1, 2)
+
+    @property
+    def entity_sizes(self) -> np.ndarray:
+        """ Number of tokens of every entity """
+        start, end = self._store.offsets('doc_entities', self._doc_id)
+        entity_tokens = self._store.array('entity_tokens')[2 * start:2 * end].reshape(-1, 2)
+        return entity_tokens[:, 1] - entity_tokens[:, 0]
+
+    @property
+    def entity_type_indices(self) -> np.ndarray:
+        start, end = self._store.offsets('doc_entities', self._doc_id)
+        return self._store.array('entity_types')[start:end]
+
+    @property
+    def entity_probas(self) -> np.ndarray:
+        start, end = self._store.offsets('doc_entities', self._doc_id)
+        return self._store.array('entity_probas')[start:end]
+
+    @property
+    def relation_pairs(self) -> np.ndarray:
+        """ Head and tail of every relation as index into the entities of the document """
+        start, end = self._store.offsets('doc_relations', self._doc_id)
+        entity_start, _ = self._store.offsets('doc_entities', self._doc_id)
+        return self._store.array('relation_entities')[2 * start:2 * end].reshape(-1, 2) - entity_start
+
+    @property
+    def relation_type_indices(self) -> np.ndarray:
+        start, end = self._store.offsets('doc_relations', self._doc_id)
+        return self._store.array('relation_types')[start:end]
+
+    @property
+    def relation_probas(self) -> np.ndarray:
+        start, end = self._store.offsets('doc_relations', self._doc_id)
+        return self._store.array('relation_probas')[start:end]
 
     def __eq__(self, other):
         if isinstance(other, Document):
-            return self._doc_id == other._doc_id
+            return self._store is other._store and self._doc_id == other._doc_id
         return False
 
     def __hash__(self):
@@ -344,15 +607,7 @@ class Dataset(TorchDataset):
         self._max_span_size = max_span_size
         self._mode = Dataset.TRAIN_MODE
 
-        self._documents = OrderedDict()
-        self._entities = OrderedDict()
-        self._relations = OrderedDict()
-
-        # current ids
-        self._doc_id = 0
-        self._rid = 0
-        self._eid = 0
-        self._tid = 0
+        self._store = DocumentStore()
 
     def iterate_documents(self, batch_size, order=None, truncate=False):
         return BatchIterator(self.documents, batch_size, order=order, truncate=truncate)
@@ -361,34 +616,35 @@ class Dataset(TorchDataset):
         return BatchIterator(self.relations, batch_size, order=order, truncate=truncate)
 
     def create_token(self, idx, span_start, span_end, phrase) -> Token:
-        token = Token(self._tid, idx, span_start, span_end, phrase)
-        self._tid += 1
-        return token
+        return Token(self._store, self._store.add_token(idx, span_start, span_end, phrase))
+
+    def create_document(self, tokens, entity_mentions, relations, doc_encoding, weight=1.0) -> Document:
+        # tokens, entity mentions and relations of a document are created (i.e. stored) right before the document
+        return Document(self._store, self._store.add_document(doc_encoding, weight))
 
-    def create_document(self, tokens, entity_mentions, relations, doc_encoding) -> Document:
-        document = Document(self._doc_id, tokens, entity_mentions, relations, doc_encoding)
-        self._documents[self._doc_id] = document
-        self._doc_id += 1
+    def create_entity(self, entity_type, tokens, phrase, proba=1.0) -> Entity:
+        # the phrase is derived from the tokens
+        eid = self._store.add_entity(entity_type, tokens[0]._tid, tokens[-1]._tid + 1, proba)
+        return Entity(self._store, eid)
 
-        return document
+    def create_relation(self, relation_type, head_entity, tail_entity, reverse=False, proba=1.0) -> Relation:
+        rid = self._store.add_relation(relation_type, head_entity._eid, tail_entity._eid, reverse, proba)
+        return Relation(self._store, rid)
 
-    def create_entity(self, entity_type, tokens, phrase) -> Entity:
-        mention = Entity(self._eid, entity_type, tokens, phrase)
-        self._entities[self._eid] = mention
-        self._eid += 1
-        return mention
+    def freeze(self):
+        """ Converts the stored documents to NumPy arrays (call after reading, before forking data loader workers) """
+        self._store.freeze()
 
-    def create_relation(self, relation_type, head_entity, tail_entity, reverse=False) -> Relation:
-        relation = Relation(self._rid, relation_type, head_entity, tail_entity, reverse)
-        self._relations[self._rid] = relation
-        self._rid += 1
-        return relation
+    def share(self, directory: str = None):
+        """ Moves the stored documents to a memory mapped file, which data loader workers share (see 'DocumentStore')
+        """
+        self._store.share(directory)
 
     def __len__(self):
-        return len(self._documents)
+        return self._store.document_count
 
     def __getitem__(self, index: int):
-        doc = self._documents[index]
+        doc = Document(self._store, index)
 
         if self._mode == Dataset.TRAIN_MODE:
             return sampling.create_train_sample(doc, self._neg_entity_count, self._neg_rel_count,
@@ -409,24 +665,86 @@ class Dataset(TorchDataset):
 
     @property
     def documents(self):
-        return list(self._documents.values())
+        return [Document(self._store, doc_id) for doc_id in range(self._store.document_count)]
 
     @property
     def entities(self):
-        return list(self._entities.values())
+        return [Entity(self._store, eid) for eid in range(self._store.entity_count)]
 
     @property
     def relations(self):
-        return list(self._relations.values())
+        return [Relation(self._store, rid) for rid in range(self._store.relation_count)]
 
     @property
     def document_count(self):
-        return len(self._documents)
+        return self._store.document_count
 
     @property
     def entity_count(self):
-        return len(self._entities)
+        return self._store.entity_count
 
     @property
     def relation_count(self):
-        return len(self._relations)
+        return self._store.relation_count
+
+    @property
+    def soft_labels(self):
+        """ True if any entity or relation has a probability below 1, i.e. soft labels of a teacher model """
+        return bool((self._store.array('entity_probas') < 1).any() or (self._store.array('relation_probas') < 1).any())
+
+
+class StreamingDataset(IterableDataset):
+    """ Prediction dataset that parses the documents of an input stream while iterating. Documents are neither
+    stored nor counted, each evaluation sample carries its document (see 'sampling.collate_fn_streaming'), so memory
+    does not grow with the input size. With multiple data loader workers, every worker parses all documents but
+    only creates the samples of every n-th batch, which keeps the document order """
+
+    def __init__(self, label, rel_types, entity_types, max_span_size, batch_size: int,
+                 documents: Callable[[], Iterable], parse_document: Callable):
+        self._label = label
+        self._rel_types = rel_types
+        self._entity_types = entity_types
+        self._max_span_size = max_span_size
+        self._batch_size = batch_size
+
+        # 'documents' returns a new iterator of the raw (JSON) documents, 'parse_document(raw, dataset)'
+        # creates a 'Document' with the 'create_*' methods of the dataset
+        self._documents = documents
+        self._parse_document = parse_document
+
+        self._store = None
+
+    def __iter__(self):
+        worker_info = get_worker_info()
+        worker_id, worker_count = (worker_info.id, worker_info.num_workers) if worker_info else (0, 1)
+
+        for i, raw_document in enumerate(self._documents()):
+            if (i // self._batch_size) % worker_count != worker_id:
+                continue
+
+            # every document has its own (small) store, which is released with the batch
+            self._store = DocumentStore()
+            doc = self._parse_document(raw_document, self)
+            sample = sampling.create_eval_sample(doc, self._max_span_size)
+            sample['document'] = doc
+            yield sample
+
+    def create_token(self, idx, span_start, span_end, phrase) -> Token:
+        return Token(self._store, self._store.add_token(idx, span_start, span_end, phrase))
+
+    def create_document(self, tokens, entity_mentions, relations, doc_encoding, weight=1.0) -> Document:
+        # tokens, entity mentions and relations of a document are created (i.e. stored) right before the document
+        return Document(self._store, self._store.add_document(doc_encoding, weight))
+
+    def create_entity(self, entity_type, tokens, phrase, proba=1.0) -> Entity:
+        # the phrase is derived from the tokens
+        eid = self._store.add_entity(entity_type, tokens[0]._tid, tokens[-1]._tid + 1, proba)
+        return Entity(self._store, eid)
+
+    def create_relation(self, relation_type, head_entity, tail_entity, reverse=False, proba=1.0) -> Relation:
+        rid = self._store.add_relation(relation_type, head_entity._eid, tail_entity._eid, reverse, proba)
+        return Relation(self._store, rid)
+
+    @property
+    def label(self):
+        return self._label
@@ -4,13 +4,13 @@ import warnings
 from typing import List, Tuple, Dict
 
 import torch
-from sklearn.metrics import precision_recall_fscore_support as prfs
 from transformers import BertTokenizer
 
+from spert import opt
 from spert import prediction
+from spert import util
 from spert.entities import Document, Dataset, EntityType
 from spert.input_reader import BaseInputReader
-from spert.opt import jinja2
 
 SCRIPT_PATH = os.path.dirname(os.path.realpath(__file__))
 
@@ -26,10 +26,13 @@ class Evaluator:
         predictions_path: str,
         examples_path: str,
         example_count: int,
+        documents: List[Document] = None,
     ):
         self._text_encoder = text_encoder
         self._input_reader = input_reader
         self._dataset = dataset
+        # evaluated documents (the shard of this rank in distributed evaluation)
+        self._documents = documents if documents is not None else dataset.documents
         self._rel_filter_threshold = rel_filter_threshold
         self._no_overlapping = no_overlapping
 
@@ -50,7 +53,7 @@ class Evaluator:
             "Entity", 1, "Entity", "Entity"
         )  # for span only evaluation
 
-        self._convert_gt(self._dataset.documents)
+        self._convert_gt(self._documents)
 
     def eval_batch(
         self,
@@ -72,58 +75,72 @@ class Evaluator:
         self._pred_entities.extend(batch_pred_entities)
         self._pred_relations.extend(batch_pred_relations)
 
-    def compute_scores(self):
-        print("Evaluation")
+    def compute_scores(self, entity_type_map: Dict[EntityType, EntityType] = None):
+        """Computes NER and relation scores. With 'entity_type_map', entity types (of ground truth and predictions)
+        are mapped before scoring, e.g. to a coarser level of the entity type hierarchy"""
+        # in distributed evaluation, counts are reduced across ranks and only the main process prints
+        print_results = util.is_main_process()
 
-        print("")
-        print("--- Entities (named entity recognition (NER)) ---")
-        print(
-            "An entity is considered correct if the entity type and span is predicted correctly"
-        )
-        print("")
+        if print_results:
+            print("Evaluation")
+
+            print("")
+            print("--- Entities (named entity recognition (NER)) ---")
+            print(
+                "An entity is considered correct if the entity type and span is predicted correctly"
+            )
+            print("")
         gt, pred = self._convert_by_setting(
-            self._gt_entities, self._pred_entities, include_entity_types=True
-        )
-        ner_eval = self._score(gt, pred, print_results=True)
-
-        print("")
-        print("--- Relations ---")
-        print("")
-        print("Without named entity classification (NEC)")
-        print(
-            "A relation is considered correct if the relation type and the spans of the two "
-            "related entities are predicted correctly (entity type is not considered)"
+            self._gt_entities,
+            self._pred_entities,
+            include_entity_types=True,
+            entity_type_map=entity_type_map,
         )
-        print("")
+        ner_eval = self._score(gt, pred, print_results=print_results, reduce=True)
+
+        if print_results:
+            print("")
+            print("--- Relations ---")
+            print("")
+            print("Without named entity classification (NEC)")
+            print(
+                "A relation is considered correct if the relation type and the spans of the two "
+                "related entities are predicted correctly (entity type is not considered)"
+            )
+            print("")
         gt, pred = self._convert_by_setting(
             self._gt_relations, self._pred_relations, include_entity_types=False
         )
-        rel_eval = self._score(gt, pred, print_results=True)
+        rel_eval = self._score(gt, pred, print_results=print_results, reduce=True)
 
-        print("")
-        print("With named entity classification (NEC)")
-        print(
-            "A relation is considered correct if the relation type and the two "
-            "related entities are predicted correctly (in span and entity type)"
-        )
-        print("")
+        if print_results:
+            print("")
+            print("With named entity classification (NEC)")
+            print(
+                "A relation is considered correct if the relation type and the two "
+                "related entities are predicted correctly (in span and entity type)"
+            )
+            print("")
         gt, pred = self._convert_by_setting(
-            self._gt_relations, self._pred_relations, include_entity_types=True
+            self._gt_relations,
+            self._pred_relations,
+            include_entity_types=True,
+            entity_type_map=entity_type_map,
         )
-        rel_nec_eval = self._score(gt, pred, print_results=True)
+        rel_nec_eval = self._score(gt, pred, print_results=print_results, reduce=True)
 
         return ner_eval, rel_eval, rel_nec_eval
 
     def store_predictions(self):
         prediction.store_predictions(
-            self._dataset.documents,
+            self._documents,
             self._pred_entities,
             self._pred_relations,
             self._predictions_path,
         )
 
     def store_examples(self):
-        if jinja2 is None:
+        if opt.jinja2 is None:
             warnings.warn("Examples cannot be stored since Jinja2 is not installed.")
             return
 
@@ -131,7 +148,7 @@ class Evaluator:
         rel_examples = []
         rel_examples_nec = []
 
-        for i, doc in enumerate(self._dataset.documents):
+        for i, doc in enumerate(self._documents):
             # entities
             entity_example = self._convert_example(
                 doc,
@@ -235,9 +252,13 @@ class Evaluator:
         pred: List[List[Tuple]],
         include_entity_types: bool = True,
         include_score: bool = False,
+        entity_type_map: Dict[EntityType, EntityType] = None,
     ):
         assert len(gt) == len(pred)
 
+        def map_entity(e):
+            return (e[0], e[1], entity_type_map[e[2]])
+
         # either include or remove entity types based on setting
         def convert(t):
             if not include_entity_types:
@@ -253,6 +274,13 @@ class Evaluator:
             else:
                 c = list(t[:3])
 
+                if entity_type_map is not None:
+                    # e.g. coarser level of the entity type hierarchy
+                    if type(t[0]) == int:  # entity
+                        c = list(map_entity(c))
+                    else:  # relation
+                        c = [map_entity(c[0]), map_entity(c[1]), c[2]]
+
             if include_score and len(t) > 3:
                 # include prediction scores
                 c.append(t[3])
@@ -272,6 +300,7 @@ class Evaluator:
         gt: List[List[Tuple]],
         pred: List[List[Tuple]],
         print_results: bool = False,
+        reduce: bool = False,
     ):
         assert len(gt) == len(pred)
 
@@ -299,10 +328,18 @@ class Evaluator:
                 else:
                     pred_flat.append(0)
 
+        if reduce and util.is_distributed():
+            return self._compute_reduced_metrics(
+                gt_flat, pred_flat, types, print_results
+            )
+
         metrics = self._compute_metrics(gt_flat, pred_flat, types, print_results)
         return metrics
 
     def _compute_metrics(self, gt_all, pred_all, types, print_results: bool = False):
+        # scikit-learn is only imported when scores are computed (not for prediction)
+        from sklearn.metrics import precision_recall_fscore_support as prfs
+
         labels = [t.index for t in types]
         per_type = prfs(gt_all, pred_all, labels=labels, average=None, zero_division=0)
         micro = prfs(gt_all, pred_all, labels=labels, average="micro", zero_division=0)[
@@ -323,6 +360,63 @@ class Evaluator:
 
         return [m * 100 for m in micro + macro]
 
+    def _compute_reduced_metrics(self, gt_all, pred_all, types, print_results: bool = False):
+        """Computes the metrics of '_compute_metrics' from true positive, false positive and false negative
+        counts per type, which are summed over all ranks"""
+        # the types occurring on any rank
+        gathered_types = [None] * torch.distributed.get_world_size()
+        torch.distributed.all_gather_object(gathered_types, {t.index: t for t in types})
+        types_by_index = {}
+        for rank_types in gathered_types:
+            types_by_index.update(rank_types)
+        types = [types_by_index[index] for index in sorted(types_by_index)]
+
+        # columns: true positives, false positives, false negatives
+        counts = torch.zeros((max(types_by_index, default=0) + 1, 3), dtype=torch.long)
+        for gt, pred in zip(gt_all, pred_all):
+            if gt == pred:
+                counts[gt, 0] += 1
+            else:
+                counts[pred, 1] += 1
+                counts[gt, 2] += 1
+
+        device = (
+            torch.device("cuda", torch.cuda.current_device())
+            if torch.distributed.get_backend() == "nccl"
+            else torch.device("cpu")
+        )
+        counts = counts.to(device)
+        torch.distributed.all_reduce(counts)
+        counts = counts.cpu()
+
+        labels = [t.index for t in types]
+        tp, fp, fn = counts[labels].double().unbind(-1)
+
+        def prf(tp, fp, fn):
+            precision = torch.where(tp + fp > 0, tp / (tp + fp), torch.zeros_like(tp))
+            recall = torch.where(tp + fn > 0, tp / (tp + fn), torch.zeros_like(tp))
+            f1 = torch.where(
+                precision + recall > 0,
+                2 * precision * recall / (precision + recall),
+                torch.zeros_like(tp),
+            )
+            return precision, recall, f1
+
+        per_type = [m.tolist() for m in prf(tp, fp, fn)] + [(tp + fn).long().tolist()]
+        micro = tuple(m.item() for m in prf(tp.sum(), fp.sum(), fn.sum()))
+        macro = tuple(sum(m) / len(m) if m else 0.0 for m in per_type[:-1])
+        total_support = sum(per_type[-1])
+
+        if print_results:
+            self._print_results(
+                per_type,
+                list(micro) + [total_support],
+                list(macro) + [total_support],
+                types,
+            )
+
+        return [m * 100 for m in micro + macro]
+
     def _print_results(self, per_type: List, micro: List, macro: List, types: List):
         columns = ("type", "precision", "recall", "f1-score", "support")
 
@@ -499,7 +593,7 @@ class Evaluator:
 
         # read template
         with open(os.path.join(SCRIPT_PATH, template_path)) as f:
-            template = jinja2.Template(f.read())
+            template = opt.jinja2.Template(f.read())
 
         # write to disc
         template.stream(examples=examples).dump(file_path)
@@ -1,14 +1,15 @@
+import functools
 import json
 from abc import abstractmethod, ABC
 from collections import OrderedDict
 from logging import Logger
-from typing import List
+from typing import Dict, List
 from tqdm import tqdm
 from transformers import BertTokenizer
 
+from spert import opt
 from spert import util
-from spert.entities import Dataset, EntityType, RelationType, Entity, Relation, Document
-from spert.opt import spacy
+from spert.entities import Dataset, EntityType, RelationType, Entity, Relation, Document, StreamingDataset
 
 
 class BaseInputReader(ABC):
@@ -22,9 +23,14 @@ class BaseInputReader(ABC):
         logger: Logger = None,
         **kwargs
     ):
-        types = json.load(
-            open(types_path), object_pairs_hook=OrderedDict
-        )  # entity + relation types
+        if isinstance(types_path, dict):
+            # already loaded, e.g. the types of a model bundle
+            types = types_path
+        else:
+            with open(types_path) as types_file:
+                types = json.load(
+                    types_file, object_pairs_hook=OrderedDict
+                )  # entity + relation types
 
         self._entity_types = OrderedDict()
         self._idx2entity_type = OrderedDict()
@@ -69,10 +75,38 @@ class BaseInputReader(ABC):
 
         self._vocabulary_size = tokenizer.vocab_size
 
+        # entity type hierarchy (created on first access)
+        self._entity_type_levels = None
+        self._entity_type_parents = None
+
     @abstractmethod
     def read(self, dataset_path, dataset_label):
         pass
 
+    def stream(self, dataset_path, dataset_label, batch_size) -> StreamingDataset:
+        """Returns a dataset that parses the documents of `dataset_path` (preferably JSON lines) lazily while
+        iterating, for prediction on inputs that do not fit into memory"""
+        return StreamingDataset(
+            dataset_label,
+            self._relation_types,
+            self._entity_types,
+            self._max_span_size,
+            batch_size,
+            documents=functools.partial(util.iter_json_documents, dataset_path),
+            parse_document=self._parse_document,
+        )
+
+    def _parse_dataset(self, dataset_path, dataset):
+        # JSON lines are parsed (and documents created) incrementally
+        documents = util.iter_json_documents(dataset_path)
+        for document in tqdm(documents, desc="Parse dataset '%s'" % dataset.label):
+            self._parse_document(document, dataset)
+        dataset.freeze()
+
+    @abstractmethod
+    def _parse_document(self, document, dataset) -> Document:
+        pass
+
     def get_dataset(self, label) -> Dataset:
         return self._datasets[label]
 
@@ -84,6 +118,73 @@ class BaseInputReader(ABC):
         relation = self._idx2relation_type[idx]
         return relation
 
+    def _create_entity_type_levels(self):
+        """Derives the levels of the entity type hierarchy from the '/' separated type identifiers (full names of
+        the 'scheme.json' entity types, e.g. 'PhysicalObject/SensingObject'). Level 0 is untyped ('Entity'), the
+        last level consists of the specified entity types"""
+        keys = [key for key in self._entity_types if key != "None"]
+        depth = max([len(key.split("/")) for key in keys] + [1])
+        none_entity_type = self._entity_types["None"]
+
+        levels = [
+            OrderedDict(
+                [
+                    ("None", none_entity_type),
+                    ("Entity", EntityType("Entity", 1, "Entity", "Entity")),
+                ]
+            )
+        ]
+        for level in range(1, depth):
+            level_types = OrderedDict([("None", none_entity_type)])
+            for key in keys:
+                prefix = "/".join(key.split("/")[:level])
+                if prefix not in level_types:
+                    level_types[prefix] = EntityType(
+                        prefix, len(level_types), prefix.split("/")[-1], prefix
+                    )
+            levels.append(level_types)
+        levels.append(self._entity_types)
+
+        def parent_key(key, level):
+            if key == "None":
+                return key
+            return "Entity" if level == 0 else "/".join(key.split("/")[:level])
+
+        # index of the parent type (previous level) of every type of the levels 1..n
+        parents = [
+            [levels[level - 1][parent_key(key, level - 1)].index for key in levels[level]]
+            for level in range(1, len(levels))
+        ]
+
+        return levels, parents
+
+    @property
+    def entity_type_levels(self) -> List[OrderedDict]:
+        if self._entity_type_levels is None:
+            self._entity_type_levels, self._entity_type_parents = self._create_entity_type_levels()
+        return self._entity_type_levels
+
+    @property
+    def entity_type_parents(self) -> List[List[int]]:
+        """Index of the parent type of every entity type of the levels 1..n (the specified types are level n)"""
+        if self._entity_type_parents is None:
+            self._entity_type_levels, self._entity_type_parents = self._create_entity_type_levels()
+        return self._entity_type_parents
+
+    def get_entity_type_level_map(self, level: int) -> Dict[EntityType, EntityType]:
+        """Maps the specified entity types to their ancestors at the given level of the hierarchy"""
+        levels = self.entity_type_levels
+        parents = self.entity_type_parents
+
+        type_map = dict()
+        for entity_type in self._entity_types.values():
+            index = entity_type.index
+            for n in range(len(levels) - 1, level, -1):
+                index = parents[n - 1][index]
+            type_map[entity_type] = list(levels[level].values())[index]
+
+        return type_map
+
     def _log(self, text):
         if self._logger is not None:
             self._logger.info(text)
@@ -156,11 +257,6 @@ class JsonInputReader(BaseInputReader):
         self._datasets[dataset_label] = dataset
         return dataset
 
-    def _parse_dataset(self, dataset_path, dataset):
-        documents = json.load(open(dataset_path))
-        for document in tqdm(documents, desc="Parse dataset '%s'" % dataset.label):
-            self._parse_document(document, dataset)
-
     def _parse_document(self, doc, dataset) -> Document:
         jtokens = doc["tokens"]
         jrelations = doc["relations"]
@@ -175,9 +271,9 @@ class JsonInputReader(BaseInputReader):
         # parse relations
         relations = self._parse_relations(jrelations, entities, dataset)
 
-        # create document
+        # create document (deduplicated datasets: number of collapsed duplicates as sample weight)
         document = dataset.create_document(
-            doc_tokens, entities, relations, doc_encoding
+            doc_tokens, entities, relations, doc_encoding, weight=doc.get("count", 1)
         )
 
         return document
@@ -192,7 +288,10 @@ class JsonInputReader(BaseInputReader):
             # create entity mention
             tokens = doc_tokens[start:end]
             phrase = " ".join([t.phrase for t in tokens])
-            entity = dataset.create_entity(entity_type, tokens, phrase)
+            # soft labels (e.g. predictions of a teacher model) carry the probability of the type
+            entity = dataset.create_entity(
+                entity_type, tokens, phrase, proba=jentity.get("proba", 1.0)
+            )
             entities.append(entity)
 
         return entities
@@ -217,7 +316,11 @@ class JsonInputReader(BaseInputReader):
                 head, tail = util.swap(head, tail)
 
             relation = dataset.create_relation(
-                relation_type, head_entity=head, tail_entity=tail, reverse=reverse
+                relation_type,
+                head_entity=head,
+                tail_entity=tail,
+                reverse=reverse,
+                proba=jrelation.get("proba", 1.0),
             )
             relations.append(relation)
 
@@ -239,8 +342,8 @@ class JsonPredictionInputReader(BaseInputReader):
         self._spacy_model = spacy_model
 
         self._nlp = (
-            spacy.load(spacy_model)
-            if spacy is not None and spacy_model is not None
+            opt.spacy.load(spacy_model)
+            if spacy_model is not None and opt.spacy is not None
             else None
         )
 
@@ -257,11 +360,6 @@ class JsonPredictionInputReader(BaseInputReader):
         self._datasets[dataset_label] = dataset
         return dataset
 
-    def _parse_dataset(self, dataset_path, dataset):
-        documents = json.load(open(dataset_path))
-        for document in tqdm(documents, desc="Parse dataset '%s'" % dataset.label):
-            self._parse_document(document, dataset)
-
     def _parse_document(self, document, dataset) -> Document:
         if type(document) == list:
             jtokens = document
@@ -279,6 +377,14 @@ class JsonPredictionInputReader(BaseInputReader):
         return document
 
 
+def encode_token(token_phrase, tokenizer):
+    """Byte-pair encoding of a document token ('[UNK]' if the tokenizer drops it, e.g. control characters)"""
+    token_encoding = tokenizer.encode(token_phrase, add_special_tokens=False)
+    if not token_encoding:
+        token_encoding = [tokenizer.convert_tokens_to_ids("[UNK]")]
+    return token_encoding
+
+
 def _parse_tokens(jtokens, dataset, tokenizer):
     doc_tokens = []
 
@@ -287,9 +393,7 @@ def _parse_tokens(jtokens, dataset, tokenizer):
 
     # parse tokens
     for i, token_phrase in enumerate(jtokens):
-        token_encoding = tokenizer.encode(token_phrase, add_special_tokens=False)
-        if not token_encoding:
-            token_encoding = [tokenizer.convert_tokens_to_ids("[UNK]")]
+        token_encoding = encode_token(token_phrase, tokenizer)
         span_start, span_end = (
             len(doc_encoding),
             len(doc_encoding) + len(token_encoding),
@@ -2,6 +2,9 @@ from abc import ABC
 
 import torch
 
+from spert import util
+from spert.profiling import StageTimer
+
 
 class Loss(ABC):
     def compute(self, *args, **kwargs):
@@ -9,28 +12,46 @@ class Loss(ABC):
 
 
 class SpERTLoss(Loss):
-    def __init__(self, rel_criterion, entity_criterion, model, optimizer, scheduler, max_grad_norm):
+    def __init__(self, rel_criterion, entity_criterion, model, optimizer, scheduler, max_grad_norm,
+                 stage_timer: StageTimer = None):
         self._rel_criterion = rel_criterion
         self._entity_criterion = entity_criterion
         self._model = model
         self._optimizer = optimizer
         self._scheduler = scheduler
         self._max_grad_norm = max_grad_norm
+        self._stage_timer = stage_timer if stage_timer is not None else StageTimer()
 
-    def compute(self, entity_logits, rel_logits, entity_types, rel_types, entity_sample_masks, rel_sample_masks):
-        # entity loss
-        entity_logits = entity_logits.view(-1, entity_logits.shape[-1])
-        entity_types = entity_types.view(-1)
-        entity_sample_masks = entity_sample_masks.view(-1).float()
+    def compute(self, entity_logits, rel_logits, entity_types, rel_types, entity_sample_masks, rel_sample_masks,
+                weights=None, entity_probas=None):
+        with self._stage_timer.stage('loss_backward'):
+            train_loss = self._compute_loss(entity_logits, rel_logits, entity_types, rel_types, entity_sample_masks,
+                                            rel_sample_masks, weights, entity_probas)
+            train_loss.backward()
 
-        entity_loss = self._entity_criterion(entity_logits, entity_types)
-        entity_loss = (entity_loss * entity_sample_masks).sum() / entity_sample_masks.sum()
+        with self._stage_timer.stage('optimizer_step'):
+            torch.nn.utils.clip_grad_norm_(self._model.parameters(), self._max_grad_norm)
+            self._optimizer.step()
+            self._scheduler.step()
+            self._model.zero_grad()
+        return train_loss.item()
+
+    def _compute_loss(self, entity_logits, rel_logits, entity_types, rel_types, entity_sample_masks, rel_sample_masks,
+                      weights, entity_probas=None):
+        if weights is not None:
+            # weighted average over the entity/relation samples of all documents (e.g. collapsed duplicates)
+            entity_sample_masks = entity_sample_masks.float() * weights.unsqueeze(-1)
+            rel_sample_masks = rel_sample_masks.float() * weights.unsqueeze(-1)
+
+        # entity loss
+        entity_loss = self._compute_entity_loss(entity_logits, entity_types, entity_sample_masks, entity_probas)
 
         # relation loss
         rel_sample_masks = rel_sample_masks.view(-1).float()
         rel_count = rel_sample_masks.sum()
 
         if rel_count.item() != 0:
+            # (soft) relation labels are the targets of the binary cross entropy
             rel_logits = rel_logits.view(-1, rel_logits.shape[-1])
             rel_types = rel_types.view(-1, rel_types.shape[-1])
 
@@ -44,9 +65,42 @@ class SpERTLoss(Loss):
             # corner case: no positive/negative relation samples
             train_loss = entity_loss
 
-        train_loss.backward()
-        torch.nn.utils.clip_grad_norm_(self._model.parameters(), self._max_grad_norm)
-        self._optimizer.step()
-        self._scheduler.step()
-        self._model.zero_grad()
-        return train_loss.item()
+        return train_loss
+
+    def _compute_entity_loss(self, entity_logits, entity_types, entity_sample_masks, entity_probas=None):
+        entity_loss = self._entity_sample_loss(entity_logits, entity_types)
+
+        if entity_probas is not None:
+            # soft labels of a teacher model: the labeled type has the teacher's probability, the remaining
+            # probability is assigned to 'None' (cross entropy with this target distribution)
+            entity_probas = entity_probas.view(-1)
+            none_loss = self._entity_sample_loss(entity_logits, torch.zeros_like(entity_types))
+            entity_loss = entity_probas * entity_loss + (1 - entity_probas) * none_loss
+
+        entity_sample_masks = entity_sample_masks.view(-1).float()
+        entity_loss = (entity_loss * entity_sample_masks).sum() / entity_sample_masks.sum()
+        return entity_loss
+
+    def _entity_sample_loss(self, entity_logits, entity_types):
+        """ Loss of every entity sample (flattened) """
+        entity_logits = entity_logits.view(-1, entity_logits.shape[-1])
+        return self._entity_criterion(entity_logits, entity_types.view(-1))
+
+
+class HierarchicalSpERTLoss(SpERTLoss):
+    """ Sum of the entity losses of all levels of a 'HierarchicalSpERT' model, where the logits of each level are
+    restricted to the children of the gold type of the previous level """
+
+    def _entity_sample_loss(self, entity_logits, entity_types):
+        model = util.unwrap_model(self._model)
+
+        level_logits = entity_logits.split(model.level_sizes, dim=-1)
+        level_types = model.level_types(entity_types)
+
+        # 'None' is only a child of 'None', so the levels below add no loss to 'None' samples
+        entity_loss = super()._entity_sample_loss(level_logits[0], level_types[0])
+        for level in range(1, len(level_logits)):
+            logits = model.constrain_level_logits(level, level_logits[level], level_types[level - 1])
+            entity_loss = entity_loss + super()._entity_sample_loss(logits, level_types[level])
+
+        return entity_loss
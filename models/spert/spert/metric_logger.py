@@ -0,0 +1,83 @@
+import atexit
+import csv
+import time
+
+from spert import util
+
+
+class MetricLogger:
+    """Buffers the CSV rows and TensorBoard scalars of a run and writes them in batches, every 'flush_interval'
+    seconds, on 'flush' (e.g. at the end of an epoch) and on 'close' (or at exit). The CSV files are kept open
+    between flushes and the on-disk format is the one of 'util.append_csv'. A disabled logger drops everything
+    (e.g. for benchmarking) and 'flush_interval == 0' writes every row immediately"""
+
+    def __init__(
+        self, summary_writer=None, flush_interval: float = 30.0, enabled: bool = True
+    ):
+        self.enabled = enabled
+        self._summary_writer = summary_writer
+        self._flush_interval = flush_interval
+
+        self._rows = dict()
+        self._scalars = []
+        self._files = dict()
+        self._last_flush = time.monotonic()
+
+        atexit.register(self.close)
+
+    def append(self, file_path: str, *row):
+        """Appends a row to a CSV file (created with 'util.create_csv')"""
+        if not self.enabled:
+            return
+
+        self._rows.setdefault(file_path, []).append(row)
+        self._maybe_flush()
+
+    def add_scalar(self, tag: str, value: object, step: int):
+        if not self.enabled or self._summary_writer is None:
+            return
+
+        self._scalars.append((tag, value, step))
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        if time.monotonic() - self._last_flush >= self._flush_interval:
+            self.flush()
+
+    def flush(self):
+        for file_path, rows in self._rows.items():
+            if not rows:
+                continue
+
+            if file_path not in self._files:
+                csv_file = open(file_path, "a", newline="")
+                writer = csv.writer(
+                    csv_file,
+                    delimiter=util.CSV_DELIMETER,
+                    quotechar="|",
+                    quoting=csv.QUOTE_MINIMAL,
+                )
+                self._files[file_path] = (csv_file, writer)
+
+            csv_file, writer = self._files[file_path]
+            writer.writerows(rows)
+            csv_file.flush()
+            rows.clear()
+
+        if self._scalars:
+            for tag, value, step in self._scalars:
+                self._summary_writer.add_scalar(tag, value, step)
+            self._scalars.clear()
+            self._summary_writer.flush()
+
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        """Writes the remaining rows and scalars and closes the CSV files (the summary writer is not closed)"""
+        self.flush()
+
+        for csv_file, _ in self._files.values():
+            csv_file.close()
+        self._files.clear()
+
+        atexit.unregister(self.close)
@@ -1,11 +1,15 @@
+import math
+from typing import List
+
 import torch
 from torch import nn as nn
 from transformers import BertConfig
 from transformers import BertModel
 from transformers import BertPreTrainedModel
 
-from spert import sampling
 from spert import util
+from spert.caching import EncoderCache
+from spert.profiling import StageTimer
 
 
 def get_token(h: torch.tensor, x: torch.tensor, token: int):
@@ -27,7 +31,9 @@ class SpERT(BertPreTrainedModel):
     VERSION = '1.1'
 
     def __init__(self, config: BertConfig, cls_token: int, relation_types: int, entity_types: int,
-                 size_embedding: int, prop_drop: float, freeze_transformer: bool, max_pairs: int = 100):
+                 size_embedding: int, prop_drop: float, freeze_transformer: bool, max_pairs: int = 100,
+                 static_shapes: bool = False, early_exit: bool = True, window_size: int = 0,
+                 window_stride: int = None, window_pooling: str = 'max', encoder_cache_size: int = 0):
         super(SpERT, self).__init__(config)
 
         # BERT model
@@ -44,6 +50,30 @@ class SpERT(BertPreTrainedModel):
         self._entity_types = entity_types
         self._max_pairs = max_pairs
 
+        # static shape inference: relation candidates are padded to bucketed sizes
+        self._static_shapes = static_shapes
+        self._static_shape_keys = set()
+
+        # inference: skip relation classification for documents with less than two predicted entities
+        self._early_exit = early_exit
+
+        # long documents: encode overlapping windows of 'window_size' sub-words (0 = single pass)
+        if window_size > config.max_position_embeddings:
+            raise ValueError("'window_size' (%s) exceeds the maximum position of the encoder (%s)"
+                             % (window_size, config.max_position_embeddings))
+        if window_pooling not in ('max', 'mean'):
+            raise ValueError("'window_pooling' must be 'max' or 'mean', not '%s'" % window_pooling)
+
+        self._window_size = window_size
+        self._window_stride = min(window_stride or max(window_size // 2, 1), max(window_size, 1))
+        self._window_pooling = window_pooling
+
+        # inference: LRU cache of the hidden states of already encoded documents (size in MB, 0 = no cache)
+        self._encoder_cache = EncoderCache(encoder_cache_size * 2 ** 20) if encoder_cache_size > 0 else None
+
+        # timing of the encoder, span pooling and relation classification (enabled by the trainer)
+        self.stage_timer = StageTimer()
+
         # weight initialization
         self.init_weights()
 
@@ -57,42 +87,103 @@ class SpERT(BertPreTrainedModel):
     def _forward_train(self, encodings: torch.tensor, context_masks: torch.tensor, entity_masks: torch.tensor,
                        entity_sizes: torch.tensor, relations: torch.tensor, rel_masks: torch.tensor):
         # get contextualized token embeddings from last transformer layer
-        context_masks = context_masks.float()
-        h = self.bert(input_ids=encodings, attention_mask=context_masks)['last_hidden_state']
+        with self.stage_timer.stage('encoder'):
+            h = self._encode(encodings, context_masks)
 
         batch_size = encodings.shape[0]
 
         # classify entities
-        size_embeddings = self.size_embeddings(entity_sizes)  # embed entity candidate sizes
-        entity_clf, entity_spans_pool = self._classify_entities(encodings, h, entity_masks, size_embeddings)
+        with self.stage_timer.stage('span_pooling'):
+            size_embeddings = self.size_embeddings(entity_sizes)  # embed entity candidate sizes
+            entity_clf, entity_spans_pool = self._classify_entities(encodings, h, entity_masks, size_embeddings)
 
         # classify relations
-        h_large = h.unsqueeze(1).repeat(1, max(min(relations.shape[1], self._max_pairs), 1), 1, 1)
-        rel_clf = torch.zeros([batch_size, relations.shape[1], self._relation_types]).to(
-            self.rel_classifier.weight.device)
-
-        # obtain relation logits
-        # chunk processing to reduce memory usage
-        for i in range(0, relations.shape[1], self._max_pairs):
-            # classify relation candidates
-            chunk_rel_logits = self._classify_relations(entity_spans_pool, size_embeddings,
-                                                        relations, rel_masks, h_large, i)
-            rel_clf[:, i:i + self._max_pairs, :] = chunk_rel_logits
+        with self.stage_timer.stage('relation_classification'):
+            h_large = h.unsqueeze(1).repeat(1, max(min(relations.shape[1], self._max_pairs), 1), 1, 1)
+            rel_clf = torch.zeros([batch_size, relations.shape[1], self._relation_types]).to(
+                self.rel_classifier.weight.device)
+
+            # obtain relation logits
+            # chunk processing to reduce memory usage
+            for i in range(0, relations.shape[1], self._max_pairs):
+                # classify relation candidates
+                chunk_rel_logits = self._classify_relations(entity_spans_pool, size_embeddings,
+                                                            relations, rel_masks, h_large, i)
+                rel_clf[:, i:i + self._max_pairs, :] = chunk_rel_logits
 
         return entity_clf, rel_clf
 
     def _forward_inference(self, encodings: torch.tensor, context_masks: torch.tensor, entity_masks: torch.tensor,
                            entity_sizes: torch.tensor, entity_spans: torch.tensor, entity_sample_masks: torch.tensor):
         # get contextualized token embeddings from last transformer layer
-        context_masks = context_masks.float()
-        h = self.bert(input_ids=encodings, attention_mask=context_masks)['last_hidden_state']
-
-        batch_size = encodings.shape[0]
-        ctx_size = context_masks.shape[-1]
+        # (static shapes: the cache is bypassed, as it changes the encoder's batch size)
+        with self.stage_timer.stage('encoder'):
+            if self._encoder_cache is not None and not self._static_shapes:
+                h = self._encode_cached(encodings, context_masks)
+            else:
+                h = self._encode(encodings, context_masks)
 
         # classify entities
-        size_embeddings = self.size_embeddings(entity_sizes)  # embed entity candidate sizes
-        entity_clf, entity_spans_pool = self._classify_entities(encodings, h, entity_masks, size_embeddings)
+        with self.stage_timer.stage('span_pooling'):
+            size_embeddings = self.size_embeddings(entity_sizes)  # embed entity candidate sizes
+            entity_clf, entity_spans_pool = self._classify_entities(encodings, h, entity_masks, size_embeddings,
+                                                                    inference=True)
+
+        with self.stage_timer.stage('relation_classification'):
+            rel_clf, relations = self._classify_relation_candidates(h, context_masks, entity_clf, entity_spans_pool,
+                                                                    size_embeddings, entity_spans,
+                                                                    entity_sample_masks)
+
+        if self._static_shapes:
+            self._static_shape_keys.add((tuple(encodings.shape), tuple(entity_masks.shape),
+                                         tuple(relations.shape)))
+
+        # apply softmax
+        entity_clf = torch.softmax(entity_clf, dim=2)
+
+        return entity_clf, rel_clf, relations
+
+    def _classify_relation_candidates(self, h, context_masks, entity_clf, entity_spans_pool, size_embeddings,
+                                      entity_spans, entity_sample_masks):
+        batch_size = h.shape[0]
+        device = self.rel_classifier.weight.device
+
+        # early exit: only documents with at least two predicted entities have relation candidates
+        rel_docs = self._relation_documents(entity_clf, entity_sample_masks) if self._early_exit else None
+
+        # (static shapes: no compaction, the batch size is part of the shape)
+        if rel_docs is None or rel_docs.shape[0] == batch_size or (self._static_shapes and rel_docs.shape[0] != 0):
+            rel_clf, relations = self._relations_inference(h, entity_clf, entity_spans_pool, size_embeddings,
+                                                           entity_spans, entity_sample_masks)
+        else:
+            # classify relations of the compacted batch (documents with relation candidates) only
+            rel_clf = torch.zeros([batch_size, 1, self._relation_types], device=device)
+            relations = torch.zeros([batch_size, 1, 2], dtype=torch.long, device=device)
+
+            if rel_docs.shape[0] != 0:
+                # also drop context padding that is only needed by the skipped (longer) documents
+                ctx_size = context_masks[rel_docs].sum(dim=-1).max().item()
+
+                docs_rel_clf, docs_relations = self._relations_inference(
+                    h[rel_docs, :ctx_size], entity_clf[rel_docs], entity_spans_pool[rel_docs],
+                    size_embeddings[rel_docs], entity_spans[rel_docs], entity_sample_masks[rel_docs])
+
+                rel_clf = rel_clf.new_zeros([batch_size, docs_rel_clf.shape[1], self._relation_types])
+                rel_clf[rel_docs] = docs_rel_clf
+                relations = relations.new_zeros([batch_size, docs_relations.shape[1], 2])
+                relations[rel_docs] = docs_relations
+
+        return rel_clf, relations
+
+    def _relation_documents(self, entity_clf, entity_sample_masks):
+        """ Indices of the batch documents with at least two spans classified as entities """
+        entity_counts = ((entity_clf.argmax(dim=-1) != 0) & entity_sample_masks.bool()).sum(dim=-1)
+        return (entity_counts > 1).nonzero().view(-1)
+
+    def _relations_inference(self, h, entity_clf, entity_spans_pool, size_embeddings, entity_spans,
+                             entity_sample_masks):
+        batch_size = h.shape[0]
+        ctx_size = h.shape[1]
 
         # ignore entity candidates that do not constitute an actual entity for relations (based on classifier)
         relations, rel_masks, rel_sample_masks = self._filter_spans(entity_clf, entity_spans,
@@ -115,19 +206,114 @@ class SpERT(BertPreTrainedModel):
 
         rel_clf = rel_clf * rel_sample_masks  # mask
 
-        # apply softmax
-        entity_clf = torch.softmax(entity_clf, dim=2)
+        return rel_clf, relations
 
-        return entity_clf, rel_clf, relations
+    def _encode(self, encodings, context_masks):
+        if self._window_size and encodings.shape[1] > self._window_size:
+            return self._encode_windowed(encodings, context_masks)
 
-    def _classify_entities(self, encodings, h, entity_masks, size_embeddings):
+        context_masks = context_masks.float()
+        h = self.bert(input_ids=encodings, attention_mask=context_masks)['last_hidden_state']
+        return h
+
+    def _encode_cached(self, encodings, context_masks):
+        """ Encode the documents of the batch that are neither cached nor duplicates of a previous document
+        of the batch, all other hidden states are copied from the cache """
+        cache = self._encoder_cache
+        lengths = context_masks.sum(dim=-1).tolist()
+        keys = [tuple(encoding[:length]) for encoding, length in zip(encodings.tolist(), lengths)]
+
+        cached = {}
+        misses = {}
+        for i, key in enumerate(keys):
+            if key in cached or key in misses:
+                continue
+            h = cache.get(key)
+            if h is not None:
+                cached[key] = h
+            else:
+                misses[key] = i
+
+        cache.hits += len(keys) - len(misses)
+        cache.misses += len(misses)
+
+        if misses:
+            indices = torch.tensor(list(misses.values()), device=encodings.device)
+            ctx_size = max(lengths[i] for i in misses.values())
+            h_misses = self._encode(encodings[indices, :ctx_size], context_masks[indices, :ctx_size])
+
+            for (key, i), h in zip(misses.items(), h_misses):
+                cached[key] = h[:lengths[i]].clone()
+                cache.put(key, cached[key])
+
+        # stack (padding positions are masked in all subsequent stages)
+        h = next(iter(cached.values()))
+        h_batch = h.new_zeros([encodings.shape[0], encodings.shape[1], h.shape[-1]])
+        for i, key in enumerate(keys):
+            h_batch[i, :lengths[i]] = cached[key]
+
+        return h_batch
+
+    @property
+    def encoder_cache(self):
+        return self._encoder_cache
+
+    def train(self, mode: bool = True):
+        # cached hidden states are stale as soon as the parameters are updated
+        if mode and getattr(self, '_encoder_cache', None) is not None:
+            self._encoder_cache.clear()
+        return super(SpERT, self).train(mode)
+
+    def _encode_windowed(self, encodings, context_masks):
+        """ Encode the context in overlapping windows ('window_size' sub-words every 'window_stride' sub-words)
+        and stitch the hidden states by max or mean pooling over the windows covering a token. Attention is
+        restricted to each window, so memory grows linearly with the context size. Only the first window starts
+        with [CLS], the entity context representation is taken from there """
+        batch_size, ctx_size = encodings.shape
+        size, stride = self._window_size, self._window_stride
+
+        # pad the context, so that the last window ends with it
+        window_count = math.ceil((ctx_size - size) / stride) + 1
+        padded_size = (window_count - 1) * stride + size
+        encodings = nn.functional.pad(encodings, [0, padded_size - ctx_size])
+        context_masks = nn.functional.pad(context_masks.long(), [0, padded_size - ctx_size])
+
+        windows = encodings.unfold(1, size, stride).reshape(-1, size)
+        window_masks = context_masks.unfold(1, size, stride).reshape(-1, size)
+
+        # windows that only cover padding (of shorter documents in the batch) are not encoded
+        active = window_masks.any(dim=-1)
+        h_active = self.bert(input_ids=windows[active],
+                             attention_mask=window_masks[active].float())['last_hidden_state']
+        h_windows = h_active.new_zeros([windows.shape[0], size, h_active.shape[-1]])
+        h_windows[active] = h_active
+        h_windows = h_windows.view(batch_size, window_count * size, -1)
+
+        # context position of every window token
+        positions = (torch.arange(window_count, device=encodings.device) * stride).unsqueeze(1)
+        positions = (positions + torch.arange(size, device=encodings.device)).view(-1)
+
+        h = h_windows.new_zeros([batch_size, padded_size, h_windows.shape[-1]])
+        if self._window_pooling == 'mean':
+            h.index_add_(1, positions, h_windows)
+            window_counts = torch.zeros(padded_size, device=h.device).index_add_(
+                0, positions, torch.ones_like(positions, dtype=torch.float))
+            h = h / window_counts.unsqueeze(-1)
+        else:
+            h.scatter_reduce_(1, positions.view(1, -1, 1).expand_as(h_windows), h_windows, 'amax',
+                              include_self=False)
+
+        return h[:, :ctx_size]
+
+    def _classify_entities(self, encodings, h, entity_masks, size_embeddings, inference=False):
         # max pool entity candidate spans
         m = (entity_masks.unsqueeze(-1) == 0).float() * (-1e30)
         entity_spans_pool = m + h.unsqueeze(1).repeat(1, entity_masks.shape[1], 1, 1)
         entity_spans_pool = entity_spans_pool.max(dim=2)[0]
 
         # get cls token as candidate context representation
-        entity_ctx = get_token(h, encodings, self._cls_token)
+        # (static shapes: [CLS] is always the first token, avoids a data dependent lookup)
+        entity_ctx = h[:, 0, :] if self._static_shapes else get_token(h, encodings, self._cls_token)
 
         # create candidate representations including context, max pooled span and size embedding
         entity_repr = torch.cat([entity_ctx.unsqueeze(1).repeat(1, entity_spans_pool.shape[1], 1),
@@ -135,10 +321,13 @@ class SpERT(BertPreTrainedModel):
         entity_repr = self.dropout(entity_repr)
 
         # classify entity candidates
-        entity_clf = self.entity_classifier(entity_repr)
+        entity_clf = self._entity_logits(entity_repr, inference)
 
         return entity_clf, entity_spans_pool
 
+    def _entity_logits(self, entity_repr, inference):
+        return self.entity_classifier(entity_repr)
+
     def _classify_relations(self, entity_spans, size_embeddings, relations, rel_masks, h, chunk_start):
         batch_size = relations.shape[0]
 
@@ -163,7 +352,7 @@ class SpERT(BertPreTrainedModel):
         # max pooling
         rel_ctx = rel_ctx.max(dim=2)[0]
         # set the context vector of neighboring or adjacent entity candidates to zero
-        rel_ctx[rel_masks.to(torch.uint8).any(-1) == 0] = 0
+        rel_ctx = rel_ctx.masked_fill(~rel_masks.any(-1, keepdim=True), 0)
 
         # create relation candidate representations including context, max pooled entity candidate pairs
         # and corresponding size embeddings
@@ -175,49 +364,72 @@ class SpERT(BertPreTrainedModel):
         return chunk_rel_logits
 
     def _filter_spans(self, entity_clf, entity_spans, entity_sample_masks, ctx_size):
+        # relation candidates are built for the whole batch with gathers (see 'util.batch_index')
         batch_size = entity_clf.shape[0]
+        device = self.rel_classifier.weight.device
         entity_logits_max = entity_clf.argmax(dim=-1) * entity_sample_masks.long()  # get entity type (including none)
-        batch_relations = []
-        batch_rel_masks = []
-        batch_rel_sample_masks = []
-
-        for i in range(batch_size):
-            rels = []
-            rel_masks = []
-            sample_masks = []
-
-            # get spans classified as entities
-            non_zero_indices = (entity_logits_max[i] != 0).nonzero().view(-1)
-            non_zero_spans = entity_spans[i][non_zero_indices].tolist()
-            non_zero_indices = non_zero_indices.tolist()
-
-            # create relations and masks
-            for i1, s1 in zip(non_zero_indices, non_zero_spans):
-                for i2, s2 in zip(non_zero_indices, non_zero_spans):
-                    if i1 != i2:
-                        rels.append((i1, i2))
-                        rel_masks.append(sampling.create_rel_mask(s1, s2, ctx_size))
-                        sample_masks.append(1)
-
-            if not rels:
-                # case: no more than two spans classified as entities
-                batch_relations.append(torch.tensor([[0, 0]], dtype=torch.long))
-                batch_rel_masks.append(torch.tensor([[0] * ctx_size], dtype=torch.bool))
-                batch_rel_sample_masks.append(torch.tensor([0], dtype=torch.bool))
-            else:
-                # case: more than two spans classified as entities
-                batch_relations.append(torch.tensor(rels, dtype=torch.long))
-                batch_rel_masks.append(torch.stack(rel_masks))
-                batch_rel_sample_masks.append(torch.tensor(sample_masks, dtype=torch.bool))
 
-        # stack
-        device = self.rel_classifier.weight.device
-        batch_relations = util.padded_stack(batch_relations).to(device)
-        batch_rel_masks = util.padded_stack(batch_rel_masks).to(device)
-        batch_rel_sample_masks = util.padded_stack(batch_rel_sample_masks).to(device)
+        # get spans classified as entities (indices padded with 0)
+        entity_indices = util.padded_nonzero(entity_logits_max).to(device)
+        entity_counts = (entity_logits_max != 0).sum(dim=-1).to(device)
+        if entity_indices.shape[1] == 0:
+            entity_indices = torch.zeros([batch_size, 1], dtype=torch.long, device=device)
+        entity_count = entity_indices.shape[1]
+
+        # ordered pairs of different entities, in the order of the (head, tail) indices
+        valid = torch.arange(entity_count, device=device) < entity_counts.unsqueeze(-1)
+        pair_masks = valid.unsqueeze(2) & valid.unsqueeze(1)
+        pair_masks &= ~torch.eye(entity_count, dtype=torch.bool, device=device)
+        pair_masks = pair_masks.view(batch_size, -1)
+
+        pair_indices = util.padded_nonzero(pair_masks)
+        if pair_indices.shape[1] == 0:
+            # case: no more than one span classified as entity in every document
+            pair_indices = torch.zeros([batch_size, 1], dtype=torch.long, device=device)
+
+        # create relations and masks (padding relations are (0, 0) with empty masks)
+        batch_rel_sample_masks = util.batch_index(pair_masks, pair_indices)
+        batch_relations = torch.stack([util.batch_index(entity_indices, pair_indices // entity_count),
+                                       util.batch_index(entity_indices, pair_indices % entity_count)], dim=-1)
+        batch_relations = batch_relations * batch_rel_sample_masks.unsqueeze(-1)
+
+        # context between the entities (see 'sampling.create_rel_mask')
+        entity_spans = entity_spans.to(device)
+        s1 = util.batch_index(entity_spans, batch_relations[:, :, 0])
+        s2 = util.batch_index(entity_spans, batch_relations[:, :, 1])
+        first = s1[:, :, 1] < s2[:, :, 0]
+        start = torch.where(first, s1[:, :, 1], s2[:, :, 1]).unsqueeze(-1)
+        end = torch.where(first, s2[:, :, 0], s1[:, :, 0]).unsqueeze(-1)
+        positions = torch.arange(ctx_size, device=device)
+        batch_rel_masks = (positions >= start) & (positions < end) & batch_rel_sample_masks.unsqueeze(-1)
+
+        if self._static_shapes:
+            # pad relation candidates to a bucketed count (masked out by 'batch_rel_sample_masks')
+            rel_count = self._static_rel_count(batch_relations.shape[1])
+            batch_relations = util.extend_tensor(batch_relations, [batch_size, rel_count, 2])
+            batch_rel_masks = util.extend_tensor(batch_rel_masks, [batch_size, rel_count, ctx_size])
+            batch_rel_sample_masks = util.extend_tensor(batch_rel_sample_masks, [batch_size, rel_count])
 
         return batch_relations, batch_rel_masks, batch_rel_sample_masks
 
+    def _static_rel_count(self, rel_count):
+        # power-of-two buckets up to 'max_pairs', multiples of 'max_pairs' above (keeps chunks equally sized)
+        if rel_count <= self._max_pairs:
+            return min(util.bucket_size(rel_count), self._max_pairs)
+        return math.ceil(rel_count / self._max_pairs) * self._max_pairs
+
+    def compile_inference(self, **compile_kwargs):
+        """ Compile the tensor-heavy stages (encoder, entity and relation classification) with torch.compile.
+        Combined with static shapes, each shape bucket is compiled once and then reused """
+        self._encode = torch.compile(self._encode, **compile_kwargs)
+        self._classify_entities = torch.compile(self._classify_entities, **compile_kwargs)
+        self._classify_relations = torch.compile(self._classify_relations, **compile_kwargs)
+
+    @property
+    def static_shape_count(self):
+        """ Number of distinct (encodings, entity candidates, relation candidates) shapes seen in inference """
+        return len(self._static_shape_keys)
+
     def forward(self, *args, inference=False, **kwargs):
         if not inference:
             return self._forward_train(*args, **kwargs)
@@ -225,10 +437,148 @@ class SpERT(BertPreTrainedModel):
             return self._forward_inference(*args, **kwargs)
 
 
+class HierarchicalSpERT(SpERT):
+    """ SpERT with one entity classifier per level of an entity type hierarchy (e.g. MaintIE levels 0-3), so that
+    all levels are trained and predicted with a single encoder and span pooling pass. The logits of each level are
+    restricted to the children of the previous level's type: the gold type in training (see
+    'HierarchicalSpERTLoss') and the predicted type in inference """
+
+    def __init__(self, config: BertConfig, cls_token: int, relation_types: int, entity_types: int,
+                 size_embedding: int, prop_drop: float, freeze_transformer: bool, max_pairs: int = 100,
+                 static_shapes: bool = False, early_exit: bool = True, window_size: int = 0,
+                 window_stride: int = None, window_pooling: str = 'max', encoder_cache_size: int = 0,
+                 entity_type_parents: List[List[int]] = None):
+        super(HierarchicalSpERT, self).__init__(config, cls_token, relation_types, entity_types, size_embedding,
+                                                prop_drop, freeze_transformer, max_pairs, static_shapes,
+                                                early_exit=early_exit, window_size=window_size,
+                                                window_stride=window_stride, window_pooling=window_pooling,
+                                                encoder_cache_size=encoder_cache_size)
+
+        if not entity_type_parents or len(entity_type_parents[-1]) != entity_types:
+            raise ValueError("'entity_type_parents' must hold the parent indices of every level "
+                             "(the last level being the %s entity types)" % entity_types)
+
+        # level 0 (untyped) up to the second to last level, the last level uses 'entity_classifier'
+        self.level_sizes = [2] + [len(parents) for parents in entity_type_parents]
+        self.level_entity_classifiers = nn.ModuleList([nn.Linear(config.hidden_size * 2 + size_embedding, size)
+                                                       for size in self.level_sizes[:-1]])
+        self.level_entity_classifiers.apply(self._init_weights)
+
+        for level, parents in enumerate(entity_type_parents, start=1):
+            self.register_buffer('_level_parents_%s' % level, torch.tensor(parents, dtype=torch.long),
+                                 persistent=False)
+
+    def level_parents(self, level: int):
+        """ Parent index (level - 1) of every type of the given level """
+        return getattr(self, '_level_parents_%s' % level)
+
+    def level_types(self, entity_types: torch.tensor):
+        """ Types of all levels (coarse to fine) given the types of the last level """
+        types = [entity_types]
+        for level in range(len(self.level_sizes) - 1, 0, -1):
+            types.insert(0, self.level_parents(level)[types[0]])
+        return types
+
+    def constrain_level_logits(self, level: int, logits: torch.tensor, parent_types: torch.tensor):
+        """ Masks the logits of all types of the given level that are not children of the given parent types """
+        children = self.level_parents(level) == parent_types.unsqueeze(-1)
+        return logits.masked_fill(~children, torch.finfo(logits.dtype).min)
+
+    def _entity_logits(self, entity_repr, inference):
+        level_logits = [classifier(entity_repr) for classifier in self.level_entity_classifiers]
+        level_logits.append(self.entity_classifier(entity_repr))
+
+        if not inference:
+            # constrained by the gold types in the loss
+            return torch.cat(level_logits, dim=-1)
+
+        # top-down: every level is restricted to the children of the predicted type of the previous level
+        parent_types = level_logits[0].argmax(dim=-1)
+        for level in range(1, len(level_logits)):
+            logits = self.constrain_level_logits(level, level_logits[level], parent_types)
+            parent_types = logits.argmax(dim=-1)
+
+        return logits
+
+
+class FactorizedSpERT(HierarchicalSpERT):
+    """ Hierarchical SpERT with a factorized entity classifier for inference: a cheap entity/None gate (level 0)
+    is applied to every span candidate, and only spans passing the gate are classified further, each level only
+    among the children of the type predicted for the previous level. Instead of a projection over all (fine-grained)
+    types for every span, most spans (None) only pay for the gate. Training is identical to 'HierarchicalSpERT' """
+
+    def __init__(self, *args, **kwargs):
+        super(FactorizedSpERT, self).__init__(*args, **kwargs)
+
+        # children of every type of the previous level (padded, see mask)
+        for level in range(1, len(self.level_sizes)):
+            parents = self.level_parents(level).tolist()
+            children = [[c for c, p in enumerate(parents) if p == parent and c != 0]
+                        for parent in range(self.level_sizes[level - 1])]
+            width = max(len(c) for c in children)
+
+            self.register_buffer('_level_children_%s' % level,
+                                 torch.tensor([c + [0] * (width - len(c)) for c in children], dtype=torch.long),
+                                 persistent=False)
+            self.register_buffer('_level_children_mask_%s' % level,
+                                 torch.tensor([[True] * len(c) + [False] * (width - len(c)) for c in children]),
+                                 persistent=False)
+
+    def level_children(self, level: int):
+        """ Children (padded) and padding mask of every type of the previous level """
+        return getattr(self, '_level_children_%s' % level), getattr(self, '_level_children_mask_%s' % level)
+
+    def level_classifier(self, level: int):
+        if level == len(self.level_sizes) - 1:
+            return self.entity_classifier
+        return self.level_entity_classifiers[level]
+
+    def _entity_logits(self, entity_repr, inference):
+        if not inference:
+            return super(FactorizedSpERT, self)._entity_logits(entity_repr, inference)
+
+        batch_size, span_count, repr_size = entity_repr.shape
+        entity_repr = entity_repr.view(-1, repr_size)
+
+        # gate: entity or None
+        parent_types = self.level_entity_classifiers[0](entity_repr).argmax(dim=-1)
+        entity_indices = parent_types.nonzero().view(-1)
+
+        # spans gated as None: 'None' type, all other types masked
+        min_value = torch.finfo(entity_repr.dtype).min
+        entity_clf = entity_repr.new_full((entity_repr.shape[0], self.level_sizes[-1]), min_value)
+        entity_clf[:, 0] = 0
+
+        if entity_indices.numel() != 0:
+            x = entity_repr[entity_indices]
+            parent_types = parent_types[entity_indices]
+
+            for level in range(1, len(self.level_sizes)):
+                # only project onto the children of the predicted parent type
+                children, children_mask = self.level_children(level)
+                children, children_mask = children[parent_types], children_mask[parent_types]
+
+                classifier = self.level_classifier(level)
+                logits = torch.einsum('ad,akd->ak', x, classifier.weight[children]) + classifier.bias[children]
+                logits = logits.masked_fill(~children_mask, min_value)
+
+                parent_types = children.gather(1, logits.argmax(dim=-1, keepdim=True)).squeeze(1)
+
+            # logits of the last level (among the children of the predicted parent, like 'HierarchicalSpERT')
+            level_clf = entity_repr.new_full((entity_indices.shape[0], self.level_sizes[-1]), min_value)
+            level_clf.scatter_(1, children.masked_fill(~children_mask, 0),
+                               logits.masked_fill(~children_mask, min_value))
+            entity_clf[entity_indices] = level_clf
+
+        return entity_clf.view(batch_size, span_count, -1)
+
+
 # Model access
 
 _MODELS = {
     'spert': SpERT,
+    'spert_hierarchical': HierarchicalSpERT,
+    'spert_factorized': FactorizedSpERT,
 }
 
 
@@ -1,18 +1,20 @@
-# optional packages
+# optional packages, imported on first access (e.g. 'opt.spacy'), so that runs which do not use them (such as
+# prediction without a spaCy model) do not pay for their import
 
-try:
-    import tensorboardX
-except ImportError:
-    tensorboardX = None
+import importlib
 
+_OPTIONAL_PACKAGES = ("tensorboardX", "jinja2", "spacy")
 
-try:
-    import jinja2
-except ImportError:
-    jinja2 = None
 
+def __getattr__(name):
+    if name not in _OPTIONAL_PACKAGES:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
 
-try:
-    import spacy
-except ImportError:
-    spacy = None
+    try:
+        package = importlib.import_module(name)
+    except ImportError:
+        package = None
+
+    # cached, later accesses do not call '__getattr__'
+    globals()[name] = package
+    return package
@@ -190,78 +190,111 @@ def _adjust_rel(rel: Tuple):
 
 
 def store_predictions(documents, pred_entities, pred_relations, store_path):
-    predictions = []
-
-    for i, doc in enumerate(documents):
-        tokens = doc.tokens
-        sample_pred_entities = pred_entities[i]
-        sample_pred_relations = pred_relations[i]
-
-        _entity_probas = {}
-        _relation_probas = {}
-
-        # convert entities
-        converted_entities = []
-        for entity in sample_pred_entities:
-            entity_span = entity[:2]
-            span_tokens = util.get_span_tokens(tokens, entity_span)
-            entity_type = entity[2].identifier
-
-            converted_entity = dict(
-                type=entity_type,
-                start=span_tokens[0].index,
-                end=span_tokens[-1].index + 1,
-            )
-            converted_entities.append(converted_entity)
-            _entity_probas[tuple(converted_entity.values())] = entity[
-                3
-            ]  # TB: added entity probability.
-        converted_entities = sorted(converted_entities, key=lambda e: e["start"])
-
-        # convert relations
-        converted_relations = []
-        for relation in sample_pred_relations:
-            head, tail = relation[:2]
-            head_span, head_type = head[:2], head[2].identifier
-            tail_span, tail_type = tail[:2], tail[2].identifier
-            head_span_tokens = util.get_span_tokens(tokens, head_span)
-            tail_span_tokens = util.get_span_tokens(tokens, tail_span)
-            relation_type = relation[2].identifier
-
-            converted_head = dict(
-                type=head_type,
-                start=head_span_tokens[0].index,
-                end=head_span_tokens[-1].index + 1,
-            )
-            converted_tail = dict(
-                type=tail_type,
-                start=tail_span_tokens[0].index,
-                end=tail_span_tokens[-1].index + 1,
+    with PredictionWriter(store_path) as writer:
+        writer.write(documents, pred_entities, pred_relations)
+
+
+class PredictionWriter:
+    """Writes predictions incrementally (batch by batch), as JSON list or, if `store_path` ends with '.jsonl',
+    as JSON lines (one document per line)"""
+
+    def __init__(self, store_path):
+        self._store_path = store_path
+        self._json_lines = util.is_json_lines(store_path)
+        self._file = None
+        self._count = 0
+
+    def __enter__(self):
+        self._file = open(self._store_path, "w")
+        if not self._json_lines:
+            self._file.write("[")
+        return self
+
+    def write(self, documents, pred_entities, pred_relations):
+        for doc, sample_pred_entities, sample_pred_relations in zip(
+            documents, pred_entities, pred_relations
+        ):
+            doc_predictions = json.dumps(
+                convert_document_predictions(
+                    doc, sample_pred_entities, sample_pred_relations
+                )
             )
 
-            head_idx = converted_entities.index(converted_head)
-            tail_idx = converted_entities.index(converted_tail)
-
-            converted_relation = dict(type=relation_type, head=head_idx, tail=tail_idx)
-            converted_relations.append(converted_relation)
-            _relation_probas[tuple(converted_relation.values())] = relation[
-                3
-            ]  # TB: added entity probability.
-        converted_relations = sorted(converted_relations, key=lambda r: r["head"])
-
-        doc_predictions = dict(
-            tokens=[t.phrase for t in tokens],
-            entities=[
-                {**e, "proba": _entity_probas[tuple(e.values())]}
-                for e in converted_entities
-            ],
-            relations=[
-                {**r, "proba": _relation_probas[tuple(r.values())]}
-                for r in converted_relations
-            ],
+            if self._json_lines:
+                self._file.write(doc_predictions + "\n")
+            else:
+                self._file.write((", " if self._count else "") + doc_predictions)
+            self._count += 1
+
+    def __exit__(self, *args):
+        if not self._json_lines:
+            self._file.write("]")
+        self._file.close()
+
+
+def convert_document_predictions(doc, sample_pred_entities, sample_pred_relations):
+    tokens = doc.tokens
+
+    _entity_probas = {}
+    _relation_probas = {}
+
+    # convert entities
+    converted_entities = []
+    for entity in sample_pred_entities:
+        entity_span = entity[:2]
+        span_tokens = util.get_span_tokens(tokens, entity_span)
+        entity_type = entity[2].identifier
+
+        converted_entity = dict(
+            type=entity_type,
+            start=span_tokens[0].index,
+            end=span_tokens[-1].index + 1,
+        )
+        converted_entities.append(converted_entity)
+        _entity_probas[tuple(converted_entity.values())] = entity[
+            3
+        ]  # TB: added entity probability.
+    converted_entities = sorted(converted_entities, key=lambda e: e["start"])
+
+    # convert relations
+    converted_relations = []
+    for relation in sample_pred_relations:
+        head, tail = relation[:2]
+        head_span, head_type = head[:2], head[2].identifier
+        tail_span, tail_type = tail[:2], tail[2].identifier
+        head_span_tokens = util.get_span_tokens(tokens, head_span)
+        tail_span_tokens = util.get_span_tokens(tokens, tail_span)
+        relation_type = relation[2].identifier
+
+        converted_head = dict(
+            type=head_type,
+            start=head_span_tokens[0].index,
+            end=head_span_tokens[-1].index + 1,
+        )
+        converted_tail = dict(
+            type=tail_type,
+            start=tail_span_tokens[0].index,
+            end=tail_span_tokens[-1].index + 1,
         )
-        predictions.append(doc_predictions)
 
-    # store as json
-    with open(store_path, "w") as predictions_file:
-        json.dump(predictions, predictions_file)
+        head_idx = converted_entities.index(converted_head)
+        tail_idx = converted_entities.index(converted_tail)
+
+        converted_relation = dict(type=relation_type, head=head_idx, tail=tail_idx)
+        converted_relations.append(converted_relation)
+        _relation_probas[tuple(converted_relation.values())] = relation[
+            3
+        ]  # TB: added entity probability.
+    converted_relations = sorted(converted_relations, key=lambda r: r["head"])
+
+    return dict(
+        tokens=[t.phrase for t in tokens],
+        entities=[
+            {**e, "proba": _entity_probas[tuple(e.values())]}
+            for e in converted_entities
+        ],
+        relations=[
+            {**r, "proba": _relation_probas[tuple(r.values())]}
+            for r in converted_relations
+        ],
+    )
@@ -0,0 +1,116 @@
+import contextlib
+import os
+import time
+from collections import OrderedDict
+
+import torch
+
+# stages in the order of a training/inference step
+STAGES = ('data_wait', 'collate', 'to_device', 'encoder', 'span_pooling', 'relation_classification',
+          'loss_backward', 'optimizer_step', 'prediction_conversion', 'evaluation')
+
+_NO_OP = contextlib.nullcontext()
+
+
+class StageTimer:
+    """ Accumulates the wall clock time of the stages of training/evaluation/prediction steps. A disabled timer only
+    hands out a no-op context, so the instrumentation is free unless profiling is switched on. On CUDA, the device is
+    synchronized at the stage boundaries, otherwise asynchronous kernels would be attributed to the next stage that
+    waits for the device. 'collate' is measured in the sampling processes, i.e. it overlaps with the other stages
+    (and is included in 'data_wait') """
+
+    def __init__(self, enabled: bool = False, device: torch.device = None):
+        self.enabled = enabled
+        self._synchronize = enabled and device is not None and device.type == 'cuda'
+
+        self._seconds = OrderedDict((stage, 0.0) for stage in STAGES)
+        self._calls = OrderedDict((stage, 0) for stage in STAGES)
+
+    def stage(self, name: str):
+        """ Context that times a stage (also labeled in torch.profiler traces) """
+        return self._timed(name) if self.enabled else _NO_OP
+
+    @contextlib.contextmanager
+    def _timed(self, name: str):
+        if self._synchronize:
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+
+        with torch.profiler.record_function(name):
+            yield
+
+        if self._synchronize:
+            torch.cuda.synchronize()
+        self.add(name, time.perf_counter() - start)
+
+    def add(self, name: str, seconds: float):
+        if self.enabled:
+            self._seconds[name] = self._seconds.get(name, 0.0) + seconds
+            self._calls[name] = self._calls.get(name, 0) + 1
+
+    def iterate(self, iterable):
+        """ Yields the batches of a data loader, timing the wait for every batch ('data_wait') and adding the
+        collate time reported by the batch """
+        if not self.enabled:
+            yield from iterable
+            return
+
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                batch = next(iterator)
+            except StopIteration:
+                return
+
+            self.add('data_wait', time.perf_counter() - start)
+            if hasattr(batch, 'collate_time'):
+                self.add('collate', batch.collate_time)
+            yield batch
+
+    def totals(self):
+        """ (stage, seconds, calls) of the stages that were timed """
+        return [(stage, seconds, self._calls[stage]) for stage, seconds in self._seconds.items() if self._calls[stage]]
+
+    def summary(self, title: str) -> str:
+        totals = self.totals()
+        overall = sum(seconds for stage, seconds, _ in totals if stage != 'collate') or 1.0
+
+        lines = [title, '%-24s %12s %10s %12s %8s' % ('stage', 'total s', 'calls', 'mean ms', 'share')]
+        for stage, seconds, calls in totals:
+            lines.append('%-24s %12.3f %10d %12.3f %7.1f%%' % (stage, seconds, calls, 1000 * seconds / calls,
+                                                                100 * seconds / overall))
+        return '\n'.join(lines)
+
+    def reset(self):
+        for stage in self._seconds:
+            self._seconds[stage] = 0.0
+            self._calls[stage] = 0
+
+
+def trace(path: str, steps: int, device: torch.device):
+    """ torch.profiler context that records 'steps' steps (after one wait and one warm up step) as TensorBoard trace
+    in 'path'. Call 'step()' after every step """
+    activities = [torch.profiler.ProfilerActivity.CPU]
+    if device.type == 'cuda':
+        activities.append(torch.profiler.ProfilerActivity.CUDA)
+
+    os.makedirs(path, exist_ok=True)
+    return torch.profiler.profile(activities=activities,
+                                  schedule=torch.profiler.schedule(wait=1, warmup=1, active=steps, repeat=1),
+                                  on_trace_ready=torch.profiler.tensorboard_trace_handler(path),
+                                  record_shapes=True, with_stack=False)
+
+
+class _NoTrace:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def step(self):
+        pass
+
+
+NO_TRACE = _NoTrace()
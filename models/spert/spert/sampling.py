@@ -1,54 +1,66 @@
 import random
+import time
 
 import torch
+from torch.utils.data import Sampler
 
 from spert import util
 
 
+def _token_span_candidates(doc, max_span_size: int):
+    """ All spans of up to 'max_span_size' tokens as (sub-word span, token count), shortest first """
+    token_spans = doc.token_spans
+    starts, ends = token_spans[:, 0].tolist(), token_spans[:, 1].tolist()
+    token_count = len(starts)
+
+    for size in range(1, max_span_size + 1):
+        for i in range(0, (token_count - size) + 1):
+            yield (starts[i], ends[i + size - 1]), size
+
+
 def create_train_sample(doc, neg_entity_count: int, neg_rel_count: int, max_span_size: int, rel_type_count: int):
+    # the document is read through its flat arrays (see 'entities.DocumentStore')
     encodings = doc.encoding
-    token_count = len(doc.tokens)
     context_size = len(encodings)
 
     # positive entities
-    pos_entity_spans, pos_entity_types, pos_entity_masks, pos_entity_sizes = [], [], [], []
-    for e in doc.entities:
-        pos_entity_spans.append(e.span)
-        pos_entity_types.append(e.entity_type.index)
-        pos_entity_masks.append(create_entity_mask(*e.span, context_size))
-        pos_entity_sizes.append(len(e.tokens))
+    pos_entity_spans = [tuple(span) for span in doc.entity_spans.tolist()]
+    pos_entity_types = doc.entity_type_indices.tolist()
+    pos_entity_masks = [create_entity_mask(*span, context_size) for span in pos_entity_spans]
+    pos_entity_sizes = doc.entity_sizes.tolist()
+    # probability of the labeled type (1, or < 1 for soft labels of a teacher model)
+    pos_entity_probas = doc.entity_probas.tolist()
 
     # positive relations
 
-    # collect relations between entity pairs
+    # collect relation types (and their probabilities) between entity pairs (indices into the document's entities)
     entity_pair_relations = dict()
-    for rel in doc.relations:
-        pair = (rel.head_entity, rel.tail_entity)
+    for pair, rel_type, rel_proba in zip(doc.relation_pairs.tolist(), doc.relation_type_indices.tolist(),
+                                         doc.relation_probas.tolist()):
+        pair = tuple(pair)
         if pair not in entity_pair_relations:
-            entity_pair_relations[pair] = []
-        entity_pair_relations[pair].append(rel)
+            entity_pair_relations[pair] = dict()
+        entity_pair_relations[pair][rel_type] = rel_proba
 
     # build positive relation samples
     pos_rels, pos_rel_spans, pos_rel_types, pos_rel_masks = [], [], [], []
-    for pair, rels in entity_pair_relations.items():
-        head_entity, tail_entity = pair
-        s1, s2 = head_entity.span, tail_entity.span
+    for (head, tail), pair_rel_types in entity_pair_relations.items():
+        s1, s2 = pos_entity_spans[head], pos_entity_spans[tail]
         pos_rels.append((pos_entity_spans.index(s1), pos_entity_spans.index(s2)))
         pos_rel_spans.append((s1, s2))
 
-        pair_rel_types = [r.relation_type.index for r in rels]
-        pair_rel_types = [int(t in pair_rel_types) for t in range(1, rel_type_count)]
+        # multi-label targets, soft labels are the (sigmoid) probabilities of the teacher
+        pair_rel_types = [pair_rel_types.get(t, 0) for t in range(1, rel_type_count)]
         pos_rel_types.append(pair_rel_types)
         pos_rel_masks.append(create_rel_mask(s1, s2, context_size))
 
     # negative entities
     neg_entity_spans, neg_entity_sizes = [], []
-    for size in range(1, max_span_size + 1):
-        for i in range(0, (token_count - size) + 1):
-            span = doc.tokens[i:i + size].span
-            if span not in pos_entity_spans:
-                neg_entity_spans.append(span)
-                neg_entity_sizes.append(size)
+    pos_entity_span_set = set(pos_entity_spans)
+    for span, size in _token_span_candidates(doc, max_span_size):
+        if span not in pos_entity_span_set:
+            neg_entity_spans.append(span)
+            neg_entity_sizes.append(size)
 
     # sample negative entities
     neg_entity_samples = random.sample(list(zip(neg_entity_spans, neg_entity_sizes)),
@@ -81,12 +93,13 @@ def create_train_sample(doc, neg_entity_count: int, neg_rel_count: int, max_span
     entity_types = pos_entity_types + neg_entity_types
     entity_masks = pos_entity_masks + neg_entity_masks
     entity_sizes = pos_entity_sizes + list(neg_entity_sizes)
+    entity_probas = pos_entity_probas + [1.0] * len(neg_entity_spans)
 
     rels = pos_rels + neg_rels
     rel_types = pos_rel_types + neg_rel_types
     rel_masks = pos_rel_masks + neg_rel_masks
 
-    assert len(entity_masks) == len(entity_sizes) == len(entity_types)
+    assert len(entity_masks) == len(entity_sizes) == len(entity_types) == len(entity_probas)
     assert len(rels) == len(rel_masks) == len(rel_types)
 
     # create tensors
@@ -104,12 +117,14 @@ def create_train_sample(doc, neg_entity_count: int, neg_rel_count: int, max_span
         entity_types = torch.tensor(entity_types, dtype=torch.long)
         entity_masks = torch.stack(entity_masks)
         entity_sizes = torch.tensor(entity_sizes, dtype=torch.long)
+        entity_probas = torch.tensor(entity_probas, dtype=torch.float32)
         entity_sample_masks = torch.ones([entity_masks.shape[0]], dtype=torch.bool)
     else:
         # corner case handling (no pos/neg entities)
         entity_types = torch.zeros([1], dtype=torch.long)
         entity_masks = torch.zeros([1, context_size], dtype=torch.bool)
         entity_sizes = torch.zeros([1], dtype=torch.long)
+        entity_probas = torch.ones([1], dtype=torch.float32)
         entity_sample_masks = torch.zeros([1], dtype=torch.bool)
 
     if rels:
@@ -124,15 +139,17 @@ def create_train_sample(doc, neg_entity_count: int, neg_rel_count: int, max_span
         rel_masks = torch.zeros([1, context_size], dtype=torch.bool)
         rel_sample_masks = torch.zeros([1], dtype=torch.bool)
 
+    # sample weight of the document
+    weights = torch.tensor(doc.weight, dtype=torch.float32)
+
     return dict(encodings=encodings, context_masks=context_masks, entity_masks=entity_masks,
-                entity_sizes=entity_sizes, entity_types=entity_types,
+                entity_sizes=entity_sizes, entity_types=entity_types, entity_probas=entity_probas,
                 rels=rels, rel_masks=rel_masks, rel_types=rel_types,
-                entity_sample_masks=entity_sample_masks, rel_sample_masks=rel_sample_masks)
+                entity_sample_masks=entity_sample_masks, rel_sample_masks=rel_sample_masks, weights=weights)
 
 
 def create_eval_sample(doc, max_span_size: int):
     encodings = doc.encoding
-    token_count = len(doc.tokens)
     context_size = len(encodings)
 
     # create entity candidates
@@ -140,12 +157,10 @@ def create_eval_sample(doc, max_span_size: int):
     entity_masks = []
     entity_sizes = []
 
-    for size in range(1, max_span_size + 1):
-        for i in range(0, (token_count - size) + 1):
-            span = doc.tokens[i:i + size].span
-            entity_spans.append(span)
-            entity_masks.append(create_entity_mask(*span, context_size))
-            entity_sizes.append(size)
+    for span, size in _token_span_candidates(doc, max_span_size):
+        entity_spans.append(span)
+        entity_masks.append(create_entity_mask(*span, context_size))
+        entity_sizes.append(size)
 
     # create tensors
     # token indices
@@ -191,16 +206,62 @@ def create_rel_mask(s1, s2, context_size):
     return mask
 
 
-def collate_fn_padding(batch):
-    padded_batch = dict()
-    keys = batch[0].keys()
+# keys whose last dimension has a fixed size (span boundaries, relation pairs, relation types)
+_FIXED_LAST_DIM_KEYS = {'entity_spans', 'rels', 'rel_types'}
+
+
+def collate_fn_padding(batch, pin_memory: bool = False, bucketed: bool = False):
+    """ Copies the samples of every key into their slices of one preallocated, zero padded batch buffer (pinned
+    if 'pin_memory', i.e. collated in the main process for a CUDA device), which 'util.to_device' moves in a single
+    copy. If 'bucketed', every variable sized dimension is padded to the next power of two """
+    start = time.perf_counter()
+
+    shapes = dict()
+    for key in batch[0].keys():
+        shape = [len(batch)] + util.max_shape([s[key] for s in batch])
 
-    for key in keys:
-        samples = [s[key] for s in batch]
+        if bucketed:
+            bucketed_dims = len(shape) - 1 if key in _FIXED_LAST_DIM_KEYS else len(shape)
+            for d in range(1, bucketed_dims):
+                shape[d] = util.bucket_size(shape[d])
 
-        if not batch[0][key].shape:
-            padded_batch[key] = torch.stack(samples)
-        else:
-            padded_batch[key] = util.padded_stack([s[key] for s in batch])
+        shapes[key] = (shape, batch[0][key].dtype)
 
+    padded_batch = util.PaddedBatch(shapes, pin_memory=pin_memory)
+    for key in shapes:
+        util.padded_stack([s[key] for s in batch], out=padded_batch[key])
+
+    padded_batch.collate_time = time.perf_counter() - start
+    return padded_batch
+
+
+def collate_fn_streaming(batch, collate_fn=collate_fn_padding):
+    """ Collates the samples of a 'StreamingDataset', the documents of the batch are passed as list """
+    documents = [s.pop('document') for s in batch]
+    padded_batch = collate_fn(batch)
+    padded_batch['documents'] = documents
     return padded_batch
+
+
+def collate_fn_padding_bucketed(batch, pin_memory: bool = False):
+    """ Like 'collate_fn_padding', but additionally pads every variable sized dimension (context size,
+    entity candidates, relations) to the next power of two, so compiled models only see a few static shapes """
+    return collate_fn_padding(batch, pin_memory=pin_memory, bucketed=True)
+
+
+class ShardSampler(Sampler):
+    """ Assigns every 'num_replicas'-th sample to a rank (distributed evaluation). Unlike 'DistributedSampler',
+    samples are neither shuffled nor repeated to even out the shards, so every document is evaluated exactly once """
+
+    def __init__(self, dataset, num_replicas: int, rank: int):
+        self._indices = list(range(rank, len(dataset), num_replicas))
+
+    @property
+    def indices(self):
+        return self._indices
+
+    def __iter__(self):
+        return iter(self._indices)
+
+    def __len__(self):
+        return len(self._indices)
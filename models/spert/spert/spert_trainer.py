@@ -1,23 +1,30 @@
 import argparse
+import copy
+import functools
+import itertools
+import json
 import math
+import multiprocessing
 import os
+import tempfile
+import time
 from typing import Type
 
 import torch
-from torch.nn import DataParallel
+from torch.nn.parallel import DistributedDataParallel
 from torch.optim import Optimizer
 import transformers
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, DistributedSampler
 from transformers import AdamW, BertConfig
 from transformers import BertTokenizer
 
-from spert import models, prediction
+from spert import bundling, models, prediction, profiling, trimming
 from spert import sampling
 from spert import util
-from spert.entities import Dataset
+from spert.entities import Dataset, StreamingDataset
 from spert.evaluator import Evaluator
 from spert.input_reader import JsonInputReader, BaseInputReader
-from spert.loss import SpERTLoss, Loss
+from spert.loss import SpERTLoss, HierarchicalSpERTLoss, Loss
 from tqdm import tqdm
 from spert.trainer import BaseTrainer
 
@@ -30,11 +37,44 @@ class SpERTTrainer(BaseTrainer):
     def __init__(self, args: argparse.Namespace):
         super().__init__(args)
 
+        # single-file model bundle (weights, config, types and vocabulary), see 'spert.py bundle'
+        bundle_path = getattr(args, "bundle_path", None)
+        self._bundle = bundling.ModelBundle(bundle_path) if bundle_path else None
+        self._model_type = self._bundle.model_type if self._bundle else args.model_type
+
         # byte-pair encoding
-        self._tokenizer = BertTokenizer.from_pretrained(
-            args.tokenizer_path, do_lower_case=args.lowercase, cache_dir=args.cache_path
+        if self._bundle is not None:
+            self._tokenizer = self._bundle.tokenizer()
+        else:
+            self._tokenizer = BertTokenizer.from_pretrained(
+                args.tokenizer_path,
+                do_lower_case=args.lowercase,
+                cache_dir=args.cache_path,
+            )
+
+        # bucketed static shapes for (compiled) inference
+        self._static_shapes = args.static_shapes or args.compile
+        # data loaders (and their sampling processes) persist across epochs, see '_data_loader'
+        self._data_loaders = dict()
+
+        # batches collated in the main process are allocated in pinned memory (asynchronous copies to the device)
+        pin_memory = self._device.type == "cuda" and args.sampling_processes == 0
+        self._train_collate_fn = functools.partial(
+            sampling.collate_fn_padding, pin_memory=pin_memory
+        )
+        self._eval_collate_fn = functools.partial(
+            sampling.collate_fn_padding_bucketed
+            if self._static_shapes
+            else sampling.collate_fn_padding,
+            pin_memory=pin_memory,
         )
 
+        # per-stage timers (see '--profile') and a torch.profiler trace of the first steps (see '--profile_steps')
+        self._stage_timer = profiling.StageTimer(
+            args.profile or args.profile_steps > 0, self._device
+        )
+        self._trace_pending = args.profile_steps > 0
+
     def train(
         self,
         train_path: str,
@@ -42,6 +82,21 @@ class SpERTTrainer(BaseTrainer):
         types_path: str,
         input_reader_cls: Type[BaseInputReader],
     ):
+        self._train(train_path, valid_path, types_path, input_reader_cls)
+
+        self._logger.info("Logged in: %s" % self._log_path)
+        self._logger.info("Saved in: %s" % self._save_path)
+        self._close_summary_writer()
+        self._close_distributed()
+
+    def _train(
+        self,
+        train_path: str,
+        valid_path: str,
+        types_path: str,
+        input_reader_cls: Type[BaseInputReader],
+    ):
+        # returns the trained model, the validation dataset and the scores of the last evaluation
         args = self._args
         train_label, valid_label = "train", "valid"
 
@@ -54,7 +109,7 @@ class SpERTTrainer(BaseTrainer):
 
         # read datasets
         input_reader = input_reader_cls(
-            types_path,
+            self._bundle.types if self._bundle else types_path,
             self._tokenizer,
             args.neg_entity_count,
             args.neg_relation_count,
@@ -63,10 +118,13 @@ class SpERTTrainer(BaseTrainer):
         )
         train_dataset = input_reader.read(train_path, train_label)
         validation_dataset = input_reader.read(valid_path, valid_label)
+        self._share_dataset(train_dataset)
+        self._share_dataset(validation_dataset)
         self._log_datasets(input_reader)
 
         train_sample_count = train_dataset.document_count
-        updates_epoch = train_sample_count // args.train_batch_size
+        # in distributed training, every rank processes 'train_batch_size' documents per update
+        updates_epoch = train_sample_count // (args.train_batch_size * self._world_size)
         updates_total = updates_epoch * args.epochs
 
         self._logger.info("Updates per epoch: %s" % updates_epoch)
@@ -75,14 +133,17 @@ class SpERTTrainer(BaseTrainer):
         # load model
         model = self._load_model(input_reader)
 
-        # SpERT is currently optimized on a single GPU and not thoroughly tested in a multi GPU setup
-        # If you still want to train SpERT on multiple GPUs, uncomment the following lines
-        # # parallelize model
-        # if self._device.type != 'cpu':
-        #     model = torch.nn.DataParallel(model)
-
         model.to(self._device)
 
+        # parallelize model (one process per device, see '--distributed')
+        if self._distributed:
+            model = DistributedDataParallel(
+                model,
+                device_ids=[self._device.index] if self._device.type == "cuda" else None,
+                # the BERT pooler is not used by SpERT
+                find_unused_parameters=True,
+            )
+
         # create optimizer
         optimizer_params = self._get_optimizer_params(model)
         optimizer = AdamW(
@@ -101,31 +162,70 @@ class SpERTTrainer(BaseTrainer):
         rel_criterion = torch.nn.BCEWithLogitsLoss(reduction="none")
         entity_criterion = torch.nn.CrossEntropyLoss(reduction="none")
 
-        compute_loss = SpERTLoss(
+        loss_cls = (
+            HierarchicalSpERTLoss
+            if isinstance(util.unwrap_model(model), models.HierarchicalSpERT)
+            else SpERTLoss
+        )
+        compute_loss = loss_cls(
             rel_criterion,
             entity_criterion,
             model,
             optimizer,
             scheduler,
             args.max_grad_norm,
+            stage_timer=self._stage_timer,
         )
 
         # eval validation set
         if args.init_eval:
             self._eval(model, validation_dataset, input_reader, 0, updates_epoch)
+            self._log_profile(train_label, 0, 0)
 
         # train
+        scores = None
         for epoch in range(args.epochs):
             # train epoch
             self._train_epoch(
                 model, compute_loss, optimizer, train_dataset, updates_epoch, epoch
             )
 
+            global_iteration = (epoch + 1) * updates_epoch
+            extra = dict(
+                epoch=epoch + 1, updates_epoch=updates_epoch, epoch_iteration=0
+            )
+
             # eval validation sets
             if not args.final_eval or (epoch == args.epochs - 1):
-                self._eval(
+                scores = self._eval(
                     model, validation_dataset, input_reader, epoch + 1, updates_epoch
                 )
+                ner_eval, rel_eval, rel_nec_eval = scores
+
+                if args.save_best:
+                    # strict relation micro F1 (relations including the entity types)
+                    self._save_best(
+                        model,
+                        self._tokenizer,
+                        optimizer,
+                        rel_nec_eval[2],
+                        global_iteration,
+                        valid_label,
+                        extra=extra,
+                    )
+
+            if args.keep_last_checkpoints > 0:
+                self._save_model(
+                    self._save_path,
+                    model,
+                    self._tokenizer,
+                    global_iteration,
+                    optimizer=optimizer if self._args.save_optimizer else None,
+                    extra=extra,
+                )
+
+            self._log_profile(train_label, epoch + 1, global_iteration)
+            self._metric_logger.flush()
 
         # save final model
         extra = dict(epoch=args.epochs, updates_epoch=updates_epoch, epoch_iteration=0)
@@ -140,10 +240,15 @@ class SpERTTrainer(BaseTrainer):
             include_iteration=False,
             name="final_model",
         )
+        if args.save_bundle and self._main_process:
+            self._save_bundle(
+                os.path.join(self._save_path, "final_model_bundle.safetensors"),
+                model,
+                types_path,
+            )
+        self._close_checkpoint_writer()
 
-        self._logger.info("Logged in: %s" % self._log_path)
-        self._logger.info("Saved in: %s" % self._save_path)
-        self._close_summary_writer()
+        return model, validation_dataset, scores
 
     def eval(
         self,
@@ -155,30 +260,34 @@ class SpERTTrainer(BaseTrainer):
         dataset_label = "test"
 
         self._logger.info("Dataset: %s" % dataset_path)
-        self._logger.info("Model: %s" % args.model_type)
+        self._logger.info("Model: %s" % self._model_type)
 
         # create log csv files
-        self._init_eval_logging(dataset_label)
+        self._init_eval_logging(dataset_label, profile=True)
 
         # read datasets
         input_reader = input_reader_cls(
-            types_path,
+            self._bundle.types if self._bundle else types_path,
             self._tokenizer,
             max_span_size=args.max_span_size,
             logger=self._logger,
         )
         test_dataset = input_reader.read(dataset_path, dataset_label)
+        self._share_dataset(test_dataset)
         self._log_datasets(input_reader)
 
         # load model
         model = self._load_model(input_reader)
         model.to(self._device)
+        self._compile_model(model)
 
         # evaluate
         self._eval(model, test_dataset, input_reader)
+        self._log_profile(dataset_label, 0, 0)
 
         self._logger.info("Logged in: %s" % self._log_path)
         self._close_summary_writer()
+        self._close_distributed()
 
     def predict(
         self,
@@ -190,44 +299,446 @@ class SpERTTrainer(BaseTrainer):
 
         # read datasets
         input_reader = input_reader_cls(
-            types_path,
+            self._bundle.types if self._bundle else types_path,
             self._tokenizer,
             max_span_size=args.max_span_size,
             spacy_model=args.spacy_model,
         )
-        dataset = input_reader.read(dataset_path, "dataset")
+        if args.stream:
+            # documents are parsed while predicting, memory does not depend on the input size
+            dataset = input_reader.stream(dataset_path, "dataset", args.eval_batch_size)
+        else:
+            dataset = input_reader.read(dataset_path, "dataset")
 
         model = self._load_model(input_reader)
         model.to(self._device)
+        self._compile_model(model)
+
+        if args.stream:
+            self._predict_stream(model, dataset, input_reader)
+        else:
+            self._predict(model, dataset, input_reader)
+        self._log_profile("dataset", 0, 0)
+
+    def distill(
+        self,
+        train_path: str,
+        valid_path: str,
+        silver_path: str,
+        types_path: str,
+        input_reader_cls: Type[BaseInputReader],
+        prediction_reader_cls: Type[BaseInputReader],
+    ):
+        """Trains the model of the run (the student, e.g. a smaller BERT) on a corpus labeled by a teacher model
+        (soft labels, see 'teacher_path') and the gold training documents, and compares student and teacher on the
+        validation dataset (F1 and CPU throughput)"""
+        args = self._args
+        if args.teacher_labels_path is None and not (args.teacher_path and silver_path):
+            raise Exception(
+                "Distillation requires 'teacher_path' and 'silver_path' (or 'teacher_labels_path')"
+            )
+
+        labels_path = args.teacher_labels_path
+        if labels_path is None:
+            labels_path = os.path.join(self._log_path, "teacher_labels.jsonl")
+            if self._main_process:
+                self._label_corpus(
+                    silver_path, labels_path, types_path, prediction_reader_cls
+                )
+
+        distill_path = os.path.join(self._log_path, "distill_train.jsonl")
+        if self._main_process:
+            self._write_distill_dataset(distill_path, train_path, labels_path)
+        if self._distributed:
+            # the other ranks read the files written by the main process
+            torch.distributed.barrier()
+
+        model, validation_dataset, scores = self._train(
+            distill_path, valid_path, types_path, input_reader_cls
+        )
+        self._compare_teacher(
+            model, validation_dataset, scores, valid_path, types_path, input_reader_cls
+        )
+
+        self._logger.info("Logged in: %s" % self._log_path)
+        self._logger.info("Saved in: %s" % self._save_path)
+        self._close_summary_writer()
+        self._close_distributed()
+
+    def _load_teacher(self, types_path: str, input_reader_cls: Type[BaseInputReader]):
+        # teacher model (checkpoint directory or model bundle), its tokenizer and an input reader with its tokenizer
+        args = self._args
+
+        bundle = None
+        if os.path.isfile(args.teacher_path):
+            bundle = bundling.ModelBundle(args.teacher_path)
+            tokenizer, types = bundle.tokenizer(), bundle.types
+        else:
+            # the tokenizer configuration of the checkpoint (e.g. lower casing) applies, not the one of the student
+            tokenizer = BertTokenizer.from_pretrained(
+                args.teacher_path, cache_dir=args.cache_path
+            )
+            types = types_path
+
+        input_reader = input_reader_cls(
+            types, tokenizer, max_span_size=args.max_span_size, logger=self._logger
+        )
+        model = self._load_model(
+            input_reader,
+            model_path=args.teacher_path,
+            bundle=bundle,
+            model_type=args.teacher_model_type,
+            tokenizer=tokenizer,
+        )
+        model.to(self._device)
+
+        return model, tokenizer, input_reader
+
+    def _label_corpus(
+        self,
+        corpus_path: str,
+        labels_path: str,
+        types_path: str,
+        prediction_reader_cls: Type[BaseInputReader],
+    ):
+        # the predictions of the teacher (with the probability of every entity and relation) are the soft labels
+        self._logger.info(
+            "Label %s with teacher %s" % (corpus_path, self._args.teacher_path)
+        )
+        teacher, _, input_reader = self._load_teacher(types_path, prediction_reader_cls)
 
-        self._predict(model, dataset, input_reader)
+        dataset = input_reader.stream(
+            corpus_path, "teacher_labels", self._args.eval_batch_size
+        )
+        self._predict_stream(teacher, dataset, input_reader, labels_path)
+
+    def _write_distill_dataset(
+        self, distill_path: str, train_path: str, labels_path: str
+    ):
+        # gold documents (hard labels) followed by the teacher labeled documents (soft labels), as JSON lines
+        with open(distill_path, "w") as distill_file:
+            for path in [path for path in (train_path, labels_path) if path]:
+                document_count = 0
+                for document in util.iter_json_documents(path):
+                    distill_file.write(json.dumps(document) + "\n")
+                    document_count += 1
+                self._logger.info(
+                    "Distillation dataset: %s documents of %s" % (document_count, path)
+                )
+
+    def _compare_teacher(
+        self,
+        model: torch.nn.Module,
+        validation_dataset: Dataset,
+        scores,
+        valid_path: str,
+        types_path: str,
+        input_reader_cls: Type[BaseInputReader],
+    ):
+        # micro F1 of entities and relations (strict, i.e. including the entity types)
+        ner_eval, _, rel_nec_eval = scores
+        throughput = self._cpu_throughput(model, validation_dataset)
+        report = dict(
+            student=dict(
+                ner_f1_micro=ner_eval[2],
+                rel_nec_f1_micro=rel_nec_eval[2],
+                cpu_documents_per_second=throughput,
+            )
+        )
+
+        if self._args.teacher_path:
+            # the validation dataset is encoded with the tokenizer of the teacher
+            teacher, tokenizer, input_reader = self._load_teacher(
+                types_path, input_reader_cls
+            )
+            teacher_dataset = input_reader.read(valid_path, "valid_teacher")
+            self._share_dataset(teacher_dataset)
+            self._init_eval_logging("valid_teacher")
+
+            ner_eval, _, rel_nec_eval = self._eval(
+                teacher, teacher_dataset, input_reader, tokenizer=tokenizer
+            )
+            throughput = self._cpu_throughput(teacher, teacher_dataset)
+            report["teacher"] = dict(
+                ner_f1_micro=ner_eval[2],
+                rel_nec_f1_micro=rel_nec_eval[2],
+                cpu_documents_per_second=throughput,
+            )
+
+        for name, results in report.items():
+            self._logger.info(
+                "Distillation, %s: entity F1 %.2f, relation F1 %.2f, CPU throughput %.1f documents/s"
+                % (
+                    name,
+                    results["ner_f1_micro"],
+                    results["rel_nec_f1_micro"],
+                    results["cpu_documents_per_second"],
+                )
+            )
+
+        if "teacher" in report:
+            student, teacher = report["student"], report["teacher"]
+            delta = {
+                key: student[key] - teacher[key]
+                for key in ("ner_f1_micro", "rel_nec_f1_micro")
+            }
+            delta["cpu_speedup"] = (
+                student["cpu_documents_per_second"]
+                / teacher["cpu_documents_per_second"]
+            )
+            report["delta"] = delta
+
+            self._logger.info(
+                "Distillation, student - teacher: entity F1 %+.2f, relation F1 %+.2f, CPU throughput %.1fx"
+                % (
+                    delta["ner_f1_micro"],
+                    delta["rel_nec_f1_micro"],
+                    delta["cpu_speedup"],
+                )
+            )
+
+        if self._main_process:
+            with open(os.path.join(self._log_path, "distill.json"), "w") as report_file:
+                json.dump(report, report_file, indent=2)
 
-    def _load_model(self, input_reader):
-        model_class = models.get_model(self._args.model_type)
+    def _cpu_throughput(self, model: torch.nn.Module, dataset: Dataset) -> float:
+        """Documents per second of the forward passes (inference) of 'model' on the CPU, without sampling"""
+        model = util.unwrap_model(model).to("cpu")
+        if model.encoder_cache is not None:
+            # holds the documents of the preceding evaluation
+            model.encoder_cache.clear()
 
-        config = BertConfig.from_pretrained(
-            self._args.model_path, cache_dir=self._args.cache_path
+        dataset.switch_mode(Dataset.EVAL_MODE)
+        data_loader = DataLoader(
+            dataset,
+            batch_size=self._args.eval_batch_size,
+            shuffle=False,
+            collate_fn=self._eval_collate_fn,
         )
-        util.check_version(config, model_class, self._args.model_path)
+
+        seconds = 0.0
+        with torch.no_grad():
+            model.eval()
+            for batch in tqdm(data_loader, desc="CPU throughput"):
+                start = time.perf_counter()
+                model(
+                    encodings=batch["encodings"],
+                    context_masks=batch["context_masks"],
+                    entity_masks=batch["entity_masks"],
+                    entity_sizes=batch["entity_sizes"],
+                    entity_spans=batch["entity_spans"],
+                    entity_sample_masks=batch["entity_sample_masks"],
+                    inference=True,
+                )
+                seconds += time.perf_counter() - start
+
+        return dataset.document_count / seconds
+
+    def bundle(
+        self,
+        output_path: str,
+        types_path: str,
+        input_reader_cls: Type[BaseInputReader],
+    ):
+        """Writes model, tokenizer vocabulary and types into a single-file model bundle (see 'bundle_path'),
+        with the vocabulary trimmed to the given corpora if 'trim_corpus_paths'"""
+        types = self._bundle.types if self._bundle else types_path
+        input_reader = input_reader_cls(
+            types,
+            self._tokenizer,
+            max_span_size=self._args.max_span_size,
+        )
+        model = self._load_model(input_reader)
+        tokenizer = self._tokenizer
+
+        if self._args.trim_corpus_paths:
+            model, tokenizer = self._trim_vocabulary(model, types, input_reader_cls)
+
+        self._save_bundle(output_path, model, types_path, tokenizer=tokenizer)
+        self._logger.info(
+            "Saved model bundle: %s (%.1f MB)"
+            % (output_path, os.path.getsize(output_path) / 2**20)
+        )
+
+    def _trim_vocabulary(
+        self, model: torch.nn.Module, types, input_reader_cls: Type[BaseInputReader]
+    ):
+        args = self._args
+
+        counts = trimming.corpus_token_ids(self._tokenizer, args.trim_corpus_paths)
+        kept_ids = trimming.kept_token_ids(self._tokenizer, counts, args.trim_margin)
+        self._logger.info(
+            "Vocabulary: %s of %s sub-words used in the corpora, %s kept (margin: %s)"
+            % (len(counts), len(self._tokenizer.vocab), len(kept_ids), args.trim_margin)
+        )
+
+        trimmed_model = copy.deepcopy(model)
+        trimmed_tokenizer = trimming.trim_vocabulary(
+            trimmed_model, self._tokenizer, kept_ids
+        )
+
+        # the trimmed model must predict exactly the same on (a sample of) the corpora
+        documents = itertools.islice(
+            itertools.chain.from_iterable(
+                util.iter_json_documents(path) for path in args.trim_corpus_paths
+            ),
+            args.trim_verify_count,
+        )
+        with tempfile.TemporaryDirectory() as verify_dir:
+            verify_path = os.path.join(verify_dir, "verify.json")
+            with open(verify_path, "w") as f:
+                json.dump(list(documents), f)
+
+            outputs = [
+                self._predict_raw(m, tok, types, input_reader_cls, verify_path)
+                for m, tok in (
+                    (model, self._tokenizer),
+                    (trimmed_model, trimmed_tokenizer),
+                )
+            ]
+
+        for batch, trimmed_batch in zip(*outputs):
+            for output, trimmed_output in zip(batch, trimmed_batch):
+                if output.shape != trimmed_output.shape or not torch.allclose(
+                    output.float(), trimmed_output.float(), atol=1e-5
+                ):
+                    raise Exception(
+                        "Predictions of the vocabulary-trimmed model differ from the original model"
+                    )
+        self._logger.info(
+            "Vocabulary-trimmed model verified: identical predictions on %s documents"
+            % sum(len(batch[0]) for batch in outputs[0])
+        )
+
+        return trimmed_model, trimmed_tokenizer
+
+    def _predict_raw(
+        self,
+        model: torch.nn.Module,
+        tokenizer: BertTokenizer,
+        types,
+        input_reader_cls: Type[BaseInputReader],
+        dataset_path: str,
+    ):
+        # entity/relation classifications and relations of every batch (CPU)
+        input_reader = input_reader_cls(
+            types, tokenizer, max_span_size=self._args.max_span_size
+        )
+        dataset = input_reader.read(dataset_path, "verify")
+        dataset.switch_mode(Dataset.EVAL_MODE)
+        data_loader = DataLoader(
+            dataset,
+            batch_size=self._args.eval_batch_size,
+            shuffle=False,
+            collate_fn=self._eval_collate_fn,
+        )
+
+        outputs = []
+        model.to(self._device)
+        with torch.no_grad():
+            model.eval()
+            for batch in data_loader:
+                batch = util.to_device(batch, self._device)
+                result = model(
+                    encodings=batch["encodings"],
+                    context_masks=batch["context_masks"],
+                    entity_masks=batch["entity_masks"],
+                    entity_sizes=batch["entity_sizes"],
+                    entity_spans=batch["entity_spans"],
+                    entity_sample_masks=batch["entity_sample_masks"],
+                    inference=True,
+                )
+                outputs.append([output.cpu() for output in result])
+        return outputs
+
+    def _save_bundle(
+        self,
+        path: str,
+        model: torch.nn.Module,
+        types_path: str,
+        tokenizer: BertTokenizer = None,
+    ):
+        if self._bundle is not None:
+            types = self._bundle.types
+        else:
+            with open(types_path) as types_file:
+                types = json.load(types_file)
+
+        bundling.save_bundle(
+            path,
+            util.unwrap_model(model),
+            tokenizer or self._tokenizer,
+            types,
+            self._model_type,
+        )
+
+    def _load_model(
+        self,
+        input_reader,
+        model_path: str = None,
+        bundle: bundling.ModelBundle = None,
+        model_type: str = None,
+        tokenizer: BertTokenizer = None,
+    ):
+        """Loads the model of the run or, if given, the checkpoint directory 'model_path' or model 'bundle' (e.g. the
+        teacher of 'distill') with its 'tokenizer'"""
+        if model_path is None and bundle is None:
+            model_path, bundle = self._args.model_path, self._bundle
+            model_type, tokenizer = self._model_type, self._tokenizer
+
+        if bundle is not None:
+            model_path, model_type = bundle.path, bundle.model_type
+            config = bundle.config
+        else:
+            config = BertConfig.from_pretrained(
+                model_path, cache_dir=self._args.cache_path
+            )
+        model_class = models.get_model(model_type)
+        # only reads the parameter names, not the weights
+        util.check_version(config, model_class, model_path)
 
         config.spert_version = model_class.VERSION
-        print(f"Loading model: {self._args.model_path}")
-        model = model_class.from_pretrained(
-            self._args.model_path,
-            config=config,
+
+        model_kwargs = dict()
+        if issubclass(model_class, models.HierarchicalSpERT):
+            # one entity classifier per level of the entity type hierarchy
+            model_kwargs["entity_type_parents"] = input_reader.entity_type_parents
+
+        model_kwargs.update(
             # SpERT model parameters
-            cls_token=self._tokenizer.convert_tokens_to_ids("[CLS]"),
+            cls_token=tokenizer.convert_tokens_to_ids("[CLS]"),
             relation_types=input_reader.relation_type_count - 1,
             entity_types=input_reader.entity_type_count,
             max_pairs=self._args.max_pairs,
             prop_drop=self._args.prop_drop,
             size_embedding=self._args.size_embedding,
             freeze_transformer=self._args.freeze_transformer,
-            cache_dir=self._args.cache_path,
+            static_shapes=self._static_shapes,
+            window_size=self._args.window_size,
+            window_stride=self._args.window_stride,
+            window_pooling=self._args.window_pooling,
+            encoder_cache_size=self._args.encoder_cache_size,
         )
 
+        print(f"Loading model: {model_path}")
+        if bundle is not None:
+            model = bundle.load_model(model_class, **model_kwargs)
+        else:
+            model = model_class.from_pretrained(
+                model_path,
+                config=config,
+                cache_dir=self._args.cache_path,
+                **model_kwargs,
+            )
+        model.stage_timer = self._stage_timer
+
         return model
 
+    def _compile_model(self, model):
+        if self._args.compile:
+            # shapes are bucketed, so every bucket is compiled once and then reused
+            model.compile_inference(dynamic=False)
+
     def _train_epoch(
         self,
         model: torch.nn.Module,
@@ -239,59 +750,84 @@ class SpERTTrainer(BaseTrainer):
     ):
         self._logger.info("Train epoch: %s" % epoch)
 
-        # create data loader
-        dataset.switch_mode(Dataset.TRAIN_MODE)
-        data_loader = DataLoader(
+        # create data loader (once, the sampling processes are reused in later epochs)
+        sampler = None
+        if self._distributed:
+            # every rank trains on a different (shuffled) part of the dataset
+            sampler = DistributedSampler(dataset, shuffle=True, seed=self._args.seed or 0)
+
+        data_loader = self._data_loader(
             dataset,
+            Dataset.TRAIN_MODE,
             batch_size=self._args.train_batch_size,
-            shuffle=True,
+            shuffle=sampler is None,
+            sampler=sampler,
             drop_last=True,
-            num_workers=self._args.sampling_processes,
-            collate_fn=sampling.collate_fn_padding,
+            collate_fn=self._train_collate_fn,
         )
+        if self._distributed:
+            data_loader.sampler.set_epoch(epoch)
+
+        # soft labels of a teacher model (see 'distill') weight the entity loss by the type probabilities
+        soft_labels = dataset.soft_labels
 
         model.zero_grad()
 
         iteration = 0
-        total = dataset.document_count // self._args.train_batch_size
-        for batch in tqdm(data_loader, total=total, desc="Train epoch %s" % epoch):
-            model.train()
-            batch = util.to_device(batch, self._device)
-
-            # forward step
-            entity_logits, rel_logits = model(
-                encodings=batch["encodings"],
-                context_masks=batch["context_masks"],
-                entity_masks=batch["entity_masks"],
-                entity_sizes=batch["entity_sizes"],
-                relations=batch["rels"],
-                rel_masks=batch["rel_masks"],
-            )
+        total = len(data_loader)
+        timer = self._stage_timer
+        start = time.perf_counter()
+        with self._profiler() as profiler:
+            for batch in tqdm(
+                timer.iterate(data_loader), total=total, desc="Train epoch %s" % epoch
+            ):
+                if iteration == 0:
+                    self._log_data_loader(
+                        dataset.label, epoch, time.perf_counter() - start
+                    )
 
-            # compute loss and optimize parameters
-            batch_loss = compute_loss.compute(
-                entity_logits=entity_logits,
-                rel_logits=rel_logits,
-                rel_types=batch["rel_types"],
-                entity_types=batch["entity_types"],
-                entity_sample_masks=batch["entity_sample_masks"],
-                rel_sample_masks=batch["rel_sample_masks"],
-            )
+                model.train()
+                with timer.stage("to_device"):
+                    batch = util.to_device(batch, self._device)
 
-            # logging
-            iteration += 1
-            global_iteration = epoch * updates_epoch + iteration
+                # forward step
+                entity_logits, rel_logits = model(
+                    encodings=batch["encodings"],
+                    context_masks=batch["context_masks"],
+                    entity_masks=batch["entity_masks"],
+                    entity_sizes=batch["entity_sizes"],
+                    relations=batch["rels"],
+                    rel_masks=batch["rel_masks"],
+                )
 
-            if global_iteration % self._args.train_log_iter == 0:
-                self._log_train(
-                    optimizer,
-                    batch_loss,
-                    epoch,
-                    iteration,
-                    global_iteration,
-                    dataset.label,
+                # compute loss and optimize parameters
+                batch_loss = compute_loss.compute(
+                    entity_logits=entity_logits,
+                    rel_logits=rel_logits,
+                    rel_types=batch["rel_types"],
+                    entity_types=batch["entity_types"],
+                    entity_sample_masks=batch["entity_sample_masks"],
+                    rel_sample_masks=batch["rel_sample_masks"],
+                    weights=batch["weights"],
+                    entity_probas=batch["entity_probas"] if soft_labels else None,
                 )
 
+                # logging
+                iteration += 1
+                global_iteration = epoch * updates_epoch + iteration
+
+                if global_iteration % self._args.train_log_iter == 0:
+                    self._log_train(
+                        optimizer,
+                        batch_loss,
+                        epoch,
+                        iteration,
+                        global_iteration,
+                        dataset.label,
+                    )
+
+                profiler.step()
+
         return iteration
 
     def _eval(
@@ -302,52 +838,76 @@ class SpERTTrainer(BaseTrainer):
         epoch: int = 0,
         updates_epoch: int = 0,
         iteration: int = 0,
+        tokenizer: BertTokenizer = None,
     ):
         self._logger.info("Evaluate: %s" % dataset.label)
 
-        if isinstance(model, DataParallel):
-            # currently no multi GPU support during evaluation
-            model = model.module
+        # evaluation runs on the plain model, distributed evaluation is sharded by documents instead
+        model = util.unwrap_model(model)
+
+        sampler = None
+        documents = None
+        rank_suffix = ""
+        if self._distributed:
+            sampler = sampling.ShardSampler(dataset, self._world_size, self._rank)
+            all_documents = dataset.documents
+            documents = [all_documents[i] for i in sampler.indices]
+            rank_suffix = f"_rank_{self._rank}"
 
         # create evaluator
         predictions_path = os.path.join(
-            self._log_path, f"predictions_{dataset.label}_epoch_{epoch}.json"
+            self._log_path,
+            f"predictions_{dataset.label}_epoch_{epoch}{rank_suffix}.json",
         )
         examples_path = os.path.join(
-            self._log_path, f"examples_%s_{dataset.label}_epoch_{epoch}.html"
+            self._log_path,
+            f"examples_%s_{dataset.label}_epoch_{epoch}{rank_suffix}.html",
         )
         evaluator = Evaluator(
             dataset,
             input_reader,
-            self._tokenizer,
+            tokenizer or self._tokenizer,
             self._args.rel_filter_threshold,
             self._args.no_overlapping,
             predictions_path,
             examples_path,
             self._args.example_count,
+            documents=documents,
         )
 
-        # create data loader
-        dataset.switch_mode(Dataset.EVAL_MODE)
-        data_loader = DataLoader(
+        # create data loader (once, the sampling processes are reused in later evaluations)
+        data_loader = self._data_loader(
             dataset,
+            Dataset.EVAL_MODE,
             batch_size=self._args.eval_batch_size,
             shuffle=False,
+            sampler=sampler,
             drop_last=False,
-            num_workers=self._args.sampling_processes,
-            collate_fn=sampling.collate_fn_padding,
+            collate_fn=self._eval_collate_fn,
         )
 
-        with torch.no_grad():
+        timer = self._stage_timer
+        with torch.no_grad(), self._profiler() as profiler:
             model.eval()
 
             # iterate batches
-            total = math.ceil(dataset.document_count / self._args.eval_batch_size)
-            for batch in tqdm(
-                data_loader, total=total, desc="Evaluate epoch %s" % epoch
+            total = len(data_loader)
+            start = time.perf_counter()
+            for i, batch in enumerate(
+                tqdm(
+                    timer.iterate(data_loader),
+                    total=total,
+                    desc="Evaluate epoch %s" % epoch,
+                )
             ):
+                if i == 0:
+                    self._log_data_loader(
+                        dataset.label, epoch, time.perf_counter() - start
+                    )
+
                 # move batch to selected device
-                batch = util.to_device(batch, self._device)
+                with timer.stage("to_device"):
+                    batch = util.to_device(batch, self._device)
 
                 # run model (forward pass)
                 result = model(
@@ -362,10 +922,19 @@ class SpERTTrainer(BaseTrainer):
                 entity_clf, rel_clf, rels = result
 
                 # evaluate batch
-                evaluator.eval_batch(entity_clf, rel_clf, rels, batch)
+                with timer.stage("prediction_conversion"):
+                    evaluator.eval_batch(entity_clf, rel_clf, rels, batch)
+
+                profiler.step()
+
+        if self._static_shapes:
+            self._logger.info("Static inference shapes: %s" % model.static_shape_count)
+        self._log_encoder_cache(model)
 
         global_iteration = epoch * updates_epoch + iteration
-        ner_eval, rel_eval, rel_nec_eval = evaluator.compute_scores()
+        with timer.stage("evaluation"):
+            ner_eval, rel_eval, rel_nec_eval = evaluator.compute_scores()
+        scores = ner_eval, rel_eval, rel_nec_eval
         self._log_eval(
             *ner_eval,
             *rel_eval,
@@ -376,12 +945,33 @@ class SpERTTrainer(BaseTrainer):
             dataset.label,
         )
 
+        if isinstance(model, models.HierarchicalSpERT):
+            # coarser levels of the entity type hierarchy (predicted in the same forward pass)
+            for level in range(len(model.level_sizes) - 1):
+                level_label = "%s_level_%s" % (dataset.label, level)
+                if level_label not in self._log_paths:
+                    self._init_eval_logging(level_label)
+
+                type_map = input_reader.get_entity_type_level_map(level)
+                ner_eval, rel_eval, rel_nec_eval = evaluator.compute_scores(type_map)
+                self._log_eval(
+                    *ner_eval,
+                    *rel_eval,
+                    *rel_nec_eval,
+                    epoch,
+                    iteration,
+                    global_iteration,
+                    level_label,
+                )
+
         if self._args.store_predictions and not self._args.no_overlapping:
             evaluator.store_predictions()
 
         if self._args.store_examples:
             evaluator.store_examples()
 
+        return scores
+
     def _predict(
         self, model: torch.nn.Module, dataset: Dataset, input_reader: BaseInputReader
     ):
@@ -393,20 +983,24 @@ class SpERTTrainer(BaseTrainer):
             shuffle=False,
             drop_last=False,
             num_workers=self._args.sampling_processes,
-            collate_fn=sampling.collate_fn_padding,
+            collate_fn=self._eval_collate_fn,
         )
 
         pred_entities = []
         pred_relations = []
 
-        with torch.no_grad():
+        timer = self._stage_timer
+        with torch.no_grad(), self._profiler() as profiler:
             model.eval()
 
             # iterate batches
             total = math.ceil(dataset.document_count / self._args.eval_batch_size)
-            for batch in tqdm(data_loader, total=total, desc="Predict"):
+            for i, batch in enumerate(
+                tqdm(timer.iterate(data_loader), total=total, desc="Predict")
+            ):
                 # move batch to selected device
-                batch = util.to_device(batch, self._device)
+                with timer.stage("to_device"):
+                    batch = util.to_device(batch, self._device)
 
                 # run model (forward pass)
                 result = model(
@@ -421,19 +1015,27 @@ class SpERTTrainer(BaseTrainer):
                 entity_clf, rel_clf, rels = result
 
                 # convert predictions
-                predictions = prediction.convert_predictions(
-                    entity_clf,
-                    rel_clf,
-                    rels,
-                    batch,
-                    self._args.rel_filter_threshold,
-                    input_reader,
-                )
+                with timer.stage("prediction_conversion"):
+                    predictions = prediction.convert_predictions(
+                        entity_clf,
+                        rel_clf,
+                        rels,
+                        batch,
+                        self._args.rel_filter_threshold,
+                        input_reader,
+                    )
 
                 batch_pred_entities, batch_pred_relations = predictions
                 pred_entities.extend(batch_pred_entities)
                 pred_relations.extend(batch_pred_relations)
 
+                if i == 0:
+                    self._log_cold_start()
+
+                profiler.step()
+
+        self._log_encoder_cache(model)
+
         prediction.store_predictions(
             dataset.documents,
             pred_entities,
@@ -441,6 +1043,153 @@ class SpERTTrainer(BaseTrainer):
             self._args.predictions_path,
         )
 
+    def _share_dataset(self, dataset: Dataset):
+        # sampling processes map the dataset arrays instead of copying them
+        if self._args.sampling_processes > 0:
+            dataset.share(self._args.dataset_memory_path)
+
+    def _data_loader(self, dataset: Dataset, mode: str, **kwargs) -> DataLoader:
+        """Creates the data loader of a dataset and mode on first use. Its sampling processes persist across epochs
+        and keep the dataset mode they were started with"""
+        key = (dataset.label, mode)
+        dataset.switch_mode(mode)
+
+        if key not in self._data_loaders:
+            self._data_loaders[key] = DataLoader(
+                dataset,
+                num_workers=self._args.sampling_processes,
+                persistent_workers=self._args.sampling_processes > 0,
+                **kwargs,
+            )
+
+        return self._data_loaders[key]
+
+    def _log_data_loader(self, label: str, epoch: int, startup: float):
+        self._logger.info(
+            "Data loader startup (%s, epoch %s): %.3fs" % (label, epoch, startup)
+        )
+
+        # resident and unique memory of the sampling processes (of all persistent data loaders)
+        workers = [util.process_memory(pid) for pid in util.child_processes()]
+        workers = [memory for memory in workers if memory is not None]
+        if workers:
+            self._logger.info(
+                "Sampling processes: %s, RSS (MB): %s, unique (MB): %s"
+                % (
+                    len(workers),
+                    ", ".join("%.1f" % rss for rss, _ in workers),
+                    ", ".join("%.1f" % unique for _, unique in workers),
+                )
+            )
+
+    def _predict_stream(
+        self,
+        model: torch.nn.Module,
+        dataset: StreamingDataset,
+        input_reader: BaseInputReader,
+        predictions_path: str = None,
+    ):
+        # batches carry their documents (see 'sampling.collate_fn_streaming')
+        data_loader = DataLoader(
+            dataset,
+            batch_size=self._args.eval_batch_size,
+            drop_last=False,
+            num_workers=self._args.sampling_processes,
+            collate_fn=functools.partial(
+                sampling.collate_fn_streaming, collate_fn=self._eval_collate_fn
+            ),
+        )
+
+        timer = self._stage_timer
+        with torch.no_grad(), self._profiler() as profiler, prediction.PredictionWriter(
+            predictions_path or self._args.predictions_path
+        ) as writer:
+            model.eval()
+
+            for i, batch in enumerate(
+                tqdm(timer.iterate(data_loader), desc="Predict")
+            ):
+                documents = batch.pop("documents")
+
+                # move batch to selected device
+                with timer.stage("to_device"):
+                    batch = util.to_device(batch, self._device)
+
+                # run model (forward pass)
+                entity_clf, rel_clf, rels = model(
+                    encodings=batch["encodings"],
+                    context_masks=batch["context_masks"],
+                    entity_masks=batch["entity_masks"],
+                    entity_sizes=batch["entity_sizes"],
+                    entity_spans=batch["entity_spans"],
+                    entity_sample_masks=batch["entity_sample_masks"],
+                    inference=True,
+                )
+
+                # convert and write predictions of the batch
+                with timer.stage("prediction_conversion"):
+                    batch_pred_entities, batch_pred_relations = prediction.convert_predictions(
+                        entity_clf,
+                        rel_clf,
+                        rels,
+                        batch,
+                        self._args.rel_filter_threshold,
+                        input_reader,
+                    )
+                writer.write(documents, batch_pred_entities, batch_pred_relations)
+
+                if i == 0:
+                    self._log_cold_start()
+
+                profiler.step()
+
+        self._log_encoder_cache(model)
+
+    def _log_cold_start(self):
+        # runs of 'spert.py' are spawned processes, the command was started with their parent process
+        parent = multiprocessing.parent_process()
+        uptime = util.process_uptime(parent.pid if parent is not None else None)
+        if uptime is not None:
+            self._logger.info("First prediction %.2fs after process start" % uptime)
+
+    def _log_encoder_cache(self, model):
+        cache = util.unwrap_model(model).encoder_cache
+        if cache is not None:
+            self._logger.info(
+                "Encoder cache: hit rate %.2f (%s hits, %s misses), %s documents, %.1f MB"
+                % (cache.hit_rate, cache.hits, cache.misses, len(cache), cache.size_bytes / 2**20)
+            )
+
+    def _profiler(self):
+        # only the first data loader loop (and only its first 'profile_steps' steps) is traced
+        if not self._trace_pending:
+            return profiling.NO_TRACE
+        self._trace_pending = False
+
+        if hasattr(self._args, "log_path"):
+            trace_dir = self._log_path
+        else:
+            trace_dir = os.path.dirname(os.path.abspath(self._args.predictions_path))
+        trace_path = os.path.join(trace_dir, "profiler")
+        self._logger.info("Profiler trace: %s" % trace_path)
+
+        return profiling.trace(trace_path, self._args.profile_steps, self._device)
+
+    def _log_profile(self, label: str, epoch: int, global_iteration: int):
+        timer = self._stage_timer
+        if not timer.enabled:
+            return
+
+        self._logger.info(timer.summary("Profile (%s, epoch %s)" % (label, epoch)))
+        for stage, seconds, calls in timer.totals():
+            self._log_tensorboard(label, "profile/%s" % stage, seconds, global_iteration)
+            if "profile" in self._log_paths.get(label, dict()):
+                self._log_csv(
+                    label, "profile", stage, seconds, calls, epoch, global_iteration
+                )
+
+        timer.reset()
+
     def _get_optimizer_params(self, model):
         param_optimizer = list(model.named_parameters())
         no_decay = ["bias", "LayerNorm.bias", "LayerNorm.weight"]
@@ -620,10 +1369,11 @@ class SpERTTrainer(BaseTrainer):
                 "lr": ["lr", "epoch", "iteration", "global_iteration"],
                 "loss": ["loss", "epoch", "iteration", "global_iteration"],
                 "loss_avg": ["loss_avg", "epoch", "iteration", "global_iteration"],
+                **self._profile_logging(),
             },
         )
 
-    def _init_eval_logging(self, label):
+    def _init_eval_logging(self, label, profile: bool = False):
         self._add_dataset_logging(
             label,
             data={
@@ -649,6 +1399,13 @@ class SpERTTrainer(BaseTrainer):
                     "epoch",
                     "iteration",
                     "global_iteration",
-                ]
+                ],
+                **(self._profile_logging() if profile else dict()),
             },
         )
+
+    def _profile_logging(self):
+        # stage timings of every epoch (see '_log_profile')
+        if not self._stage_timer.enabled:
+            return dict()
+        return {"profile": ["stage", "seconds", "calls", "epoch", "global_iteration"]}
@@ -6,13 +6,14 @@ import sys
 from typing import List, Dict, Tuple
 
 import torch
-from torch.nn import DataParallel
 from torch.optim import Optimizer
 from transformers import PreTrainedModel
 from transformers import PreTrainedTokenizer
 
+from spert import opt
 from spert import util
-from spert.opt import tensorboardX
+from spert.checkpointing import CheckpointWriter
+from spert.metric_logger import MetricLogger
 
 SCRIPT_PATH = os.path.dirname(os.path.realpath(__file__))
 
@@ -24,13 +25,34 @@ class BaseTrainer:
         self._args = args
         self._debug = self._args.debug
 
+        # distributed data parallel (one process per device, started with `torchrun`)
+        self._distributed = getattr(args, "distributed", False)
+        if self._distributed:
+            self._rank, self._world_size, self._local_rank = util.init_distributed(
+                args.dist_backend
+            )
+        else:
+            self._rank, self._world_size, self._local_rank = 0, 1, 0
+        self._main_process = self._rank == 0
+
         run_key = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S.%f")
+        if self._distributed:
+            # all ranks share the run directories of the main process
+            run_key_list = [run_key]
+            torch.distributed.broadcast_object_list(run_key_list, src=0)
+            run_key = run_key_list[0]
 
         if hasattr(args, "save_path"):
             self._save_path = os.path.join(
                 self._args.save_path, self._args.label, run_key
             )
-            util.create_directories_dir(self._save_path)
+            if self._main_process:
+                util.create_directories_dir(self._save_path)
+
+            # checkpoints are written in the background (see '_save_model')
+            self._checkpoint_writer = CheckpointWriter(
+                keep_last=getattr(args, "keep_last_checkpoints", 0)
+            )
 
         # logging
         if hasattr(args, "log_path"):
@@ -48,9 +70,12 @@ class BaseTrainer:
             self._logger = logging.getLogger()
             util.reset_logger(self._logger)
 
-            file_handler = logging.FileHandler(os.path.join(self._log_path, "all.log"))
-            file_handler.setFormatter(log_formatter)
-            self._logger.addHandler(file_handler)
+            if self._main_process:
+                file_handler = logging.FileHandler(
+                    os.path.join(self._log_path, "all.log")
+                )
+                file_handler.setFormatter(log_formatter)
+                self._logger.addHandler(file_handler)
 
             console_handler = logging.StreamHandler(sys.stdout)
             console_handler.setFormatter(log_formatter)
@@ -58,17 +83,41 @@ class BaseTrainer:
 
             if self._debug:
                 self._logger.setLevel(logging.DEBUG)
-            else:
+            elif self._main_process:
                 self._logger.setLevel(logging.INFO)
+            else:
+                # other ranks only report warnings and errors
+                self._logger.setLevel(logging.WARNING)
 
             # tensorboard summary
             self._summary_writer = (
-                tensorboardX.SummaryWriter(self._log_path)
-                if tensorboardX is not None
+                opt.tensorboardX.SummaryWriter(self._log_path)
+                if self._main_process and opt.tensorboardX is not None
                 else None
             )
 
-            self._log_arguments()
+            if self._main_process:
+                self._log_arguments()
+        else:
+            # prediction has no log directory, only console logging
+            self._log_paths = dict()
+            self._summary_writer = None
+
+            self._logger = logging.getLogger()
+            util.reset_logger(self._logger)
+            console_handler = logging.StreamHandler(sys.stdout)
+            console_handler.setFormatter(
+                logging.Formatter("%(asctime)s [%(levelname)-5.5s]  %(message)s")
+            )
+            self._logger.addHandler(console_handler)
+            self._logger.setLevel(logging.DEBUG if self._debug else logging.INFO)
+
+        # buffered CSV/TensorBoard metrics (see '--log_flush_interval' and '--disable_metric_logging')
+        self._metric_logger = MetricLogger(
+            self._summary_writer,
+            flush_interval=getattr(args, "log_flush_interval", 30.0),
+            enabled=not getattr(args, "disable_metric_logging", False),
+        )
 
         self._best_results = dict()
 
@@ -78,6 +127,10 @@ class BaseTrainer:
         )
         self._gpu_count = torch.cuda.device_count()
 
+        if self._distributed and self._device.type == "cuda":
+            self._device = torch.device("cuda", self._local_rank)
+            torch.cuda.set_device(self._device)
+
         # set seed
         if args.seed is not None:
             util.set_seed(args.seed)
@@ -88,7 +141,8 @@ class BaseTrainer:
 
             for key, columns in data.items():
                 path = os.path.join(self._log_path, "%s_%s.csv" % (key, label))
-                util.create_csv(path, *columns)
+                if self._main_process:
+                    util.create_csv(path, *columns)
                 dic[key] = path
 
             self._log_paths[label] = dic
@@ -102,14 +156,16 @@ class BaseTrainer:
     def _log_tensorboard(
         self, dataset_label: str, data_label: str, data: object, iteration: int
     ):
-        if self._summary_writer is not None:
-            self._summary_writer.add_scalar(
-                "data/%s/%s" % (dataset_label, data_label), data, iteration
-            )
+        self._metric_logger.add_scalar(
+            "data/%s/%s" % (dataset_label, data_label), data, iteration
+        )
 
     def _log_csv(self, dataset_label: str, data_label: str, *data: Tuple[object]):
+        if not self._main_process:
+            return
+
         logs = self._log_paths[dataset_label]
-        util.append_csv(logs[data_label], *data)
+        self._metric_logger.append(logs[data_label], *data)
 
     def _save_best(
         self,
@@ -150,10 +206,11 @@ class BaseTrainer:
         include_iteration: int = True,
         name: str = "model",
     ):
-        extra_state = dict(iteration=iteration)
+        # in distributed training, all ranks hold the same weights and only the main process saves them
+        if not self._main_process:
+            return
 
-        if optimizer:
-            extra_state["optimizer"] = optimizer.state_dict()
+        extra_state = dict(iteration=iteration)
 
         if extra:
             extra_state.update(extra)
@@ -164,20 +221,20 @@ class BaseTrainer:
             dir_name = "%s_%s" % (name, iteration) if include_iteration else name
             dir_path = os.path.join(save_path, dir_name)
 
-        util.create_directories_dir(dir_path)
-
-        # save model
-        if isinstance(model, DataParallel):
-            model.module.save_pretrained(dir_path)
-        else:
-            model.save_pretrained(dir_path)
-
-        # save vocabulary
-        tokenizer.save_pretrained(dir_path)
+        # model (safetensors), vocabulary, optimizer and extra state are snapshot to CPU memory and written in a
+        # background thread, the last 'keep_last_checkpoints' iteration checkpoints are kept
+        self._checkpoint_writer.save(
+            dir_path,
+            util.unwrap_model(model),
+            tokenizer,
+            extra_state,
+            optimizer=optimizer,
+            group=name if include_iteration and not save_as_best else None,
+        )
 
-        # save extra
-        state_path = os.path.join(dir_path, "extra.state")
-        torch.save(extra_state, state_path)
+    def _close_checkpoint_writer(self):
+        # waits for the checkpoint in flight
+        self._checkpoint_writer.close()
 
     def _get_lr(self, optimizer):
         lrs = []
@@ -187,5 +244,10 @@ class BaseTrainer:
         return lrs
 
     def _close_summary_writer(self):
+        self._metric_logger.close()
         if self._summary_writer is not None:
             self._summary_writer.close()
+
+    def _close_distributed(self):
+        if self._distributed:
+            util.cleanup_distributed()
@@ -0,0 +1,69 @@
+import os
+import tempfile
+from collections import Counter
+from typing import Iterable, List
+
+import torch
+from torch import nn as nn
+from transformers import BertTokenizer
+
+from spert import util
+from spert.input_reader import encode_token
+
+
+def corpus_token_ids(tokenizer: BertTokenizer, corpus_paths: Iterable[str]) -> Counter:
+    """ Frequencies of the sub-word ids of the documents of the given corpora, encoded like 'JsonInputReader' """
+    counts = Counter()
+    for path in corpus_paths:
+        for document in util.iter_json_documents(path):
+            tokens = document['tokens'] if isinstance(document, dict) else document
+            for token_phrase in tokens:
+                counts.update(encode_token(token_phrase, tokenizer))
+    return counts
+
+
+def kept_token_ids(tokenizer: BertTokenizer, used_ids: Iterable[int], margin: int = 0) -> List[int]:
+    """ Ids (ascending) of the trimmed vocabulary: the used and special tokens, all single characters (with and
+    without '##' prefix, so unseen words are split into characters instead of becoming '[UNK]') and the first
+    'margin' other tokens (BERT's WordPiece vocabulary is roughly ordered by frequency) """
+    kept = set(used_ids) | set(tokenizer.all_special_ids) | set(tokenizer.get_added_vocab().values())
+
+    for token, index in tokenizer.vocab.items():
+        if len(token) == 1 or (token.startswith('##') and len(token) == 3):
+            kept.add(index)
+
+    # '[unused...]' placeholders are not part of the margin
+    remaining = [index for token, index in sorted(tokenizer.vocab.items(), key=lambda item: item[1])
+                 if index not in kept and not token.startswith('[unused')]
+    kept.update(remaining[:margin])
+
+    return sorted(kept)
+
+
+def trim_vocabulary(model: nn.Module, tokenizer: BertTokenizer, kept_ids: List[int]) -> BertTokenizer:
+    """ Restricts the word embeddings of 'model' (in place) and the tokenizer to 'kept_ids'. Words that are
+    encoded with kept sub-words only are encoded identically, as WordPiece selects the longest matching sub-word
+    and a subset of the vocabulary contains no longer match. Returns the trimmed tokenizer """
+    id_to_token = {index: token for token, index in tokenizer.vocab.items()}
+
+    with tempfile.TemporaryDirectory() as vocab_dir:
+        vocab_path = os.path.join(vocab_dir, 'vocab.txt')
+        with open(vocab_path, 'w', encoding='utf-8') as f:
+            f.write(''.join(id_to_token[index] + '\n' for index in kept_ids))
+
+        trimmed_tokenizer = BertTokenizer(vocab_path, do_lower_case=tokenizer.do_lower_case)
+
+    embeddings = model.bert.embeddings.word_embeddings
+    pad_index = trimmed_tokenizer.convert_tokens_to_ids('[PAD]')
+    trimmed = nn.Embedding(len(kept_ids), embeddings.embedding_dim, padding_idx=pad_index,
+                           device=embeddings.weight.device, dtype=embeddings.weight.dtype)
+    with torch.no_grad():
+        trimmed.weight.copy_(embeddings.weight[torch.tensor(kept_ids, device=embeddings.weight.device)])
+    trimmed.weight.requires_grad = embeddings.weight.requires_grad
+    model.bert.embeddings.word_embeddings = trimmed
+
+    model.config.vocab_size = len(kept_ids)
+    model.config.pad_token_id = pad_index
+    model._cls_token = trimmed_tokenizer.convert_tokens_to_ids('[CLS]')
+
+    return trimmed_tokenizer
@@ -1,5 +1,6 @@
 import csv
 import json
+import math
 import os
 import random
 import shutil
@@ -8,7 +9,8 @@ from pathlib import Path
 import numpy as np
 import torch
 
-from spert.entities import TokenSpan
+from spert import checkpointing
+from spert import entities
 
 CSV_DELIMETER = ";"
 
@@ -56,6 +58,22 @@ def append_csv(file_path, *row):
         writer.writerow(row)
 
 
+def is_json_lines(file_path):
+    return file_path.endswith((".jsonl", ".ndjson"))
+
+
+def iter_json_documents(file_path):
+    """Iterates the documents of a JSON (list) or JSON lines ('.jsonl', '.ndjson', one document per line) file.
+    JSON lines are parsed lazily, so memory does not depend on the file size"""
+    with open(file_path, "r") as f:
+        if is_json_lines(file_path):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from json.load(f)
+
+
 def append_csv_multiple(file_path, *rows):
     if not os.path.exists(file_path):
         raise Exception("The given file doesn't exist")
@@ -170,59 +188,213 @@ def extend_tensor(tensor, extended_shape, fill=0):
     return extended_tensor
 
 
-def padded_stack(tensors, padding=0):
+def max_shape(tensors):
     dim_count = len(tensors[0].shape)
+    return [max([t.shape[d] for t in tensors]) for d in range(dim_count)]
+
+
+def padded_stack(tensors, padding=0, out=None):
+    """Stacks the tensors padded to the maximum size of every dimension. Every tensor is copied once into its slice of
+    a single preallocated tensor ('out' if given, which must be filled with 'padding')"""
+    if out is None:
+        out = torch.full(
+            [len(tensors)] + max_shape(tensors),
+            padding,
+            dtype=tensors[0].dtype,
+            device=tensors[0].device,
+        )
+
+    for i, t in enumerate(tensors):
+        out[i][tuple(slice(0, size) for size in t.shape)] = t
+
+    return out
+
+
+class PaddedBatch(dict):
+    """Batch whose tensors are views of one contiguous, zero initialized buffer (in pinned memory if 'pin_memory').
+    'to_device' moves the whole batch to the device in a single (asynchronous) copy"""
+
+    def __init__(self, shapes: dict, pin_memory: bool = False):
+        # shapes: key -> (shape, dtype), tensors start at 8 byte aligned offsets of the buffer
+        super().__init__()
+        self.layout = dict()
+
+        size = 0
+        for key, (shape, dtype) in shapes.items():
+            self.layout[key] = (list(shape), dtype, size)
+            nbytes = math.prod(shape) * torch.empty([], dtype=dtype).element_size()
+            size += -(-nbytes // 8) * 8
 
-    max_shape = [max([t.shape[d] for t in tensors]) for d in range(dim_count)]
-    padded_tensors = []
+        self.buffer = torch.zeros(size, dtype=torch.uint8, pin_memory=pin_memory)
+        self.update(self.views(self.buffer))
 
-    for t in tensors:
-        e = extend_tensor(t, max_shape, fill=padding)
-        padded_tensors.append(e)
+        # seconds spent collating the batch (see 'profiling.StageTimer')
+        self.collate_time = 0.0
 
-    stacked = torch.stack(padded_tensors)
-    return stacked
+    def views(self, buffer):
+        views = dict()
+        for key, (shape, dtype, offset) in self.layout.items():
+            nbytes = math.prod(shape) * torch.empty([], dtype=dtype).element_size()
+            views[key] = buffer[offset : offset + nbytes].view(dtype).view(shape)
+        return views
+
+
+def bucket_size(size, minimum=1):
+    """Round 'size' up to the next power of two (at least 'minimum')"""
+    bucket = minimum
+    while bucket < size:
+        bucket *= 2
+
+    return bucket
 
 
 def batch_index(tensor, index, pad=False):
+    """Indexes every batch element of 'tensor' with the corresponding element of 'index', i.e.
+    'tensor[i][index[i]]' for every 'i', as a single gather"""
     if tensor.shape[0] != index.shape[0]:
         raise Exception()
 
-    if not pad:
-        return torch.stack([tensor[i][index[i]] for i in range(index.shape[0])])
-    else:
-        return padded_stack([tensor[i][index[i]] for i in range(index.shape[0])])
+    if index.dtype == torch.bool:
+        # boolean masks select a different number of elements per batch element
+        selected = [tensor[i][index[i]] for i in range(index.shape[0])]
+        return padded_stack(selected) if pad else torch.stack(selected)
+
+    # the batch offsets broadcast over the index dimensions
+    batch = torch.arange(index.shape[0], device=index.device)
+    batch = batch.view([-1] + [1] * (index.dim() - 1))
+    return tensor[batch, index]
 
 
 def padded_nonzero(tensor, padding=0):
-    indices = padded_stack(
-        [tensor[i].nonzero().view(-1) for i in range(tensor.shape[0])], padding
-    )
-    return indices
+    """Indices of the nonzero elements of every row of a 2D tensor (ascending), padded with 'padding'"""
+    nonzero = tensor != 0
+    counts = nonzero.sum(dim=-1)
+    max_count = int(counts.max()) if counts.numel() else 0
+
+    # a stable sort moves the nonzero elements to the front and keeps their order
+    _, indices = torch.sort((~nonzero).int(), dim=-1, stable=True)
+    indices = indices[:, :max_count]
+
+    positions = torch.arange(max_count, device=tensor.device)
+    return indices.masked_fill(positions >= counts.unsqueeze(-1), padding)
 
 
 def swap(v1, v2):
     return v2, v1
 
 
-def get_span_tokens(tokens, span):
-    inside = False
-    span_tokens = []
+def get_span_tokens(tokens: "entities.TokenSpan", span):
+    start = None
 
-    for t in tokens:
+    for i, t in enumerate(tokens):
         if t.span[0] == span[0]:
-            inside = True
-
-        if inside:
-            span_tokens.append(t)
+            start = i
 
-        if inside and t.span[1] == span[1]:
-            return TokenSpan(span_tokens)
+        if start is not None and t.span[1] == span[1]:
+            return tokens[start:i + 1]
 
     return None
 
 
+def process_memory(pid=None):
+    """Resident (RSS) and unique (not shared with other processes) memory of a process in MB, None if not available
+    (Linux only)"""
+    try:
+        with open(f"/proc/{pid or 'self'}/smaps_rollup", "r") as f:
+            fields = {
+                parts[0][:-1]: int(parts[1])
+                for parts in (line.split() for line in f)
+                if parts[0].endswith(":")
+            }
+    except OSError:
+        return None
+
+    rss = fields.get("Rss", 0) / 1024
+    unique = (fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)) / 1024
+    return rss, unique
+
+
+def process_uptime(pid=None):
+    """Seconds since the start of a process, None if not available (Linux only)"""
+    try:
+        with open(f"/proc/{pid or 'self'}/stat", "r") as f:
+            stat = f.read()
+        with open("/proc/uptime", "r") as f:
+            uptime = float(f.read().split()[0])
+    except OSError:
+        return None
+
+    # start time (in clock ticks since boot) is the 20th field after the command name
+    start = int(stat.rsplit(")", 1)[1].split()[19])
+    return uptime - start / os.sysconf("SC_CLK_TCK")
+
+
+def child_processes():
+    """Process ids of the child processes (e.g. data loader workers) of this process (Linux only)"""
+    if not os.path.isdir("/proc"):
+        return []
+
+    pid = os.getpid()
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # the parent id follows the state, after the (possibly space containing) command name
+        if int(stat.rsplit(")", 1)[1].split()[1]) == pid:
+            children.append(int(entry))
+    return children
+
+
+def init_distributed(backend=None):
+    """Initializes the default process group from the environment variables set by `torchrun`"""
+    if backend is None:
+        backend = "nccl" if torch.cuda.is_available() else "gloo"
+
+    torch.distributed.init_process_group(backend=backend)
+    local_rank = int(os.environ.get("LOCAL_RANK", 0))
+
+    return torch.distributed.get_rank(), torch.distributed.get_world_size(), local_rank
+
+
+def cleanup_distributed():
+    if is_distributed():
+        torch.distributed.destroy_process_group()
+
+
+def is_distributed():
+    return torch.distributed.is_available() and torch.distributed.is_initialized()
+
+
+def is_main_process():
+    return not is_distributed() or torch.distributed.get_rank() == 0
+
+
+def unwrap_model(model):
+    """Returns the model wrapped by (Distributed)DataParallel"""
+    if isinstance(
+        model,
+        (torch.nn.DataParallel, torch.nn.parallel.DistributedDataParallel),
+    ):
+        return model.module
+
+    return model
+
+
 def to_device(batch, device):
+    if isinstance(batch, PaddedBatch) and device.type != "cpu":
+        # single copy of the batch buffer, asynchronous from pinned memory
+        buffer = batch.buffer if batch.buffer.is_pinned() else batch.buffer.pin_memory()
+        converted_batch = batch.views(buffer.to(device, non_blocking=True))
+        for key in batch.keys() - converted_batch.keys():
+            converted_batch[key] = batch[key].to(device)
+
+        return converted_batch
+
     converted_batch = dict()
     for key in batch.keys():
         converted_batch[key] = batch[key].to(device)
@@ -232,18 +404,14 @@ def to_device(batch, device):
 
 def check_version(config, model_class, model_path):
     if os.path.exists(model_path):
-        model_path = (
-            model_path
-            if model_path.endswith(".bin")
-            else os.path.join(model_path, "pytorch_model.bin")
-        )
-        state_dict = torch.load(model_path, map_location=torch.device("cpu"))
+        # only the parameter names are read, the weights are loaded once by 'from_pretrained'
+        keys = checkpointing.state_dict_keys(model_path)
         config_dict = config.to_dict()
 
         # version check
         loaded_version = config_dict.get("spert_version", "1.0")
         if (
-            "rel_classifier.weight" in state_dict
+            "rel_classifier.weight" in keys
             and loaded_version != model_class.VERSION
         ):
             msg = (